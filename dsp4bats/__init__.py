@@ -5,22 +5,87 @@
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
 # Makes it possible to "import dsp4bats" only to get access to all classes.
+# Submodules are imported on first access, for example "dsp4bats.SignalUtil",
+# to keep startup fast. numpy, scipy, pandas etc. are only loaded when the 
+# feature that needs them is used.
+
+import importlib
 
 __version__ = '0.1.2'
 
-from .wave_file_utils import WaveFileReader
-from .wave_file_utils import WaveFileWriter
-from .wave_file_utils import WurbFileUtils
-
-from .time_domain_utils import SignalUtil
- 
-from .frequency_domain_utils import DbfsSpectrumUtil
- 
-from .sound_stream_manager import SoundSourceBase
-from .sound_stream_manager import SoundProcessBase
-from .sound_stream_manager import SoundTargetBase
-from .sound_stream_manager import SoundStreamManager
- 
-# from .batfiles_scanner import BatfilesScanner
-
-from .librosa_utils import *
+# Name: submodule.
+_lazy_attributes = {
+    'WaveFileReader': 'wave_file_utils',
+    'WaveFileWriter': 'wave_file_utils',
+    'AsyncWaveFileWriter': 'wave_file_utils',
+    'WurbFileUtils': 'wave_file_utils',
+    #
+    'SignalUtil': 'time_domain_utils',
+    #
+    'FftBackend': 'fft_utils',
+    'get_fft_backend': 'fft_utils',
+    'set_fft_backend': 'fft_utils',
+    #
+    'DbfsSpectrumUtil': 'frequency_domain_utils',
+    'SpectrumCache': 'frequency_domain_utils',
+    'StreamingSpectrogram': 'frequency_domain_utils',
+    'ChirpFrequencyTracker': 'frequency_domain_utils',
+    #
+    'SpectrogramTilePyramid': 'spectrogram_tiles',
+    #
+    'ZeroCrossingUtil': 'zero_crossing_utils',
+    #
+    'NoiseFloorTracker': 'noise_floor_utils',
+    #
+    'MatchedFilterDetector': 'matched_filter_utils',
+    #
+    'Int16ActivityDetector': 'fixed_point_utils',
+    #
+    'SoundSourceBase': 'sound_stream_manager',
+    'SoundProcessBase': 'sound_stream_manager',
+    'SoundTargetBase': 'sound_stream_manager',
+    'SoundStreamManager': 'sound_stream_manager',
+    'DirectoryWatcherSource': 'directory_watcher',
+    'MetricsScanProcess': 'directory_watcher',
+    'ScanResultTarget': 'directory_watcher',
+    'FileLeaseQueue': 'work_queue',
+    #
+    'BatfilesScanner': 'batfiles_scanner',
+    'MetricsPlotRenderer': 'plot_utils',
+    #
+    'ChirpSnippetArchive': 'chirp_archive',
+    #
+    'ActivityAggregate': 'activity_aggregation',
+    #
+    'librosa_frame': 'librosa_utils',
+    'librosa_rms': 'librosa_utils',
+    'librosa_localmax': 'librosa_utils',
+    'librosa_frames_to_samples': 'librosa_utils',
+    }
+
+__all__ = list(_lazy_attributes)
+
+def __getattr__(name):
+    """ Imports the submodule when an attribute is used the first time. """
+    module_name = _lazy_attributes.get(name)
+    if module_name is None:
+        raise AttributeError("module 'dsp4bats' has no attribute '" + name + "'")
+    module = importlib.import_module('.' + module_name, __name__)
+    value = getattr(module, name)
+    globals()[name] = value # Next access is a normal lookup.
+    return value
+
+def __dir__():
+    """ """
+    return sorted(list(globals()) + __all__)
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    from dsp4bats import cli
+    # Raises UserWarning if scipy, pandas or matplotlib are loaded, or if too slow.
+    report = cli.check_startup()
+    print('Startup time (s): ', report['time_s'], '  budget (s): ', report['budget_s'])
+    print('Test ended.')
@@ -0,0 +1,13 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+# Makes it possible to run "python -m dsp4bats scan ...".
+
+import sys
+
+from dsp4bats import cli
+
+sys.exit(cli.main())
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import json
+import pathlib
+import numpy as np
+
+# Fixed bins. Aggregates are only mergeable if bins are the same, so the
+# bin version is stored with each aggregate.
+BINS_VERSION = 1
+MINUTES_PER_DAY = 1440
+FREQ_BIN_KHZ = 1.0 # Peak frequency histogram.
+FREQ_BINS = 250
+BAND_KHZ = 5.0 # Peak frequency bands, for activity per minute and band.
+BANDS = 50
+INTERVAL_BIN_MS = 5.0
+INTERVAL_BINS = 200
+DURATION_BIN_MS = 0.25
+DURATION_BINS = 200
+DBFS_BIN_DB = 1.0
+DBFS_MIN = -120.0
+DBFS_BINS = 120
+
+class ActivityAggregate():
+    """ Compact, mergeable summary of detected chirps. Histograms have fixed
+        bins, and the last bin in each is used for values above the range.
+        Aggregates are added per file during scanning and saved as
+        "*_Activity.npz". Summaries for a night, a week or a season are then
+        sums of the saved aggregates, see merge_aggregates.
+
+        Counters: files, files_with_chirps, chirps, checked_peaks and audio_s.
+        Activity per minute uses the local time in WURB file names. Chirps in
+        files without a time are counted, but not in the minute histograms.
+    """
+    def __init__(self):
+        """ """
+        self.counters = {'files': 0, 'files_with_chirps': 0, 'chirps': 0,
+                         'checked_peaks': 0, 'audio_s': 0.0}
+        self.detectors = {} # Detector id: Chirps. Also detectors without chirps.
+        self.dates = {} # Recording start date, 'YYYY-MM-DD': Chirps.
+        self.histograms = {
+            'minute': np.zeros(MINUTES_PER_DAY, dtype=np.int64),
+            'minute_band': np.zeros((MINUTES_PER_DAY, BANDS), dtype=np.int64),
+            'peak_freq': np.zeros(FREQ_BINS, dtype=np.int64),
+            'interval': np.zeros(INTERVAL_BINS, dtype=np.int64),
+            'duration': np.zeros(DURATION_BINS, dtype=np.int64),
+            'peak_dbfs': np.zeros(DBFS_BINS, dtype=np.int64),
+            }
+
+    def add_chirps(self, metrics, sampling_freq=384000, start_datetime=None,
+                   detector_id='', audio_s=0.0, checked_peaks=0):
+        """ Adds the chirps from one file. metrics is a dict with one array per
+            column, as from plot_utils.read_metrics_file. start_datetime is the
+            recording start, or None. """
+        peak_s = np.asarray(metrics['peak_signal_index'], dtype=np.float64) / sampling_freq
+        chirps = len(peak_s)
+        self.counters['files'] += 1
+        self.counters['files_with_chirps'] += 1 if chirps > 0 else 0
+        self.counters['chirps'] += chirps
+        self.counters['checked_peaks'] += int(checked_peaks)
+        self.counters['audio_s'] += float(audio_s)
+        detector_id = str(detector_id)
+        self.detectors[detector_id] = self.detectors.get(detector_id, 0) + chirps
+        if chirps == 0:
+            return
+        #
+        peak_freq_khz = np.asarray(metrics['peak_freq_khz'], dtype=np.float64)
+        self._add(self.histograms['peak_freq'], peak_freq_khz / FREQ_BIN_KHZ)
+        self._add(self.histograms['duration'], np.asarray(metrics['duration_ms']) / DURATION_BIN_MS)
+        self._add(self.histograms['peak_dbfs'], (np.asarray(metrics['peak_dbfs']) - DBFS_MIN) / DBFS_BIN_DB)
+        # Intervals inside the file. The first chirp has no interval.
+        self._add(self.histograms['interval'], np.diff(np.sort(peak_s)) * 1000 / INTERVAL_BIN_MS)
+        #
+        if start_datetime:
+            date_str = start_datetime.strftime('%Y-%m-%d')
+            self.dates[date_str] = self.dates.get(date_str, 0) + chirps
+            start_minute = start_datetime.hour * 60 + start_datetime.minute + start_datetime.second / 60
+            minute = np.floor(start_minute + peak_s / 60).astype(np.int64) % MINUTES_PER_DAY
+            band = np.clip((peak_freq_khz / BAND_KHZ).astype(np.int64), 0, BANDS - 1)
+            np.add.at(self.histograms['minute'], minute, 1)
+            np.add.at(self.histograms['minute_band'], (minute, band), 1)
+
+    def _add(self, histogram, bin_values):
+        """ Values below 0 go to the first bin and above range to the last. """
+        if len(bin_values) == 0:
+            return
+        bins = np.clip(np.floor(bin_values), 0, len(histogram) - 1).astype(np.int64)
+        histogram += np.bincount(bins, minlength=len(histogram))
+
+    def merge(self, other):
+        """ Adds another aggregate to this one. Returns self. """
+        for key, value in other.counters.items():
+            self.counters[key] += value
+        for key, value in other.detectors.items():
+            self.detectors[key] = self.detectors.get(key, 0) + value
+        for key, value in other.dates.items():
+            self.dates[key] = self.dates.get(key, 0) + value
+        for key in self.histograms:
+            self.histograms[key] += other.histograms[key]
+        return self
+
+    def get_bin_edges(self, histogram):
+        """ Lower bin edges for a histogram, in its unit. """
+        bins = len(self.histograms[histogram])
+        if histogram == 'minute':
+            return np.arange(bins)
+        step, start = {'peak_freq': (FREQ_BIN_KHZ, 0.0),
+                       'interval': (INTERVAL_BIN_MS, 0.0),
+                       'duration': (DURATION_BIN_MS, 0.0),
+                       'peak_dbfs': (DBFS_BIN_DB, DBFS_MIN)}[histogram]
+        return start + np.arange(bins) * step
+
+    def save(self, file_path):
+        """ Saves as a compressed numpy file. Mostly empty histograms are small. """
+        meta = {'bins_version': BINS_VERSION, 'counters': self.counters,
+                'detectors': self.detectors, 'dates': self.dates}
+        np.savez_compressed(str(file_path), meta=np.array(json.dumps(meta)), **self.histograms)
+
+    @classmethod
+    def load(cls, file_path):
+        """ """
+        aggregate = cls()
+        with np.load(str(file_path)) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['bins_version'] != BINS_VERSION:
+                raise UserWarning('Activity aggregate with other bins: ' + str(file_path))
+            for key in aggregate.histograms:
+                aggregate.histograms[key] = data[key].astype(np.int64)
+        aggregate.counters.update(meta['counters'])
+        aggregate.detectors = meta['detectors']
+        aggregate.dates = meta['dates']
+        return aggregate
+
+def merge_aggregates(aggregates):
+    """ Sum of aggregates, or of "*_Activity.npz" files. """
+    result = ActivityAggregate()
+    for aggregate in aggregates:
+        if not isinstance(aggregate, ActivityAggregate):
+            aggregate = ActivityAggregate.load(aggregate)
+        result.merge(aggregate)
+    return result
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import tempfile
+    import datetime
+    from dsp4bats import plot_utils
+    print('Test started.')
+    results_dir = pathlib.Path(__file__).parent.parent / 'data' / 'batfiles_results'
+    start_datetime = datetime.datetime(2017, 6, 11, 23, 58)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        partial_files = []
+        for metrics_path in sorted(results_dir.glob('*_Metrics.txt')):
+            aggregate = ActivityAggregate()
+            aggregate.add_chirps(plot_utils.read_metrics_file(metrics_path),
+                                 start_datetime=start_datetime, detector_id='wurb1')
+            partial_path = pathlib.Path(temp_dir, metrics_path.name.replace('_Metrics.txt', '_Activity.npz'))
+            aggregate.save(partial_path)
+            partial_files.append(partial_path)
+            print(partial_path.name, '  bytes: ', partial_path.stat().st_size)
+        night = merge_aggregates(partial_files)
+    print('Counters: ', night.counters)
+    print('Detectors: ', night.detectors, '  dates: ', night.dates)
+    print('Active minutes: ', np.flatnonzero(night.histograms['minute']))
+    peak_freq = night.histograms['peak_freq']
+    print('Most common peak freq (kHz): ', night.get_bin_edges('peak_freq')[peak_freq.argmax()])
+    print('Test ended.')
@@ -1,462 +1,1071 @@
-# #!/usr/bin/python3
-# # -*- coding:utf-8 -*-
-# # Project: http://cloudedbats.org
-# # Copyright (c) 2017-2018 Arnold Andreasson 
-# # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
-# 
-# import pathlib
-# import datetime
-# import numpy as np
-# import pandas as pd
-# #
-# folium_installed = True
-# try:
-#     import folium # For maps.
-# except:
-#     folium_installed = False
-# 
-# ##import matplotlib
-# ##matplotlib.use('Agg')
-# import matplotlib.pyplot as plt
-# 
-# import dsp4bats
-# 
-# class BatfilesScanner():
-#     """ """
-#     def __init__(self,
-#                  batfiles_dir='batfiles',
-#                  scanning_results_dir='batfiles_results',
-#                  sampling_freq=384000, 
-#                  debug=False,
-#                  ):
-#         """ """
-#         self.batfiles_dir = batfiles_dir
-#         self.scanning_results_dir = scanning_results_dir
-#         self.sampling_freq = sampling_freq        
-#         self.debug = debug
-#         #
-#         self.file_utils = dsp4bats.WurbFileUtils()
-#         self.files_df = None 
-# 
-#     def create_list_of_files(self):
-#         """ """
-#         # Exists directory for results? Create if not.
-#         if not pathlib.Path(self.scanning_results_dir).exists():
-#             pathlib.Path(self.scanning_results_dir).mkdir(parents=True)
-#         # Read files to dataframe.
-#         self.file_utils.find_sound_files(dir_path=self.batfiles_dir, 
-#                                          recursive=False, 
-#                                          wurb_files_only=False)
-#         self.files_df = self.file_utils.get_dataframe()
-#         if self.debug:
-#             print('Number of wave files found: ', len(self.files_df))
-#     
-#     def scan_files(self, 
-#                 # Time domain parameters.
-#                 time_filter_low_limit_hz=15000,
-#                 time_filter_high_limit_hz=None,
-#                 localmax_noise_threshold_factor=1.2, 
-#                 localmax_jump_factor=1000, 
-#                 localmax_frame_length=1024, 
-#                 # Frequency domain parameters.
-#                 freq_window_size=128, 
-#                 freq_filter_low_hz=15000, 
-#                 freq_threshold_below_peak_db=40.0, 
-#                 freq_threshold_dbfs =-50.0, 
-#                 freq_jump_factor=4000, 
-#                 freq_max_frames_to_check=200, 
-#                 freq_max_silent_slots=8, 
-#                 ):
-#         """ """
-#         # Exists directory for results? Create if not.
-#         if not pathlib.Path(self.scanning_results_dir).exists():
-#             pathlib.Path(self.scanning_results_dir).mkdir(parents=True)
-#         # Read files to dataframe.
-#         self.file_utils.find_sound_files(dir_path=self.batfiles_dir, 
-#                                          recursive=False, 
-#                                          wurb_files_only=False)
-#         self.files_df = self.file_utils.get_dataframe()
-#         if self.debug:
-#             print('Number of wave files found: ', len(self.files_df))
-#         
-#         for file_path in self.files_df.abs_file_path:
-#             #
-#             if self.debug:
-#                 print('\n', 'Scanning file: ', file_path)
-#             # Read signal from file. Length 1 sec.
-#             wave_reader = dsp4bats.WaveFileReader(file_path)
-#             # samp_width = wave_reader.samp_width
-#             sampling_freq = wave_reader.sampling_freq
-#             if sampling_freq != self.sampling_freq:
-#                 if self.debug:
-#                     print('\n', 'Error: Wrong sampling frequency in file: ', sampling_freq,
-#                           '   Expected: ', self.sampling_freq, '\n')
-#                     continue
-#             # Create dsp4bats utils.
-#             signal_util = dsp4bats.SignalUtil(sampling_freq)
-#             spectrum_util = dsp4bats.DbfsSpectrumUtil(window_size=freq_window_size,
-#                                                       window_function='kaiser',
-#                                                       kaiser_beta=14,
-#                                                       sampling_freq=sampling_freq)
-#             # Prepare output file for metrics. Create on demand.
-#             metrics_file_name = pathlib.Path(file_path).stem + '_Metrics.txt'
-#             out_header = spectrum_util.chirp_metrics_header()
-#             out_file = None
-#             # Read file.
-#             checked_peaks_counter = 0
-#             found_peak_counter = 0
-#             acc_checked_peaks_counter = 0
-#             acc_found_peak_counter = 0
-#             buffer_number = 0
-#             # Read buffer, 1 sec.
-#             signal_1sec = wave_reader.read_buffer()
-#             
-#             # Iterate over buffers.
-#             while len(signal_1sec) > 0:
-#                 # Get noise level for 1 sec buffer.
-#                 raw_noise_level = signal_util.noise_level(signal_1sec)
-#                 raw_noise_level_db = signal_util.noise_level_in_db(signal_1sec)
-#                 #
-#                 signal_1sec = signal_util.butterworth_filter(signal_1sec, 
-#                                                              low_freq_hz=time_filter_low_limit_hz,
-#                                                              high_freq_hz=time_filter_high_limit_hz)
-#                 # Get noise level for 1 sec buffer after filtering.
-#                 noise_level = signal_util.noise_level(signal_1sec)
-#                 noise_level_db = signal_util.noise_level_in_db(signal_1sec)
-#                 if self.debug:
-#                     print('Noise level (before filter):', np.round(noise_level, 5), 
-#                           '(', np.round(raw_noise_level, 5), ')', 
-#                           ' Noise (db):', np.round(noise_level_db, 2), 
-#                           '(', np.round(raw_noise_level_db, 5), ')'
-#                           )
-#                 # Find peaks in time domain.
-#                 peaks = signal_util.find_localmax(signal=signal_1sec,
-#                                                   noise_threshold=noise_level * localmax_noise_threshold_factor, 
-#                                                   jump=int(sampling_freq/localmax_jump_factor), 
-#                                                   frame_length=localmax_frame_length) # Window size.
-#     
-#                 checked_peaks_counter = len(peaks)
-#                 acc_checked_peaks_counter += len(peaks)
-#                 found_peak_counter = 0
-#                 
-#                 for peak_position in peaks:
-#         
-#                     # Extract metrics.
-#                     result = spectrum_util.chirp_metrics(
-#                                                 signal=signal_1sec, 
-#                                                 peak_position=peak_position, 
-#                                                 jump_factor=freq_jump_factor, 
-#                                                 high_pass_filter_freq_hz=freq_filter_low_hz, 
-#                                                 threshold_dbfs = freq_threshold_dbfs, 
-#                                                 threshold_dbfs_below_peak = freq_threshold_below_peak_db, 
-#                                                 max_frames_to_check=freq_max_frames_to_check, 
-#                                                 max_silent_slots=freq_max_silent_slots, 
-#                                                 debug=False)
-#     
-#                     if result is False:
-#                         continue # 
-#                     else:
-#                         result_dict = dict(zip(out_header, result))
-#                         ## out_row = [result_dict.get(x, '') for x in out_header]
-#                         # Add buffer steps to peak_signal_index, start_signal_index and end_signal_index.
-#                         out_row = []
-#                         for key in out_header:
-#                             if '_signal_index' in key:
-#                                 # Adjust index if more than one buffer was read.
-#                                 index = int(result_dict.get(key, 0))
-#                                 index += buffer_number * signal_util.sampling_freq
-#                                 out_row.append(index)
-#                             else:
-#                                 out_row.append(result_dict.get(key, ''))
-#                         # Write to file.
-#                         if out_file is None:
-#                             out_file = pathlib.Path(self.scanning_results_dir, metrics_file_name).open('w')
-#                             out_file.write('\t'.join(map(str, out_header)) + '\n')# Read until end of file.
-#                         #
-#                         out_file.write('\t'.join(map(str, out_row)) + '\n')
-#                         #
-#                         found_peak_counter += 1
-#                         acc_found_peak_counter += 1
-# 
-#                 if self.debug:
-#                     print('Buffer: Detected peak counter: ', str(found_peak_counter),
-#                           '  of ', checked_peaks_counter, ' checked peaks.') 
-#                 #
-#                 buffer_number += 1
-#                 # Read next buffer.
-#                 signal_1sec = wave_reader.read_buffer()
-#                 
-#             # Done.
-#             if self.debug:
-#                 print('Summary: Detected peak counter: ', str(acc_found_peak_counter),
-#                       '  of ', acc_checked_peaks_counter, ' checked peaks.') 
-#             wave_reader.close()
-#             if out_file is None:
-#                 print('\n', 'Warning: No detected peaks found. No metrics produced.', '\n') 
-#             else: 
-#                 out_file.close()
-#     
-#     def plot_results(self, 
-#                      figsize_width=16, 
-#                      figsize_height=10, 
-#                      dpi=150,
-#                      plot_min_time_s=0.0, # None: Automatic. 
-#                      plot_max_time_s=None, # None: Automatic. 
-#                      plot_max_freq_khz=200, # None: Automatic. 
-#                      plot_max_interval_s=0.2, # None: Automatic. 
-#                      plot_max_duration_ms=20, # None: Automatic. 
-#                     ):
-#         """ """
-#         for file_path in self.files_df.abs_file_path:
-#             # Update for each figure.
-#             fig_min_time_s = plot_min_time_s
-#             fig_max_time_s = plot_max_time_s
-#             fig_max_freq_khz = plot_max_freq_khz
-#             fig_max_interval_s = plot_max_interval_s
-#             fig_max_duration_ms = plot_max_duration_ms
-# 
-#             # Prepare file pathes.
-#             metrics_file_path = pathlib.Path(file_path).stem + '_Metrics.txt'
-#             metrics_file_path = pathlib.Path(self.scanning_results_dir, metrics_file_path)
-#             plot_file_path = pathlib.Path(file_path).stem + '_Plot.png'
-#             plot_file_path = pathlib.Path(self.scanning_results_dir, plot_file_path)
-#             # Check if metrics exists.
-#             if not pathlib.Path(metrics_file_path).exists():
-#                 continue
-#             #
-#             if self.debug:
-#                 print('Plot to file: ', plot_file_path)
-#             # Read dataframe.
-#             metrics_df = pd.read_csv(metrics_file_path, sep="\t")
-#             # Plot time instead of index. Add columns to dataframe.
-#             metrics_df['time_peak_s'] = metrics_df.peak_signal_index / self.sampling_freq
-#             metrics_df['time_start_s'] = metrics_df.start_signal_index / self.sampling_freq
-#             metrics_df['time_end_s'] = metrics_df.end_signal_index / self.sampling_freq
-#             # Calculate intervals between chirps.
-#             metrics_df['interval_s'] = metrics_df.time_peak_s.diff()
-#             if fig_max_interval_s is None:
-#                 metrics_df.loc[(metrics_df.interval_s > 0.2)] = np.NaN # Too long interval.
-#             else:
-#                 metrics_df.loc[(metrics_df.interval_s > fig_max_interval_s)] = np.NaN # Too long interval.
-#             # Calculate if automatic.
-#             if fig_min_time_s is None:
-#                 fig_min_time_s = metrics_df.time_peak_s.min() - 0.1
-#             if fig_max_time_s is None:
-#                 fig_max_time_s = metrics_df.time_peak_s.max() + 0.1
-#             if fig_max_freq_khz is None:
-#                 fig_max_freq_khz = self.sampling_freq / 1000 / 2 # Nyquist.
-#             if fig_max_interval_s is None:
-#                 fig_max_interval_s = metrics_df.interval_s.max() + 0.1
-#             if fig_max_duration_ms is None:
-#                 fig_max_duration_ms = metrics_df.duration_ms.max() + 0.1
-#             
-#             if len(metrics_df.time_peak_s) == 0:
-#                 return # Empty.
-#     
-#             fig, (ax1, ax2) = plt.subplots(2,1,
-#                                     figsize=(figsize_width, figsize_height), 
-#                                     dpi=dpi,
-#                                     #sharex=True
-#                                     )
-#             # ax1 - Peak freq, etc.
-#             cs1 = ax1.scatter(
-#                         x=metrics_df.time_peak_s,
-#                         y=metrics_df.peak_freq_khz,
-#                         s=150,
-#                         edgecolors='black', 
-#                         linewidth=0.5, 
-#                         c=metrics_df.peak_dbfs,
-#                         cmap=plt.get_cmap('YlOrRd'),  #'YlOrRd', 'Reds'
-#                         alpha=0.7)
-#             ax1.vlines(x=metrics_df.time_peak_s, 
-#                        ymin=metrics_df.start_freq_khz, 
-#                        ymax=metrics_df.end_freq_khz,
-#     #                    ymin=metrics_df.max_freq_khz, 
-#     #                    ymax=metrics_df.min_freq_khz,
-#                        linewidth=0.5, 
-#                        alpha=0.8
-#                       )
-#             ax1.hlines(y=metrics_df.peak_freq_khz, 
-#                        xmin=metrics_df.time_start_s, 
-#                        xmax=metrics_df.time_end_s,
-#                        linewidth=0.5, 
-#                        alpha=0.8
-#                       )
-#             cbar = fig.colorbar(cs1, ax=ax1, label='dBFS')
-#             ax1.set_xlim((fig_min_time_s, fig_max_time_s))
-#             ax1.set_ylim((0, fig_max_freq_khz))
-#             ax1.minorticks_on()
-#             ax1.grid(which='major', linestyle='-', linewidth='0.5', alpha=0.6)
-#             ax1.grid(which='minor', linestyle='-', linewidth='0.5', alpha=0.3)
-#             ax1.tick_params(which='both', top='off', left='off', right='off', bottom='off')
-#             
-#             # ax2 - Interval.
-#             ax2.scatter(
-#                          x=metrics_df.time_peak_s,
-#                          y=metrics_df.interval_s,
-#                          s=20,
-#                          color='blue',
-#                          label='Interval (s)',
-#                          alpha=0.5
-#                         )    
-#             ax2.hlines(y=metrics_df.interval_s, 
-#                        xmin=metrics_df.time_peak_s - metrics_df.interval_s, 
-#                        xmax=metrics_df.time_peak_s,
-#                        linewidth=0.5, 
-#                        color='blue',
-#                        label=None,
-#                        alpha=0.8
-#                       )
-#             ax2.set_xlim((fig_min_time_s, fig_max_time_s))
-#             ax2.set_ylim((0, fig_max_interval_s))
-#             ax2.minorticks_on()
-#             ax2.grid(which='major', linestyle='-', linewidth='0.5', alpha=0.6)
-#             ax2.grid(which='minor', linestyle='-', linewidth='0.5', alpha=0.3)
-#             ax2.tick_params(which='both', top='off', left='off', right='off', bottom='off') 
-#             
-#             # ax3 - Duration.
-#             ax3 = ax2.twinx()
-#             ax3.scatter(
-#                          x=metrics_df.time_peak_s,
-#                          y=metrics_df.duration_ms,
-#                          s=20,
-#                          marker='s',
-#                          color='red',
-#                          label='Duration (ms)',
-#                          alpha=0.5
-#                         )
-#             ax3.set_xlim((fig_min_time_s, fig_max_time_s))
-#             ax3.set_ylim((0, fig_max_duration_ms))
-#             
-#             # Legends
-#             ax2.legend(loc='upper left')
-#             ax3.legend(loc='upper right')
-#             
-#             # Adjust size on second diagram.
-#             pos = ax1.get_position()
-#             pos2 = ax2.get_position()
-#             ax2.set_position([pos.x0,pos2.y0,pos.width,pos2.height])
-#             ax3.set_position([pos.x0,pos2.y0,pos.width,pos2.height])
-#             
-#             # Titles and labels.
-#             file_name = pathlib.Path(metrics_file_path).name
-#             fig.suptitle('Metrics from: ' + file_name, 
-#                          fontsize=12, fontweight='bold')
-#             ax1.set_title('Peak and start/end frequencies, amplitude and start/stop time')
-#             ax1.set_xlabel('Time (s)')
-#             ax1.set_ylabel('Frequency (kHz)')
-#             ax2.set_xlabel('Time (s)')
-#             ax2.set_title('Interval (s) and duration (ms)')
-#             ax2.set_ylabel('Interval (s)')
-#             ax3.set_ylabel('Duration (ms)')
-#             
-#             # Save and plot.
-#             fig.savefig(str(plot_file_path))
-#             #
-#             plt.close()       
-#     
-#     def plot_positions_on_map(self, map_file_path=None):
-#         """ Plots positions on an interactive OpenStreetMap by using the folium library. 
-#             Note: A map can only be created if lat/long is in file name. """
-#         if folium_installed == False:
-#             if self.debug:
-#                 print('\n', 'Warning: Position map not created. Folium is not installed.', '\n')
-#             return
-#         # Create name if not specified.
-#         if map_file_path is None:
-#             map_file_path=str(pathlib.Path(self.scanning_results_dir, 
-#                                            'positions_map.html'))        
-#         # Remove rows with no position.
-#         files_with_pos_df = pd.DataFrame(self.files_df)
-#         files_with_pos_df.latlong_str.replace('', np.nan, inplace=True)
-#         files_with_pos_df.dropna(subset=['latlong_str'], inplace=True) 
-#         if len(files_with_pos_df) > 0:
-#             # Group by positions and count files at each position.
-#             distinct_df = pd.DataFrame(
-#                     {'file_count' : files_with_pos_df.groupby( ['latlong_str', 
-#                                                                 'latitude_dd', 
-#                                                                 'longitude_dd']).size()
-#                     }).reset_index()
-#             # Add a column for description to be shown when hovering over point in map.
-#             distinct_df['description'] = 'Pos: ' + distinct_df['latlong_str'] + \
-#                                          ' Count: ' + distinct_df['file_count'].astype(str)
-#             # Use the mean value as center for the map.
-#             center_lat = distinct_df.latitude_dd.mean()
-#             center_long = distinct_df.longitude_dd.mean()
-#             # Create map object.
-#             map_osm = folium.Map(location=[center_lat, center_long], zoom_start=8)
-#             # Loop over positions an create markers.
-#             for long, lat, desc in zip(distinct_df.longitude_dd.values,
-#                                      distinct_df.latitude_dd.values,
-#                                      distinct_df.description.values):
-#                 # The description column is used for popup messages.
-#                 marker = folium.Marker([lat, long], popup=desc).add_to(map_osm)            
-#             # Write to html file.
-#             map_osm.save(map_file_path)
-#             if self.debug:
-#                 print('Position map saved here: ', map_file_path)
-#         else:
-#             if self.debug:
-#                 print('\n', 'Warning: Position map not created. Lat/long positions are missing.', '\n')
-#     
-# 
-# 
-# # === MAIN ===    
-# if __name__ == "__main__":
-#     """ """
-# 
-#     print('Batfile scanner started. ',  datetime.datetime.now())
-#     
-#     #scanner = dsp4bats.BatfilesScanner(
-#     scanner = BatfilesScanner(
-#                 batfiles_dir='../data/batfiles',
-#                 scanning_results_dir='../data/batfiles_results',
-#                 sampling_freq= 384000, 
-# #                 sampling_freq= 500000, 
-#                 debug=True) # True: Print progress information.
-#         
-#     # Get files.
-#     scanner.create_list_of_files()
-#     
-#     # Scan all files and extract metrics.
-#     print('\n', 'Scanning files. ',  datetime.datetime.now(), '\n')
-#     scanner.scan_files(
-#                 # Time domain parameters.
-#                 time_filter_low_limit_hz=30000, # Lower limit for highpass or bandpass filter.
-#                 time_filter_high_limit_hz=None,  # Upper limit for lowpass or bandpass filter.
-#                 localmax_noise_threshold_factor=3.0, # Multiplies the detected noise level by this factor. 
-#                 localmax_jump_factor=1000, # 1000 gives 1 ms jumps, 2000 gives 0.5 ms jumps.
-#                 localmax_frame_length=1024, # Frame size to smooth the signal.
-#                 # Frequency domain parameters.
-#                 freq_window_size=128, # 
-#                 freq_filter_low_hz=30000, # Don't use peaks below this limit. 
-#                 freq_threshold_below_peak_db=20.0, # Threshold calculated in relation to chirp peak level.
-#                 freq_threshold_dbfs =-50.0, # Absolute threshold in dbms. 
-#                 freq_jump_factor=2000, # 1000 gives 1 ms jumps, 2000 gives 0.5 ms jumps.  
-#                 freq_max_frames_to_check=100, # Max number of jump steps to calculate metrics.  
-#                 freq_max_silent_slots=8, # Number of jump steps to detect start/end of chirp.
-#                 )
-#     
-#     # Plot the content of the "*_Metrics.txt" files as Matplotlib plots.
-#     print('\n', 'Creates plots. ',  datetime.datetime.now(), '\n')
-#     scanner.plot_results(
-#                 # Figure settings.
-#                 figsize_width=16, 
-#                 figsize_height=10, 
-#                 dpi=80,
-#                 # Plot settings.
-#                 plot_min_time_s=0, # None: Automatic. 
-#                 plot_max_time_s=None, # 1.0, # None: Automatic. 
-#                 plot_max_freq_khz=200, # None: Automatic.  
-#                 plot_max_interval_s=0.2, # None: Automatic.  
-#                 plot_max_duration_ms=20, # None: Automatic.  
-#                 )
-#     
-#     # If the file names contains latitude/longitude information an 
-#     # interactive map (html) will be generated.
-#     print('\n', 'Creates map. ',  datetime.datetime.now(), '\n')
-#     scanner.plot_positions_on_map()
-#     
-#     print('\n', 'Batfile scanner ended. ',  datetime.datetime.now(), '\n')
-#     
-#     
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson 
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import time
+import json
+import inspect
+import pathlib
+import datetime
+import threading
+import contextlib
+import tracemalloc
+import concurrent.futures
+import numpy as np
+
+import dsp4bats
+
+# Note: matplotlib, pandas and folium are imported when plots and maps are
+# created. Scanning does not need them.
+
+# Peak memory, in bytes per sample in a chunk, for the most memory consuming 
+# stage. That is find_localmax, or the noise floor calculation if used.
+# From measure_bytes_per_sample on data/batfiles, rounded up to 10 bytes:
+# localmax 37.6 (float64) and 18.8 (float32), noise_floor 28.1 for both.
+# Regenerate when the stages change:
+#   measure_bytes_per_sample('data/batfiles', signal_dtype='float32', 
+#                            freq_noise_floor_tracking=True)
+STAGE_BYTES_PER_SAMPLE = {'float64': 40, 'float32': 20}
+NOISE_FLOOR_BYTES_PER_SAMPLE = 30
+
+# The noise level used for the localmax threshold is calculated over fixed 
+# windows, aligned to the file start. Then detections do not depend on the 
+# chunk size, for example when reduced by memory_budget_mb.
+NOISE_WINDOW_S = 1.0
+
+# Grouped scan_files parameters. Keys and default values. A group dict with 
+# some of the keys can be used, the others get the default values.
+CHUNK_SETTINGS = {
+    'chunk_workers': 1, # Threads. numpy/scipy release the GIL.
+    'chunk_halo_s': 0.0, # Overlap before and after each chunk. Chirps in two chunks are merged.
+    'chunk_size_s': 1.0, # Use a halo if chunks are smaller than the files.
+    }
+DETECTOR_SETTINGS = {
+    'peak_detector': 'localmax', # 'localmax' or 'matched_filter'. See MatchedFilterDetector.
+    'matched_filter_templates': None, # List of dicts. None: Default templates.
+    'matched_filter_threshold_factor': 8.0, # Multiplies the running noise level.
+    }
+MEMORY_SETTINGS = {
+    'signal_dtype': 'float64', # 'float32' halves memory usage, small differences in results.
+    'memory_budget_mb': None, # Chunk size and workers are reduced to fit. See plan_memory_budget.
+    'memory_report': False, # Peak allocation per file, and per stage with one worker.
+    }
+TELEMETRY_SETTINGS = {
+    'telemetry': False, # "file_telemetry" and "chunk_telemetry" events, with time per stage.
+    'telemetry_file': None, # Telemetry records are also appended to this JSON lines file.
+    }
+SETTINGS_GROUPS = {
+    'chunk_settings': CHUNK_SETTINGS, 
+    'detector_settings': DETECTOR_SETTINGS, 
+    'memory_settings': MEMORY_SETTINGS, 
+    'telemetry_settings': TELEMETRY_SETTINGS, 
+    }
+
+def group_scan_settings(settings):
+    """ scan_files parameters from flat settings. Keys in the settings groups 
+        are moved to their group dict. """
+    grouped = {}
+    for name, value in settings.items():
+        for group_name, group in SETTINGS_GROUPS.items():
+            if name in group:
+                grouped.setdefault(group_name, {})[name] = value
+                break
+        else:
+            if name in SETTINGS_GROUPS:
+                grouped.setdefault(name, {}).update(value or {})
+            else:
+                grouped[name] = value
+    return grouped
+
+class MemoryStages():
+    """ Peak memory allocation per scanning stage, measured with tracemalloc.
+        tracemalloc has one peak for the whole process, so stages are only 
+        measured with per_stage, when one worker thread is used. Nothing is 
+        serialized. The peak for the whole file is always measured. """
+    def __init__(self, per_stage=True):
+        """ """
+        self.per_stage = per_stage
+        self.started_tracing = False
+        self.stage_peaks = {}
+        self.start_bytes = 0
+        self.peak_bytes = 0
+
+    def start(self):
+        """ """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        tracemalloc.reset_peak()
+        self.start_bytes, _peak = tracemalloc.get_traced_memory()
+        self.stage_peaks = {}
+        self.peak_bytes = 0
+
+    def stop(self):
+        """ Returns (peak bytes per stage, peak bytes for the file). Both are 
+            above the allocated size when the stage, or the file, started. """
+        self._update_peak_bytes()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return dict(self.stage_peaks), self.peak_bytes
+
+    def _update_peak_bytes(self):
+        """ File peak, before the tracemalloc peak is reset. """
+        _current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(self.peak_bytes, peak - self.start_bytes)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """ Peak allocation above the allocated size when the stage started. 
+            Only one stage at a time, so nothing is measured without per_stage. """
+        if not self.per_stage:
+            yield
+            return
+        self._update_peak_bytes()
+        tracemalloc.reset_peak()
+        current, _peak = tracemalloc.get_traced_memory()
+        yield
+        _current, peak = tracemalloc.get_traced_memory()
+        self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak - current)
+        self._update_peak_bytes()
+
+def measure_bytes_per_sample(batfiles_dir, sampling_freq=384000, **kwargs):
+    """ Peak memory per stage in bytes per sample in a chunk, max over the files 
+        in batfiles_dir. Used to regenerate STAGE_BYTES_PER_SAMPLE and 
+        NOISE_FLOOR_BYTES_PER_SAMPLE. Other parameters as for scan_files. """
+    import tempfile
+    events = []
+    with tempfile.TemporaryDirectory() as results_dir:
+        scanner = BatfilesScanner(batfiles_dir=batfiles_dir, 
+                                  scanning_results_dir=results_dir, 
+                                  sampling_freq=sampling_freq, 
+                                  progress_callback=events.append)
+        scanner.scan_files(**group_scan_settings(dict(kwargs, memory_report=True, chunk_workers=1, 
+                                                      chunk_halo_s=0.0, memory_budget_mb=None)))
+    bytes_per_sample = {}
+    for event in events:
+        if event['event'] == 'file_memory':
+            chunk_samples = event['chunk_size_s'] * sampling_freq
+            for stage, peak in event['stage_peak_bytes'].items():
+                bytes_per_sample[stage] = max(bytes_per_sample.get(stage, 0.0), 
+                                              round(peak / chunk_samples, 1))
+    return bytes_per_sample
+
+class BatfilesScanner():
+    """ """
+    def __init__(self,
+                 batfiles_dir='batfiles',
+                 scanning_results_dir='batfiles_results',
+                 sampling_freq=384000, 
+                 debug=False,
+                 progress_callback=None, # Called with a dict for each progress event.
+                 ):
+        """ """
+        self.batfiles_dir = batfiles_dir
+        self.scanning_results_dir = scanning_results_dir
+        self.sampling_freq = sampling_freq        
+        self.debug = debug
+        self.progress_callback = progress_callback
+        self._progress_lock = threading.Lock()
+        #
+        self.file_utils = dsp4bats.WurbFileUtils()
+        self.files_df = None 
+
+    def report_progress(self, event, **kwargs):
+        """ Sends a progress event, as a dict, to progress_callback if used. """
+        if self.progress_callback is not None:
+            progress = {'event': event, 
+                        'time': datetime.datetime.now().isoformat()}
+            progress.update(kwargs)
+            with self._progress_lock: # Files can be scanned in parallel threads.
+                self.progress_callback(progress)
+
+    def create_list_of_files(self):
+        """ """
+        # Exists directory for results? Create if not.
+        if not pathlib.Path(self.scanning_results_dir).exists():
+            pathlib.Path(self.scanning_results_dir).mkdir(parents=True)
+        # Read files to dataframe.
+        self.file_utils.find_sound_files(dir_path=self.batfiles_dir, 
+                                         recursive=False, 
+                                         wurb_files_only=False)
+        self.files_df = self.file_utils.get_dataframe()
+        if self.debug:
+            print('Number of wave files found: ', len(self.files_df))
+    
+    def scan_files(self, 
+                # Time domain parameters.
+                time_filter_low_limit_hz=15000,
+                time_filter_high_limit_hz=None,
+                localmax_noise_threshold_factor=1.2, 
+                localmax_jump_factor=1000, 
+                localmax_frame_length=1024, 
+                # Frequency domain parameters.
+                freq_window_size=128, 
+                freq_filter_low_hz=15000, 
+                freq_threshold_below_peak_db=40.0, 
+                freq_threshold_dbfs =-50.0, 
+                freq_jump_factor=4000, 
+                freq_max_frames_to_check=200, 
+                freq_max_silent_slots=8, 
+                freq_estimator='peak', # 'peak' or 'harmonic'.
+                freq_subharmonic_threshold_db=20.0, # Used by 'harmonic'. Max level below the strongest bin.
+                freq_coarse_factor=1, # > 1: Coarse-to-fine search in chirp_metrics.
+                freq_noise_floor_tracking=False, # Per bin threshold from a NoiseFloorTracker.
+                freq_noise_floor_margin_db=10.0, # Threshold above tracked noise floor.
+                # Chirp shape parameters.
+                chirp_shape_method=None, # None, 'fft' or 'zc' (Zero Crossing).
+                shape_jump_factor=16000, # Used by 'fft'. 16000 gives 0.0625 ms jumps.
+                zc_division_ratio=8, # Used by 'zc'.
+                # Grouped settings, dicts. See CHUNK_SETTINGS, DETECTOR_SETTINGS, etc.
+                chunk_settings=None, 
+                detector_settings=None, 
+                memory_settings=None, 
+                telemetry_settings=None, 
+                # Activity summaries.
+                activity_aggregation=False, # Writes "*_Activity.npz" for each file.
+                ):
+        """ Scans all files and writes chirp metrics to "*_Metrics.txt", and 
+            chirp shapes to "*_ChirpShape.txt" if chirp_shape_method is used. 
+            Each file is analysed in chunks, see CHUNK_SETTINGS. The result 
+            does not depend on the number of workers. """
+        settings = self.get_scan_settings(**{name: value for name, value in locals().items() 
+                                             if name != 'self'})
+        # Exists directory for results? Create if not.
+        if not pathlib.Path(self.scanning_results_dir).exists():
+            pathlib.Path(self.scanning_results_dir).mkdir(parents=True)
+        # Read files to dataframe.
+        self.file_utils.find_sound_files(dir_path=self.batfiles_dir, 
+                                         recursive=False, 
+                                         wurb_files_only=False)
+        self.files_df = self.file_utils.get_dataframe()
+        if self.debug:
+            print('Number of wave files found: ', len(self.files_df))
+        self.report_progress('scan_started', files=len(self.files_df))
+        
+        for file_path in self.files_df.abs_file_path:
+            self.scan_file(file_path, settings)
+        #
+        self.report_progress('scan_finished', files=len(self.files_df))
+
+    def watch_directory(self, 
+                        scan_settings=None, # Dict with scan_files parameters. None: Defaults.
+                        poll_interval_s=0.5, 
+                        stable_time_s=2.0, # A file is finished when size and mtime are unchanged this long.
+                        file_workers=1, # Max number of files scanned at the same time.
+                        include_existing=False, # False: Only files added, or still written, after start.
+                        max_files=None, # Stop after this number of files. None: No limit.
+                        timeout_s=None, # Stop after this time. None: Until interrupted.
+                        ):
+        """ Scans new wave files in batfiles_dir as they are finished, for example 
+            while a WURB recorder is running. Metrics files are written as for 
+            scan_files. Uses a SoundStreamManager pipeline: 
+            DirectoryWatcherSource ---> MetricsScanProcess ---> ScanResultTarget. 
+            Emits a "file_watched" event for each file. Returns a list of results. """
+        from dsp4bats import directory_watcher
+        settings = self.get_scan_settings(**(scan_settings or {}))
+        if not pathlib.Path(self.scanning_results_dir).exists():
+            pathlib.Path(self.scanning_results_dir).mkdir(parents=True)
+        #
+        def result_callback(result):
+            if self.debug:
+                print('Scanned: ', result['file'], '  time (s): ', result['scan_time_s'])
+            self.report_progress('file_watched', **result)
+        source = directory_watcher.DirectoryWatcherSource(self.batfiles_dir, 
+                                                          poll_interval_s=poll_interval_s, 
+                                                          stable_time_s=stable_time_s, 
+                                                          include_existing=include_existing, 
+                                                          max_files=max_files)
+        process = directory_watcher.MetricsScanProcess(self, settings, file_workers=file_workers)
+        target = directory_watcher.ScanResultTarget(result_callback)
+        stream_manager = dsp4bats.SoundStreamManager(source, process, target, 
+                                                     source_queue_max=1000, 
+                                                     target_queue_max=1000)
+        self.report_progress('watch_started', dir=str(self.batfiles_dir))
+        stream_manager.start_streaming()
+        try:
+            if not stream_manager.wait_until_finished(timeout=timeout_s):
+                stream_manager.stop_streaming()
+                stream_manager.wait_until_finished()
+        except KeyboardInterrupt:
+            # Files being scanned are finished first.
+            stream_manager.stop_streaming()
+            stream_manager.wait_until_finished()
+        self.report_progress('watch_finished', files=len(target.results))
+        return target.results
+
+    def scan_shared(self,
+                    scan_settings=None, # Dict with scan_files parameters. None: Defaults.
+                    queue_dir=None, # Shared by all workers. None: "work_queue" in scanning_results_dir.
+                    worker_id=None, # Unique for each worker. None: Host name and pid.
+                    lease_s=60.0, # A worker is assumed dead if its leases are not touched this long.
+                    poll_interval_s=5.0, # Wait before files leased by others are tried again.
+                    ):
+        """ Scans all files in batfiles_dir together with other scanners, on this
+            or other machines, pointing at the same batfiles_dir and
+            scanning_results_dir. Each file is claimed with a lease in queue_dir,
+            see work_queue.FileLeaseQueue. Files claimed by dead workers are
+            scanned when their leases expire. Returns when all files are done.
+            Emits "lease_reclaimed" and "lease_lost" events. Returns the number
+            of files scanned by this worker. """
+        from dsp4bats import work_queue
+        settings = self.get_scan_settings(**(scan_settings or {}))
+        if queue_dir is None:
+            queue_dir = pathlib.Path(self.scanning_results_dir, 'work_queue')
+        self.create_list_of_files()
+        lease_queue = work_queue.FileLeaseQueue(queue_dir, worker_id=worker_id, lease_s=lease_s,
+                                                event_callback=self.report_progress)
+        self.report_progress('shared_scan_started', worker=lease_queue.worker_id,
+                             files=len(self.files_df))
+        scanned_files = 0
+        lease_queue.start_heartbeat()
+        try:
+            for file_path in lease_queue.claim_files(self.files_df.abs_file_path,
+                                                     poll_interval_s=poll_interval_s):
+                error = None
+                try:
+                    self.scan_file(file_path, settings)
+                except Exception as e:
+                    error = str(e)
+                    self.report_progress('file_failed', file=str(file_path), error=error)
+                except BaseException:
+                    lease_queue.release(file_path, done=False) # Interrupted. Others can claim it.
+                    raise
+                lease_queue.release(file_path, error=error)
+                scanned_files += 1
+        finally:
+            lease_queue.stop_heartbeat()
+        self.report_progress('shared_scan_finished', worker=lease_queue.worker_id,
+                             files=scanned_files)
+        return scanned_files
+
+    def get_scan_settings(self, **kwargs):
+        """ Flat settings for scan_file. Parameters and default values as for 
+            scan_files. Keys in the settings groups can also be used directly, 
+            for example chunk_workers=4. """
+        settings = {name: parameter.default for name, parameter 
+                    in inspect.signature(self.scan_files).parameters.items() 
+                    if (name != 'self') and (name not in SETTINGS_GROUPS)}
+        for group in SETTINGS_GROUPS.values():
+            settings.update(group)
+        for name, value in group_scan_settings(kwargs).items():
+            if name in SETTINGS_GROUPS:
+                for key in value:
+                    if key not in SETTINGS_GROUPS[name]:
+                        raise UserWarning('Unknown key in ' + name + ': ' + key)
+                settings.update(value)
+            elif name in settings:
+                settings[name] = value
+            else:
+                raise UserWarning('Unknown scan parameter: ' + name)
+        settings['chunk_workers'] = max(int(settings['chunk_workers']), 1)
+        return self._apply_memory_budget(settings)
+
+    def _apply_memory_budget(self, settings):
+        """ Chunk size and workers from plan_memory_budget, if memory_budget_mb is used. """
+        memory_budget_mb = settings['memory_budget_mb']
+        if memory_budget_mb is not None:
+            chunk_size_s, chunk_workers, estimated_mb = self.plan_memory_budget(settings)
+            settings['chunk_size_s'] = chunk_size_s
+            settings['chunk_workers'] = chunk_workers
+            if self.debug:
+                print('Memory budget (MB): ', memory_budget_mb, '  chunk size (s): ', chunk_size_s,
+                      '  workers: ', chunk_workers, '  estimated (MB): ', round(estimated_mb, 1))
+            self.report_progress('memory_plan', memory_budget_mb=memory_budget_mb, 
+                                 chunk_size_s=chunk_size_s, chunk_workers=chunk_workers, 
+                                 estimated_mb=round(estimated_mb, 1))
+        return settings
+
+    def estimate_chunk_memory(self, chunk_size, settings):
+        """ Estimated peak memory in bytes for one chunk, halo included, during 
+            scanning. The signal is kept until chirp metrics are calculated, and 
+            one stage at a time needs extra work arrays. """
+        halo_size = int(settings['chunk_halo_s'] * self.sampling_freq)
+        samples = chunk_size + 2 * halo_size
+        signal_dtype = np.dtype(settings['signal_dtype'])
+        bytes_per_sample = signal_dtype.itemsize + STAGE_BYTES_PER_SAMPLE[signal_dtype.name]
+        if settings['freq_noise_floor_tracking']:
+            bytes_per_sample = max(bytes_per_sample, 
+                                   signal_dtype.itemsize + NOISE_FLOOR_BYTES_PER_SAMPLE)
+        return samples * bytes_per_sample
+
+    def plan_memory_budget(self, settings):
+        """ Selects chunk size and number of workers that fits memory_budget_mb.
+            Full size chunks are preferred before more workers. 
+            Returns (chunk_size_s, chunk_workers, estimated_mb). """
+        budget = settings['memory_budget_mb'] * 1000000
+        max_workers = max(int(settings['chunk_workers']), 1)
+        chunk_size = int(settings['chunk_size_s'] * self.sampling_freq)
+        min_chunk_size = int(self.sampling_freq / 20) # 50 ms.
+        # Smaller chunks until one fits.
+        while (self.estimate_chunk_memory(chunk_size, settings) > budget) and \
+              (chunk_size > min_chunk_size):
+            chunk_size = max(chunk_size // 2, min_chunk_size)
+        chunk_memory = self.estimate_chunk_memory(chunk_size, settings)
+        if chunk_memory > budget:
+            raise UserWarning('Memory budget too small. At least ' + 
+                              str(round(chunk_memory / 1000000, 1)) + ' MB is needed.')
+        # More workers if they fit.
+        chunk_workers = int(min(max_workers, budget // chunk_memory))
+        #
+        return chunk_size / self.sampling_freq, chunk_workers, chunk_workers * chunk_memory / 1000000
+
+    def scan_file(self, file_path, settings):
+        """ Scans one file. Settings are the parameters to scan_files. """
+        if self.debug:
+            print('\n', 'Scanning file: ', file_path)
+        self.report_progress('file_started', file=str(file_path))
+        start_time = time.perf_counter()
+        telemetry = settings['telemetry'] or (settings['telemetry_file'] is not None)
+        # Check file.
+        wave_reader = dsp4bats.WaveFileReader(file_path)
+        sampling_freq = wave_reader.sampling_freq
+        file_length = wave_reader.get_length()
+        wave_reader.close()
+        if sampling_freq != self.sampling_freq:
+            if self.debug:
+                print('\n', 'Error: Wrong sampling frequency in file: ', sampling_freq,
+                      '   Expected: ', self.sampling_freq, '\n')
+            self.report_progress('file_skipped', file=str(file_path), 
+                                 reason='Wrong sampling frequency: ' + str(sampling_freq))
+            return
+        # Create dsp4bats utils. Shared by all chunks, read-only.
+        spectrum_util = dsp4bats.DbfsSpectrumUtil(window_size=settings['freq_window_size'],
+                                                  window_function='kaiser',
+                                                  kaiser_beta=14,
+                                                  sampling_freq=sampling_freq)
+        # Noise floor per bin, tracked over all chunks in the file.
+        noise_floor_tracker = None
+        if settings['freq_noise_floor_tracking']:
+            noise_floor_tracker = dsp4bats.NoiseFloorTracker(window_size=settings['freq_window_size'],
+                                                             window_function='kaiser',
+                                                             kaiser_beta=14,
+                                                             sampling_freq=sampling_freq)
+        # Chunks, and a halo before and after.
+        chunk_size = int(settings['chunk_size_s'] * sampling_freq)
+        halo_size = int(settings['chunk_halo_s'] * sampling_freq)
+        number_of_chunks = int(np.ceil(file_length / chunk_size))
+        chunk_workers = settings['chunk_workers']
+        #
+        memory_stages = None
+        if settings['memory_report']:
+            memory_stages = MemoryStages(per_stage=(chunk_workers == 1))
+            memory_stages.start()
+        # Noise level per window. Calculated in each chunk if chunks are whole windows.
+        noise_window = int(NOISE_WINDOW_S * sampling_freq)
+        window_levels = None
+        stage_totals = {}
+        if (halo_size > 0) or ((chunk_size % noise_window != 0) and (number_of_chunks > 1)):
+            levels_start = time.perf_counter()
+            window_levels = self._calc_window_levels(file_path, file_length, chunk_size, halo_size, 
+                                                     noise_window, sampling_freq, settings)
+            stage_totals['noise_windows_s'] = time.perf_counter() - levels_start
+        # One matched filter detector for the whole file. The chunks are streamed 
+        # through it, so the filter state and the noise level continue over chunks.
+        detector = None
+        if settings['peak_detector'] == 'matched_filter':
+            detector = dsp4bats.MatchedFilterDetector(sampling_freq=sampling_freq, 
+                                    templates=settings['matched_filter_templates'], 
+                                    threshold_factor=settings['matched_filter_threshold_factor'], 
+                                    jump=int(sampling_freq/settings['localmax_jump_factor']))
+        waiting_chunks = [] # Chunks waiting for matched filter peaks from later chunks.
+        #
+        chirps = []
+        acc_checked_peaks_counter = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=chunk_workers) as executor:
+            # Process chunk_workers chunks at a time to limit memory usage.
+            for first_chunk in range(0, number_of_chunks, chunk_workers):
+                chunk_numbers = range(first_chunk, min(first_chunk + chunk_workers, number_of_chunks))
+                # Step 1: Read, filter and find peaks.
+                chunks = list(executor.map(
+                            lambda chunk_number: self._prepare_chunk(file_path, chunk_number, 
+                                                                     chunk_size, halo_size, 
+                                                                     sampling_freq, settings, 
+                                                                     noise_floor_tracker, 
+                                                                     noise_window, window_levels, 
+                                                                     memory_stages), 
+                            chunk_numbers))
+                # Step 2: Noise floor tracking must be done in chunk order.
+                for chunk in chunks:
+                    if noise_floor_tracker is not None:
+                        noise_floor_tracker.update_from_spectrum(chunk['buffer_floor_dbfs'])
+                        chunk['threshold_dbfs'] = noise_floor_tracker.get_threshold_dbfs(
+                                                margin_db=settings['freq_noise_floor_margin_db'], 
+                                                min_threshold_dbfs=settings['freq_threshold_dbfs'])
+                    else:
+                        chunk['threshold_dbfs'] = settings['freq_threshold_dbfs']
+                    if detector is not None:
+                        waiting_chunks.append(chunk)
+                        self._add_matched_filter_peaks(detector, chunk, waiting_chunks, 
+                                                       file_length, memory_stages)
+                if detector is not None:
+                    # Only chunks with all their peaks. Normally the last chunk waits 
+                    # for the next batch.
+                    if chunk_numbers[-1] == number_of_chunks - 1:
+                        self._add_matched_filter_peaks(detector, None, waiting_chunks, 
+                                                       file_length, memory_stages)
+                        chunks, waiting_chunks = waiting_chunks, []
+                    else:
+                        decided_until = detector.get_decided_until()
+                        chunks = [chunk for chunk in waiting_chunks if chunk['peaks_until'] <= decided_until]
+                        waiting_chunks = [chunk for chunk in waiting_chunks if chunk['peaks_until'] > decided_until]
+                # Step 3: Chirp metrics and shapes.
+                results = list(executor.map(
+                            lambda chunk: self._analyse_chunk(chunk, spectrum_util, settings, 
+                                                              memory_stages), 
+                            chunks))
+                for chunk, chunk_chirps in zip(chunks, results):
+                    acc_checked_peaks_counter += len(chunk['peaks'])
+                    chirps += chunk_chirps
+                    for stage, stage_s in chunk['stage_times'].items():
+                        stage_totals[stage] = stage_totals.get(stage, 0.0) + stage_s
+                    if telemetry:
+                        audio_s = (min(chunk['core_end'], file_length) - chunk['core_start']) / sampling_freq
+                        self._report_telemetry(settings, 'chunk_telemetry', 
+                                               file=str(file_path), 
+                                               chunk=chunk['chunk_number'], 
+                                               audio_s=round(audio_s, 6), 
+                                               wall_s=round(chunk['wall_s'], 6), 
+                                               realtime_factor=round(chunk['wall_s'] / audio_s, 6), 
+                                               checked_peaks=len(chunk['peaks']), 
+                                               chirps=len(chunk_chirps), 
+                                               noise_level_db=round(float(chunk['noise_level_db']), 2), 
+                                               **{stage: round(stage_s, 6) for stage, stage_s 
+                                                  in chunk['stage_times'].items()})
+                    if self.debug:
+                        print('Noise level: ', np.round(chunk['noise_level'], 5), 
+                              ' Noise (db): ', np.round(chunk['noise_level_db'], 2))
+                        print('Buffer: Detected peak counter: ', str(len(chunk_chirps)),
+                              '  of ', len(chunk['peaks']), ' checked peaks.',
+                              '  Spectrum cache hits/misses: ', chunk['cache_counters']) 
+        # Merge chirps found in more than one chunk.
+        chirps = self._merge_chirps(chirps)
+        if memory_stages is not None:
+            stage_peaks, peak_bytes = memory_stages.stop()
+            if self.debug:
+                print('Peak memory (MB): ', round(peak_bytes / 1000000, 1), '  per stage: ', 
+                      {stage: round(peak / 1000000, 1) for stage, peak in stage_peaks.items()})
+            self.report_progress('file_memory', file=str(file_path), 
+                                 chunk_size_s=chunk_size / sampling_freq, 
+                                 chunk_workers=chunk_workers, 
+                                 peak_bytes=peak_bytes, 
+                                 stage_peak_bytes=stage_peaks)
+        # Done.
+        if self.debug:
+            print('Summary: Detected peak counter: ', str(len(chirps)),
+                  '  of ', acc_checked_peaks_counter, ' checked peaks.') 
+        self.report_progress('file_finished', file=str(file_path), 
+                             checked_peaks=acc_checked_peaks_counter, 
+                             chirps=len(chirps))
+        if settings['activity_aggregation']:
+            self._save_activity(file_path, chirps, spectrum_util, 
+                                file_length / sampling_freq, acc_checked_peaks_counter)
+        if telemetry:
+            # Result files not included.
+            wall_s = time.perf_counter() - start_time
+            self._report_telemetry(settings, 'file_telemetry', 
+                                   file=str(file_path), 
+                                   audio_s=round(file_length / sampling_freq, 6), 
+                                   wall_s=round(wall_s, 6), 
+                                   realtime_factor=round(wall_s * sampling_freq / max(file_length, 1), 6), 
+                                   checked_peaks=acc_checked_peaks_counter, 
+                                   chirps=len(chirps), 
+                                   chunks=number_of_chunks, 
+                                   chunk_workers=chunk_workers, 
+                                   **{stage: round(stage_s, 6) for stage, stage_s in stage_totals.items()})
+        if len(chirps) == 0:
+            print('\n', 'Warning: No detected peaks found. No metrics produced.', '\n') 
+            return
+        # Write metrics.
+        out_header = spectrum_util.chirp_metrics_header()
+        metrics_file_name = pathlib.Path(file_path).stem + '_Metrics.txt'
+        with pathlib.Path(self.scanning_results_dir, metrics_file_name).open('w') as out_file:
+            out_file.write('\t'.join(map(str, out_header)) + '\n')
+            for chirp in chirps:
+                out_file.write('\t'.join(map(str, chirp['metrics'])) + '\n')
+        # Write chirp shapes.
+        if settings['chirp_shape_method'] is not None:
+            shape_header = spectrum_util.chirp_shape_header()
+            shape_file_name = pathlib.Path(file_path).stem + '_ChirpShape.txt'
+            with pathlib.Path(self.scanning_results_dir, shape_file_name).open('w') as shape_file:
+                shape_file.write('\t'.join(shape_header) + '\n')
+                for chirp in chirps:
+                    for shape_row in chirp['shape']:
+                        shape_file.write('\t'.join(map(str, shape_row)) + '\n')
+
+    def _report_telemetry(self, settings, event, **record):
+        """ Telemetry record as an event, and/or as a line in telemetry_file. """
+        if settings['telemetry']:
+            self.report_progress(event, **record)
+        if settings['telemetry_file'] is not None:
+            record = dict(event=event, time=datetime.datetime.now().isoformat(), **record)
+            with self._progress_lock: # Files can be scanned in parallel threads.
+                with open(settings['telemetry_file'], 'a') as telemetry_file:
+                    telemetry_file.write(json.dumps(record) + '\n')
+
+    def _save_activity(self, file_path, chirps, spectrum_util, audio_s, checked_peaks):
+        """ Activity aggregate for one file, see activity_aggregation. """
+        from dsp4bats import activity_aggregation
+        out_header = spectrum_util.chirp_metrics_header()
+        rows = np.array([chirp['metrics'] for chirp in chirps], dtype=np.float64).reshape(-1, len(out_header))
+        metrics = {name: rows[:, index] for index, name in enumerate(out_header)}
+        meta_dict = self.file_utils.extract_metadata(file_path) or {}
+        aggregate = activity_aggregation.ActivityAggregate()
+        aggregate.add_chirps(metrics, 
+                             sampling_freq=self.sampling_freq, 
+                             start_datetime=meta_dict.get('datetime') or None, 
+                             detector_id=meta_dict.get('detector_id', ''), 
+                             audio_s=audio_s, 
+                             checked_peaks=checked_peaks)
+        activity_file_name = pathlib.Path(file_path).stem + '_Activity.npz'
+        aggregate.save(pathlib.Path(self.scanning_results_dir, activity_file_name))
+
+    def _read_filtered(self, file_path, chunk_number, chunk_size, halo_size, 
+                       sampling_freq, settings, measure=contextlib.nullcontext):
+        """ Filtered signal for a chunk and its halo. Returns (signal, read_start). """
+        chunk_start = chunk_number * chunk_size
+        read_start = max(chunk_start - halo_size, 0)
+        # Each thread uses its own reader.
+        with measure('read'):
+            wave_reader = dsp4bats.WaveFileReader(file_path)
+            wave_reader.set_position(read_start)
+            signal = wave_reader.read_buffer(chunk_start + chunk_size + halo_size - read_start, 
+                                             dtype=np.dtype(settings['signal_dtype']))
+            wave_reader.close()
+        #
+        signal_util = dsp4bats.SignalUtil(sampling_freq)
+        with measure('filter'):
+            signal = signal_util.butterworth_filter(signal, 
+                                                    low_freq_hz=settings['time_filter_low_limit_hz'],
+                                                    high_freq_hz=settings['time_filter_high_limit_hz'])
+        return signal, read_start
+
+    def _window_square_sums(self, signal, signal_start, core_start, core_end, noise_window):
+        """ Sum of squares and number of samples per noise window, for the core 
+            part of a chunk. Returns a dict with window number: (sum, samples). """
+        core_end = min(core_end, signal_start + len(signal))
+        sums = {}
+        for window in range(core_start // noise_window, (core_end - 1) // noise_window + 1):
+            start = max(window * noise_window, core_start) - signal_start
+            end = min((window + 1) * noise_window, core_end) - signal_start
+            sums[window] = (np.sum(np.square(signal[start:end])), end - start)
+        return sums
+
+    def _calc_window_levels(self, file_path, file_length, chunk_size, halo_size, 
+                            noise_window, sampling_freq, settings):
+        """ Noise level for each window in a file, used when windows are not 
+            whole chunks. Chunks are filtered as when scanned, but only the sum 
+            of squares is kept. """
+        number_of_chunks = int(np.ceil(file_length / chunk_size))
+        def window_sums(chunk_number):
+            signal, read_start = self._read_filtered(file_path, chunk_number, chunk_size, 
+                                                     halo_size, sampling_freq, settings)
+            core_start = chunk_number * chunk_size
+            return self._window_square_sums(signal, read_start, core_start, 
+                                            core_start + chunk_size, noise_window)
+        square_sums = np.zeros(int(np.ceil(file_length / noise_window)))
+        samples = np.zeros(len(square_sums))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=settings['chunk_workers']) as executor:
+            for sums in executor.map(window_sums, range(number_of_chunks)):
+                for window, (square_sum, window_samples) in sums.items():
+                    square_sums[window] += square_sum
+                    samples[window] += window_samples
+        return np.sqrt(square_sums / np.maximum(samples, 1))
+
+    def _prepare_chunk(self, file_path, chunk_number, chunk_size, halo_size, 
+                       sampling_freq, settings, noise_floor_tracker, 
+                       noise_window, window_levels=None, memory_stages=None):
+        """ Reads, filters and finds peaks for one chunk. Runs in a worker thread. 
+            window_levels are noise levels per noise window, or None if the 
+            chunk contains whole windows and no halo. """
+        start_time = time.perf_counter()
+        stage_times = {} # Seconds per stage, for telemetry.
+        @contextlib.contextmanager
+        def measure(stage):
+            with memory_stages.measure(stage) if memory_stages else contextlib.nullcontext():
+                stage_start = time.perf_counter()
+                yield
+                stage_times[stage + '_s'] = time.perf_counter() - stage_start
+        chunk_start = chunk_number * chunk_size
+        signal, read_start = self._read_filtered(file_path, chunk_number, chunk_size, halo_size, 
+                                                 sampling_freq, settings, measure)
+        signal_util = dsp4bats.SignalUtil(sampling_freq)
+        # Get noise levels after filtering, per noise window.
+        with measure('noise_level'):
+            first_window = read_start // noise_window
+            if window_levels is None:
+                sums = self._window_square_sums(signal, read_start, chunk_start, 
+                                                chunk_start + chunk_size, noise_window)
+                window_levels = np.zeros(first_window + len(sums))
+                for window, (square_sum, window_samples) in sums.items():
+                    window_levels[window] = np.sqrt(square_sum / max(window_samples, 1))
+            last_window = min((read_start + len(signal) - 1) // noise_window, len(window_levels) - 1)
+            levels = window_levels[first_window:last_window + 1]
+            # Level for the core start. Used for ZC shapes and reports.
+            noise_level = window_levels[min(chunk_start // noise_window, len(window_levels) - 1)]
+            noise_level_db = signal_util.noise_level_in_db(signal, noise_level)
+            # Threshold per sample if more than one window.
+            noise_threshold = levels[0] if len(levels) == 1 else \
+                              np.repeat(levels, np.diff(np.clip(
+                                  (np.arange(first_window, last_window + 2) * noise_window) - read_start, 
+                                  0, len(signal))))
+            noise_threshold = noise_threshold * settings['localmax_noise_threshold_factor']
+        # Noise floor per frequency bin for this chunk. Merged later in chunk order.
+        buffer_floor_dbfs = None
+        if noise_floor_tracker is not None:
+            with measure('noise_floor'):
+                buffer_floor_dbfs = noise_floor_tracker.calc_buffer_floor(signal)
+        # Find peaks in time domain. Matched filter peaks are found later, in chunk 
+        # order, see _add_matched_filter_peaks.
+        peaks = np.empty(0, dtype=np.int64)
+        if settings['peak_detector'] != 'matched_filter':
+            with measure('localmax'):
+                peaks = signal_util.find_localmax(signal=signal,
+                                                  noise_threshold=noise_threshold, 
+                                                  jump=int(sampling_freq/settings['localmax_jump_factor']), 
+                                                  frame_length=settings['localmax_frame_length']) # Window size.
+        #
+        return {'chunk_number': chunk_number, 
+                'signal': signal, 
+                'signal_start': read_start, # Absolute index for signal[0].
+                'core_start': chunk_start, # Chirps with peaks in the core belong to this chunk.
+                'core_end': chunk_start + chunk_size, 
+                'sampling_freq': sampling_freq, 
+                'noise_level': noise_level, 
+                'noise_level_db': noise_level_db, 
+                'buffer_floor_dbfs': buffer_floor_dbfs, 
+                'peaks': peaks, 
+                'stage_times': stage_times, 
+                'wall_s': time.perf_counter() - start_time, 
+                }
+
+    def _add_matched_filter_peaks(self, detector, chunk, waiting_chunks, file_length, 
+                                  memory_stages=None):
+        """ Streams the core of the next chunk through the file's matched filter 
+            detector, or ends the stream if chunk is None. New peaks are added to 
+            all waiting chunks with the peak inside the signal, halo included. 
+            Must be called in chunk order. """
+        start_time = time.perf_counter()
+        with memory_stages.measure('localmax') if memory_stages else contextlib.nullcontext():
+            if chunk is None:
+                peaks = detector.flush()['signal_index']
+            else:
+                core = chunk['signal'][chunk['core_start'] - chunk['signal_start']:
+                                       min(chunk['core_end'], file_length) - chunk['signal_start']]
+                peaks = detector.process_buffer(core)['signal_index']
+        for waiting_chunk in waiting_chunks:
+            signal_start = waiting_chunk['signal_start']
+            signal_end = signal_start + len(waiting_chunk['signal'])
+            # Peaks up to the signal end are needed before the chunk is analysed.
+            waiting_chunk['peaks_until'] = signal_end
+            inside = (peaks >= signal_start) & (peaks < signal_end)
+            waiting_chunk['peaks'] = np.concatenate((waiting_chunk['peaks'], peaks[inside] - signal_start))
+        if chunk is not None:
+            stage_s = time.perf_counter() - start_time
+            chunk['stage_times']['localmax_s'] = chunk['stage_times'].get('localmax_s', 0.0) + stage_s
+            chunk['wall_s'] += stage_s
+
+    def _analyse_chunk(self, chunk, spectrum_util, settings, memory_stages=None):
+        """ Chirp metrics, and shapes, for peaks in one chunk. Runs in a worker thread.
+            Returns a list of chirps with absolute signal indexes. """
+        if memory_stages is not None:
+            with memory_stages.measure('chirp_metrics'):
+                return self._analyse_chunk(chunk, spectrum_util, settings)
+        start_time = time.perf_counter()
+        chirp_metrics_s = 0.0
+        chirp_shape_s = 0.0
+        signal = chunk['signal']
+        signal_start = chunk['signal_start']
+        sampling_freq = chunk['sampling_freq']
+        out_header = spectrum_util.chirp_metrics_header()
+        zc_util = dsp4bats.ZeroCrossingUtil(sampling_freq=sampling_freq, 
+                                            division_ratio=settings['zc_division_ratio'])
+        # Spectra for frames are shared by all peaks in the chunk.
+        spectrum_cache = dsp4bats.SpectrumCache(spectrum_util, signal)
+        chirps = []
+        for peak_position in chunk['peaks']:
+            # Extract metrics.
+            metrics_start = time.perf_counter()
+            result = spectrum_util.chirp_metrics(
+                                        signal=signal, 
+                                        peak_position=peak_position, 
+                                        jump_factor=settings['freq_jump_factor'], 
+                                        high_pass_filter_freq_hz=settings['freq_filter_low_hz'], 
+                                        threshold_dbfs = chunk['threshold_dbfs'], 
+                                        threshold_dbfs_below_peak = settings['freq_threshold_below_peak_db'], 
+                                        max_frames_to_check=settings['freq_max_frames_to_check'], 
+                                        max_silent_slots=settings['freq_max_silent_slots'], 
+                                        frequency_estimator=settings['freq_estimator'], 
+                                        subharmonic_threshold_db=settings['freq_subharmonic_threshold_db'], 
+                                        coarse_factor=settings['freq_coarse_factor'], 
+                                        spectrum_cache=spectrum_cache, 
+                                        debug=False)
+            chirp_metrics_s += time.perf_counter() - metrics_start
+            if result is False:
+                continue # 
+            result_dict = dict(zip(out_header, result))
+            # Only chirps with the peak inside the core. The halo is covered by other chunks.
+            peak_signal_index = int(result_dict['peak_signal_index']) + signal_start
+            if (peak_signal_index < chunk['core_start']) or (peak_signal_index >= chunk['core_end']):
+                continue
+            # Add chunk start to peak_signal_index, start_signal_index and end_signal_index.
+            out_row = []
+            for key in out_header:
+                if '_signal_index' in key:
+                    out_row.append(int(result_dict.get(key, 0)) + signal_start)
+                else:
+                    out_row.append(result_dict.get(key, ''))
+            # Chirp shape.
+            shape = []
+            chirp_shape_method = settings['chirp_shape_method']
+            if chirp_shape_method is not None:
+                shape_start = time.perf_counter()
+                if chirp_shape_method == 'zc':
+                    shape = zc_util.chirp_shape(signal, 
+                                                result_dict['peak_signal_index'],
+                                                start_index=result_dict['start_signal_index'], 
+                                                stop_index=result_dict['end_signal_index'], 
+                                                threshold=chunk['noise_level'] * settings['localmax_noise_threshold_factor'], 
+                                                min_freq_hz=settings['freq_filter_low_hz'], 
+                                                as_array=True)
+                else:
+                    shape = spectrum_util.chirp_shape(signal, 
+                                                      result_dict['peak_signal_index'],
+                                                      start_index=result_dict['start_signal_index'], 
+                                                      stop_index=result_dict['end_signal_index'], 
+                                                      jump_factor=settings['shape_jump_factor'], 
+                                                      as_array=True)
+                # Adjust time and index to the position in the file.
+                shape['time_s'] += signal_start / sampling_freq
+                shape['signal_index'] += signal_start
+                chirp_shape_s += time.perf_counter() - shape_start
+            #
+            chirps.append({'chunk_number': chunk['chunk_number'], 
+                           'metrics': out_row, 
+                           'shape': shape, 
+                           })
+        chunk['cache_counters'] = spectrum_cache.get_counters()
+        chunk['signal'] = None # Release memory.
+        chunk['stage_times']['chirp_metrics_s'] = chirp_metrics_s
+        if settings['chirp_shape_method'] is not None:
+            chunk['stage_times']['chirp_shape_s'] = chirp_shape_s
+        chunk['wall_s'] += time.perf_counter() - start_time
+        #
+        return chirps
+
+    def _merge_chirps(self, chirps):
+        """ Chirps detected in two neighbour chunks, with overlapping start/end, 
+            are merged. The one with highest peak dBFS is kept. Sorted by 
+            absolute peak signal index, which makes the result deterministic. """
+        header = dsp4bats.DbfsSpectrumUtil().chirp_metrics_header()
+        peak_col = header.index('peak_signal_index')
+        start_col = header.index('start_signal_index')
+        end_col = header.index('end_signal_index')
+        dbfs_col = header.index('peak_dbfs')
+        chirps = sorted(chirps, key=lambda chirp: (chirp['metrics'][peak_col], chirp['chunk_number']))
+        merged = []
+        for chirp in chirps:
+            if len(merged) > 0:
+                last = merged[-1]
+                if (last['chunk_number'] != chirp['chunk_number']) and \
+                   (chirp['metrics'][start_col] <= last['metrics'][end_col]) and \
+                   (chirp['metrics'][end_col] >= last['metrics'][start_col]):
+                    if chirp['metrics'][dbfs_col] > last['metrics'][dbfs_col]:
+                        merged[-1] = chirp
+                    continue
+            merged.append(chirp)
+        return merged
+    
+    def summarize_activity(self, detector_id=None):
+        """ Sum of all "*_Activity.npz" files in scanning_results_dir, optionally 
+            for one detector only. No metrics files are read. """
+        from dsp4bats import activity_aggregation
+        aggregates = []
+        for activity_path in sorted(pathlib.Path(self.scanning_results_dir).glob('*_Activity.npz')):
+            aggregate = activity_aggregation.ActivityAggregate.load(activity_path)
+            if (detector_id is None) or (detector_id in aggregate.detectors):
+                aggregates.append(aggregate)
+        summary = activity_aggregation.merge_aggregates(aggregates)
+        self.report_progress('activity_summarized', files=summary.counters['files'], 
+                             chirps=summary.counters['chirps'])
+        return summary
+
+    def plot_results(self, 
+                     figsize_width=16, 
+                     figsize_height=10, 
+                     dpi=150,
+                     plot_min_time_s=0.0, # None: Automatic. 
+                     plot_max_time_s=None, # None: Automatic. 
+                     plot_max_freq_khz=200, # None: Automatic. 
+                     plot_max_interval_s=0.2, # None: Automatic. 
+                     plot_max_duration_ms=20, # None: Automatic. 
+                     plot_workers=1, # Number of processes used for rendering.
+                     skip_up_to_date=True, # Skip plots newer than the metrics, with the same settings.
+                    ):
+        """ Plots "*_Metrics.txt" as "*_Plot.png". See plot_utils.MetricsPlotRenderer. """
+        from dsp4bats import plot_utils # Imports matplotlib when used.
+        #
+        renderer_settings = {'sampling_freq': self.sampling_freq,
+                             'figsize_width': figsize_width,
+                             'figsize_height': figsize_height,
+                             'dpi': dpi,
+                             'plot_min_time_s': plot_min_time_s,
+                             'plot_max_time_s': plot_max_time_s,
+                             'plot_max_freq_khz': plot_max_freq_khz,
+                             'plot_max_interval_s': plot_max_interval_s,
+                             'plot_max_duration_ms': plot_max_duration_ms,
+                             }
+        file_pairs = []
+        for file_path in self.files_df.abs_file_path:
+            # Prepare file pathes.
+            metrics_file_path = pathlib.Path(file_path).stem + '_Metrics.txt'
+            metrics_file_path = pathlib.Path(self.scanning_results_dir, metrics_file_path)
+            plot_file_path = pathlib.Path(file_path).stem + '_Plot.png'
+            plot_file_path = pathlib.Path(self.scanning_results_dir, plot_file_path)
+            file_pairs.append((metrics_file_path, plot_file_path))
+        #
+        for metrics_file_path, plot_file_path, created in plot_utils.render_plots(
+                                                file_pairs, renderer_settings,
+                                                workers=plot_workers,
+                                                skip_up_to_date=skip_up_to_date):
+            if self.debug:
+                print('Plot to file: ', plot_file_path, '  created: ', created)
+            if created:
+                self.report_progress('plot_created', file=str(plot_file_path))
+            else:
+                self.report_progress('plot_skipped', file=str(plot_file_path))
+    
+    def export_chirp_snippets(self, archive_file_path=None, margin_s=0.002):
+        """ Adds audio snippets for all chirps in the "*_Metrics.txt" files to one
+            archive file. Chirps already in the archive are skipped. 
+            See chirp_archive.ChirpSnippetArchive. """
+        if archive_file_path is None:
+            archive_file_path = str(pathlib.Path(self.scanning_results_dir, 
+                                                 'chirp_snippets.chirps'))
+        with dsp4bats.ChirpSnippetArchive(archive_file_path, mode='a', 
+                                          sampling_freq=self.sampling_freq) as archive:
+            for file_path in self.files_df.abs_file_path:
+                metrics_file_path = pathlib.Path(file_path).stem + '_Metrics.txt'
+                metrics_file_path = pathlib.Path(self.scanning_results_dir, metrics_file_path)
+                if not metrics_file_path.exists():
+                    continue
+                added = archive.add_from_metrics(file_path, metrics_file_path, margin_s=margin_s)
+                if self.debug:
+                    print('Snippets added: ', added, '  from: ', file_path)
+            snippets = len(archive)
+        self.report_progress('snippets_exported', file=str(archive_file_path), snippets=snippets)
+    
+    def plot_positions_on_map(self, map_file_path=None):
+        """ Plots positions on an interactive OpenStreetMap by using the folium library. 
+            Note: A map can only be created if lat/long is in file name. """
+        import pandas as pd # Only needed for maps.
+        folium_installed = True
+        try:
+            import folium # For maps.
+        except:
+            folium_installed = False
+        if folium_installed == False:
+            if self.debug:
+                print('\n', 'Warning: Position map not created. Folium is not installed.', '\n')
+            return
+        # Create name if not specified.
+        if map_file_path is None:
+            map_file_path=str(pathlib.Path(self.scanning_results_dir, 
+                                           'positions_map.html'))        
+        # Remove rows with no position.
+        files_with_pos_df = pd.DataFrame(self.files_df)
+        files_with_pos_df.latlong_str.replace('', np.nan, inplace=True)
+        files_with_pos_df.dropna(subset=['latlong_str'], inplace=True) 
+        if len(files_with_pos_df) > 0:
+            # Group by positions and count files at each position.
+            distinct_df = pd.DataFrame(
+                    {'file_count' : files_with_pos_df.groupby( ['latlong_str', 
+                                                                'latitude_dd', 
+                                                                'longitude_dd']).size()
+                    }).reset_index()
+            # Add a column for description to be shown when hovering over point in map.
+            distinct_df['description'] = 'Pos: ' + distinct_df['latlong_str'] + \
+                                         ' Count: ' + distinct_df['file_count'].astype(str)
+            # Use the mean value as center for the map.
+            center_lat = distinct_df.latitude_dd.mean()
+            center_long = distinct_df.longitude_dd.mean()
+            # Create map object.
+            map_osm = folium.Map(location=[center_lat, center_long], zoom_start=8)
+            # Loop over positions an create markers.
+            for long, lat, desc in zip(distinct_df.longitude_dd.values,
+                                     distinct_df.latitude_dd.values,
+                                     distinct_df.description.values):
+                # The description column is used for popup messages.
+                marker = folium.Marker([lat, long], popup=desc).add_to(map_osm)            
+            # Write to html file.
+            map_osm.save(map_file_path)
+            self.report_progress('map_created', file=str(map_file_path))
+            if self.debug:
+                print('Position map saved here: ', map_file_path)
+        else:
+            if self.debug:
+                print('\n', 'Warning: Position map not created. Lat/long positions are missing.', '\n')
+    
+
+
+# === MAIN ===    
+if __name__ == "__main__":
+    """ """
+
+    print('Batfile scanner started. ',  datetime.datetime.now())
+    
+    #scanner = dsp4bats.BatfilesScanner(
+    scanner = BatfilesScanner(
+                batfiles_dir='../data/batfiles',
+                scanning_results_dir='../data/batfiles_results',
+                sampling_freq= 384000, 
+#                 sampling_freq= 500000, 
+                debug=True) # True: Print progress information.
+        
+    # Get files.
+    scanner.create_list_of_files()
+    
+    # Scan all files and extract metrics.
+    print('\n', 'Scanning files. ',  datetime.datetime.now(), '\n')
+    scanner.scan_files(
+                # Time domain parameters.
+                time_filter_low_limit_hz=30000, # Lower limit for highpass or bandpass filter.
+                time_filter_high_limit_hz=None,  # Upper limit for lowpass or bandpass filter.
+                localmax_noise_threshold_factor=3.0, # Multiplies the detected noise level by this factor. 
+                localmax_jump_factor=1000, # 1000 gives 1 ms jumps, 2000 gives 0.5 ms jumps.
+                localmax_frame_length=1024, # Frame size to smooth the signal.
+                # Frequency domain parameters.
+                freq_window_size=128, # 
+                freq_filter_low_hz=30000, # Don't use peaks below this limit. 
+                freq_threshold_below_peak_db=20.0, # Threshold calculated in relation to chirp peak level.
+                freq_threshold_dbfs =-50.0, # Absolute threshold in dbms. 
+                freq_jump_factor=2000, # 1000 gives 1 ms jumps, 2000 gives 0.5 ms jumps.  
+                freq_max_frames_to_check=100, # Max number of jump steps to calculate metrics.  
+                freq_max_silent_slots=8, # Number of jump steps to detect start/end of chirp.
+                )
+    
+    # Plot the content of the "*_Metrics.txt" files as Matplotlib plots.
+    print('\n', 'Creates plots. ',  datetime.datetime.now(), '\n')
+    scanner.plot_results(
+                # Figure settings.
+                figsize_width=16, 
+                figsize_height=10, 
+                dpi=80,
+                # Plot settings.
+                plot_min_time_s=0, # None: Automatic. 
+                plot_max_time_s=None, # 1.0, # None: Automatic. 
+                plot_max_freq_khz=200, # None: Automatic.  
+                plot_max_interval_s=0.2, # None: Automatic.  
+                plot_max_duration_ms=20, # None: Automatic.  
+                )
+    
+    # If the file names contains latitude/longitude information an 
+    # interactive map (html) will be generated.
+    print('\n', 'Creates map. ',  datetime.datetime.now(), '\n')
+    scanner.plot_positions_on_map()
+    
+    print('\n', 'Batfile scanner ended. ',  datetime.datetime.now(), '\n')
+    
+    
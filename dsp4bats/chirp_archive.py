@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import pathlib
+import numpy as np
+
+import dsp4bats
+
+class ChirpSnippetArchive():
+    """ Short int16 audio snippets around detected chirps, stored in one
+        container file, for example one for each night.
+
+        File layout, little endian:
+        - Header, 64 bytes: Magic, version, sampling frequency, and offset
+          and size for the index and the source file list.
+        - Snippet samples, appended one snippet after the other.
+        - Index: One row per snippet, see index_dtype. Offset and length
+          are in samples from the start of the snippet area.
+        - Source file list: JSON, utf-8. The index refers to it by number.
+
+        When snippets are added to an existing archive the new samples are
+        written after the old index, and a new index is written when closed.
+        The header is updated last. If the program is stopped before that the
+        old index is still valid. The whole file is memory-mapped when read,
+        so reading an index and a snippet is only a few read calls.
+    """
+    magic = b'DSP4BATS_CHIRPS_' # 16 bytes.
+    version = 1
+    header_dtype = np.dtype([('magic', 'S16'),
+                             ('version', '<u4'),
+                             ('sampling_freq', '<u4'),
+                             ('index_offset', '<u8'), # Bytes from file start.
+                             ('index_count', '<u8'),
+                             ('sources_offset', '<u8'), # Bytes from file start.
+                             ('sources_size', '<u8'), # Bytes.
+                             ('reserved', 'V8')])
+    index_dtype = np.dtype([('source', '<i4'), # Number in the source file list.
+                            ('peak_signal_index', '<i8'), # Index in the source file.
+                            ('start_signal_index', '<i8'),
+                            ('end_signal_index', '<i8'),
+                            ('snippet_signal_index', '<i8'), # Source index for the first sample.
+                            ('offset', '<i8'), # Samples from the start of the snippet area.
+                            ('length', '<i8')]) # Samples.
+
+    def __init__(self, file_path, mode='r', sampling_freq=384000):
+        """ mode: 'r' for read only, 'a' to add snippets, 'w' for a new archive. """
+        if mode not in ['r', 'a', 'w']:
+            raise UserWarning("Invalid mode. Use 'r', 'a' or 'w'.")
+        self.file_path = str(file_path)
+        self.mode = mode
+        self.sampling_freq = sampling_freq
+        self._file = None
+        self._memmap = None
+        self._index = np.empty(0, dtype=self.index_dtype)
+        self._new_rows = [] # Added since open.
+        self._sources = []
+        self._source_numbers = {}
+        self._keys = None # Key: (source, peak_signal_index). Value: Row number.
+        self._data_end = self.header_dtype.itemsize # Bytes. Where the next snippet is written.
+        #
+        if (mode == 'w') or ((mode == 'a') and not pathlib.Path(self.file_path).exists()):
+            self._file = open(self.file_path, 'w+b')
+            self._write_header(0, 0, 0, 0)
+        else:
+            self._read_header_and_index()
+            if mode == 'a':
+                self._file = open(self.file_path, 'r+b')
+                self._data_end = os.path.getsize(self.file_path)
+                self._data_end += (self._data_end - self.header_dtype.itemsize) % 2 # int16 aligned.
+
+    def __len__(self):
+        """ """
+        return len(self._index) + len(self._new_rows)
+
+    def __enter__(self):
+        """ """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ """
+        self.close()
+
+    def get_sources(self):
+        """ Source file names. The index column "source" is the position in this list. """
+        return list(self._sources)
+
+    def get_index(self):
+        """ Structured array, one row per snippet. See index_dtype. """
+        if len(self._new_rows) == 0:
+            return self._index
+        return np.concatenate((self._index, np.array(self._new_rows, dtype=self.index_dtype)))
+
+    def find(self, source_file, peak_signal_index):
+        """ Row number for a snippet, or None. """
+        if self._keys is None:
+            index = self.get_index()
+            self._keys = {(int(source), int(peak)): row for row, (source, peak)
+                          in enumerate(zip(index['source'], index['peak_signal_index']))}
+        source = self._source_numbers.get(pathlib.Path(source_file).name)
+        if source is None:
+            return None
+        return self._keys.get((source, int(peak_signal_index)))
+
+    def add_snippet(self, source_file, signal, snippet_signal_index,
+                    peak_signal_index, start_signal_index, end_signal_index):
+        """ Appends an int16 snippet. snippet_signal_index is the position of
+            signal[0] in the source file. Returns the row number. """
+        if self.mode == 'r':
+            raise UserWarning('Archive is opened read only.')
+        signal = np.asarray(signal)
+        if signal.dtype != np.int16:
+            # Convert from signal in the interval [-1.0, 1.0] to int16.
+            signal = np.int16(np.clip(signal * 32767, -32768, 32767))
+        source_name = pathlib.Path(source_file).name
+        source = self._source_numbers.get(source_name)
+        if source is None:
+            source = len(self._sources)
+            self._sources.append(source_name)
+            self._source_numbers[source_name] = source
+        #
+        self._file.seek(self._data_end)
+        self._file.write(signal.astype('<i2', copy=False).tobytes())
+        offset = (self._data_end - self.header_dtype.itemsize) // 2
+        self._data_end += len(signal) * 2
+        row = (source, peak_signal_index, start_signal_index, end_signal_index,
+               snippet_signal_index, offset, len(signal))
+        self._new_rows.append(row)
+        self._memmap = None # Mapped again, with the new size, when used.
+        if self._keys is not None:
+            self._keys[(source, int(peak_signal_index))] = len(self) - 1
+        return len(self) - 1
+
+    def get_snippet(self, row, convert_to_float=False):
+        """ Snippet as a read-only view into the memory-mapped file, int16, or
+            float64 in the interval [-1.0, 1.0] if convert_to_float is True. """
+        if self._memmap is None:
+            if self._file is not None:
+                self._file.flush()
+            samples = (os.path.getsize(self.file_path) - self.header_dtype.itemsize) // 2
+            self._memmap = np.memmap(self.file_path, dtype='<i2', mode='r',
+                                     offset=self.header_dtype.itemsize, shape=(samples,))
+        if row < len(self._index):
+            offset, length = self._index['offset'][row], self._index['length'][row]
+        else:
+            offset, length = self._new_rows[row - len(self._index)][5:7]
+        snippet = self._memmap[offset:offset + length]
+        if convert_to_float:
+            return np.divide(snippet, 32767, dtype=np.float64)
+        return snippet
+
+    def get_snippets(self, rows=None, convert_to_float=False):
+        """ List of snippets. All if rows is None. """
+        if rows is None:
+            rows = range(len(self))
+        return [self.get_snippet(row, convert_to_float) for row in rows]
+
+    def add_from_metrics(self, wave_file_path, metrics_file_path, margin_s=0.002):
+        """ Adds one snippet for each chirp in a "*_Metrics.txt" file. The snippet
+            covers start to end signal index, with margin_s added on both sides.
+            Returns the number of added snippets. """
+        from dsp4bats import plot_utils # Metrics file reader, no plotting.
+        metrics = plot_utils.read_metrics_file(metrics_file_path)
+        margin = int(margin_s * self.sampling_freq)
+        wave_reader = dsp4bats.WaveFileReader(str(wave_file_path))
+        file_length = wave_reader.get_length()
+        counter = 0
+        for peak_index, start_index, end_index in zip(metrics['peak_signal_index'].astype(np.int64),
+                                                      metrics['start_signal_index'].astype(np.int64),
+                                                      metrics['end_signal_index'].astype(np.int64)):
+            if self.find(wave_file_path, peak_index) is not None:
+                continue # Already added.
+            snippet_start = max(int(start_index) - margin, 0)
+            snippet_end = min(int(end_index) + margin, file_length)
+            wave_reader.set_position(snippet_start)
+            signal = wave_reader.read_buffer(snippet_end - snippet_start, convert_to_float=False)
+            self.add_snippet(wave_file_path, signal, snippet_start,
+                             peak_index, start_index, end_index)
+            counter += 1
+        wave_reader.close()
+        return counter
+
+    def close(self):
+        """ Writes index and source list, then the header. """
+        if self._file is None:
+            self._memmap = None
+            return
+        if len(self._new_rows) > 0:
+            index = self.get_index()
+            sources = json.dumps(self._sources).encode('utf-8')
+            index_offset = self._data_end
+            self._file.seek(index_offset)
+            self._file.write(index.tobytes())
+            sources_offset = index_offset + index.nbytes
+            self._file.write(sources)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._write_header(index_offset, len(index), sources_offset, len(sources))
+            self._index = index
+            self._new_rows = []
+        self._file.close()
+        self._file = None
+        self._memmap = None
+
+    def _write_header(self, index_offset, index_count, sources_offset, sources_size):
+        """ """
+        header = np.zeros(1, dtype=self.header_dtype)
+        header['magic'] = self.magic
+        header['version'] = self.version
+        header['sampling_freq'] = self.sampling_freq
+        header['index_offset'] = index_offset
+        header['index_count'] = index_count
+        header['sources_offset'] = sources_offset
+        header['sources_size'] = sources_size
+        self._file.seek(0)
+        self._file.write(header.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _read_header_and_index(self):
+        """ """
+        with open(self.file_path, 'rb') as archive_file:
+            header = np.frombuffer(archive_file.read(self.header_dtype.itemsize),
+                                   dtype=self.header_dtype)
+            if (len(header) != 1) or (header['magic'][0] != self.magic):
+                raise UserWarning('Not a chirp snippet archive: ' + self.file_path)
+            if header['version'][0] > self.version:
+                raise UserWarning('Unsupported archive version: ' + str(header['version'][0]))
+            self.sampling_freq = int(header['sampling_freq'][0])
+            index_count = int(header['index_count'][0])
+            if index_count > 0:
+                archive_file.seek(int(header['index_offset'][0]))
+                self._index = np.frombuffer(archive_file.read(index_count * self.index_dtype.itemsize),
+                                            dtype=self.index_dtype)
+                archive_file.seek(int(header['sources_offset'][0]))
+                self._sources = json.loads(archive_file.read(int(header['sources_size'][0])).decode('utf-8'))
+        self._source_numbers = {name: number for number, name in enumerate(self._sources)}
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import tempfile
+    print('Test started.')
+    data_dir = pathlib.Path(__file__).parent.parent / 'data'
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = pathlib.Path(temp_dir, 'night.chirps')
+        with ChirpSnippetArchive(archive_path, mode='w', sampling_freq=384000) as archive:
+            for metrics_path in sorted((data_dir / 'batfiles_results').glob('*_Metrics.txt')):
+                wave_path = data_dir / 'batfiles' / metrics_path.name.replace('_Metrics.txt', '.wav')
+                print('Added: ', archive.add_from_metrics(wave_path, metrics_path), ' from ', wave_path.name)
+        archive = ChirpSnippetArchive(archive_path)
+        index = archive.get_index()
+        row = archive.find('Mdau_TE384.wav', index['peak_signal_index'][0])
+        print('Snippets: ', len(archive), '  sources: ', archive.get_sources(),
+              '  first length: ', len(archive.get_snippet(row)))
+        archive.close()
+    print('Test ended.')
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+""" Command line interface for headless batch scanning.
+
+    Examples:
+        dsp4bats scan --batfiles-dir data/batfiles --scanning-results-dir data/batfiles_results
+                      --time-filter-low-limit-hz 30000 --jobs 4 --skip-plots
+        dsp4bats scan --config scan_settings.json
+        dsp4bats plot --batfiles-dir data/batfiles --scanning-results-dir data/batfiles_results
+        dsp4bats map --batfiles-dir data/batfiles --scanning-results-dir data/batfiles_results
+        dsp4bats watch --batfiles-dir /media/wurb/recordings --file-workers 2
+        dsp4bats worker --batfiles-dir /mnt/archive --scanning-results-dir /mnt/archive_results
+        dsp4bats snippets --batfiles-dir data/batfiles --scanning-results-dir data/batfiles_results
+        dsp4bats check --engine float32 --chunking
+
+    Progress is written as JSON lines to stdout. Other printouts go to stderr.
+    The config file is JSON with parameter names as keys, for example
+    {"sampling_freq": 500000, "freq_jump_factor": 2000}. Grouped settings can
+    be nested, for example {"chunk_settings": {"chunk_workers": 4}}, or used
+    directly. Command line flags override values in the config file. Keys that
+    no subcommand uses are reported as errors.
+"""
+
+import sys
+import os
+import json
+import argparse
+import inspect
+import subprocess
+import contextlib
+
+# Parameters for BatfilesScanner.__init__, used by all subcommands.
+SCANNER_PARAMETERS = {
+    'batfiles_dir': 'batfiles',
+    'scanning_results_dir': 'batfiles_results',
+    'sampling_freq': 384000,
+    'debug': False,
+    }
+
+def get_parameters(function, skip=()):
+    """ Parameter names and default values for a function or method. """
+    parameters = {}
+    for name, parameter in inspect.signature(function).parameters.items():
+        if (name == 'self') or (name in skip):
+            continue
+        if parameter.default is inspect.Parameter.empty:
+            continue
+        parameters[name] = parameter.default
+    return parameters
+
+def get_scan_parameters(scanner_class, skip=()):
+    """ Parameters for scan_files, with the keys in the settings groups as 
+        parameters. For example chunk_workers instead of chunk_settings. """
+    from dsp4bats import batfiles_scanner
+    parameters = get_parameters(scanner_class.scan_files, skip=batfiles_scanner.SETTINGS_GROUPS)
+    for group in batfiles_scanner.SETTINGS_GROUPS.values():
+        parameters.update(group)
+    return {name: default for name, default in parameters.items() if name not in skip}
+
+def parse_value(value_str):
+    """ Used for parameters without a typed default value, for example None. """
+    if value_str.lower() in ['none', 'null']:
+        return None
+    for value_type in [int, float]:
+        try:
+            return value_type(value_str)
+        except ValueError:
+            pass
+    return value_str
+
+def parse_bool(value_str):
+    """ """
+    if value_str.lower() in ['true', 'yes', '1', 'on']:
+        return True
+    if value_str.lower() in ['false', 'no', '0', 'off']:
+        return False
+    raise argparse.ArgumentTypeError('Boolean value expected: ' + value_str)
+
+def add_parameter_flags(parser, parameters):
+    """ One flag for each parameter. Type from the default value. """
+    for name, default in parameters.items():
+        flag = '--' + name.replace('_', '-')
+        if isinstance(default, bool):
+            value_type = parse_bool
+        elif isinstance(default, int):
+            value_type = int
+        elif isinstance(default, float):
+            value_type = float
+        else:
+            value_type = parse_value
+        parser.add_argument(flag, dest=name, type=value_type, default=None,
+                            metavar='VALUE', help='Default: ' + str(default))
+
+def create_parser():
+    """ """
+    # BatfilesScanner is only inspected here. Plotting libraries are not imported.
+    from dsp4bats import batfiles_scanner
+    scanner_class = batfiles_scanner.BatfilesScanner
+    #
+    parser = argparse.ArgumentParser(prog='dsp4bats',
+                                     description='Scan bat sound files and extract chirp metrics.')
+    subparsers = parser.add_subparsers(dest='command')
+    # Scan.
+    scan_parser = subparsers.add_parser('scan', help='Extract metrics to "*_Metrics.txt" files.')
+    add_parameter_flags(scan_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(scan_parser, get_scan_parameters(scanner_class, 
+                                                         skip=['chunk_workers', 'signal_dtype']))
+    scan_parser.add_argument('--jobs', type=int, default=None,
+                             help='Number of threads used for each file. Default: 1')
+    scan_parser.add_argument('--dtype', choices=['float32', 'float64'], default=None,
+                             help='Signal data type. Default: float64')
+    scan_parser.add_argument('--skip-plots', action='store_true',
+                             help='Only extract metrics. Plotting libraries are not imported.')
+    # Watch.
+    watch_parser = subparsers.add_parser('watch', help='Scan new files in batfiles_dir as they are finished.')
+    add_parameter_flags(watch_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(watch_parser, get_scan_parameters(scanner_class))
+    add_parameter_flags(watch_parser, get_parameters(scanner_class.watch_directory,
+                                                     skip=['scan_settings']))
+    # Worker. Several workers, on one or more machines, share the files.
+    worker_parser = subparsers.add_parser('worker', help='Scan files shared with other workers, with leases.')
+    add_parameter_flags(worker_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(worker_parser, get_scan_parameters(scanner_class))
+    add_parameter_flags(worker_parser, get_parameters(scanner_class.scan_shared,
+                                                      skip=['scan_settings']))
+    # Plot.
+    plot_parser = subparsers.add_parser('plot', help='Plot "*_Metrics.txt" files as "*_Plot.png".')
+    add_parameter_flags(plot_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(plot_parser, get_parameters(scanner_class.plot_results))
+    # Map.
+    map_parser = subparsers.add_parser('map', help='Create a html map if positions are in file names.')
+    add_parameter_flags(map_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(map_parser, get_parameters(scanner_class.plot_positions_on_map))
+    # Snippets.
+    snippets_parser = subparsers.add_parser('snippets', help='Export chirp audio snippets to one archive file.')
+    add_parameter_flags(snippets_parser, SCANNER_PARAMETERS)
+    add_parameter_flags(snippets_parser, get_parameters(scanner_class.export_chirp_snippets))
+    # Check.
+    from dsp4bats import reference_check
+    check_parser = subparsers.add_parser('check', help='Check startup time, and compare a DSP engine with the reference implementations.')
+    check_parser.add_argument('--engine', choices=sorted(reference_check.ENGINES), default='default',
+                              help='Default: default')
+    check_parser.add_argument('--batfiles-dir', dest='batfiles_dir', default='data/batfiles',
+                              help='Default: data/batfiles')
+    check_parser.add_argument('--scanning-results-dir', dest='scanning_results_dir', 
+                              default='data/batfiles_results', help='Default: data/batfiles_results')
+    check_parser.add_argument('--chunking', action='store_true',
+                              help='Also scan with small chunks, as used with a memory budget.')
+    # Common.
+    for sub_parser in [scan_parser, watch_parser, worker_parser, plot_parser, map_parser, snippets_parser, check_parser]:
+        sub_parser.add_argument('--config', default=None,
+                                help='JSON file with parameters. Flags override the file.')
+        sub_parser.add_argument('--profile', default=None, nargs='?', const='-', metavar='FILE',
+                                help='Profile with cProfile. Stats to stderr, or FILE if given.')
+    return parser
+
+# "import dsp4bats" and create_parser must not load these, and must be fast.
+STARTUP_HEAVY_MODULES = ['scipy', 'pandas', 'matplotlib']
+STARTUP_BUDGET_S = 0.5
+
+_STARTUP_CODE = """
+import sys, time, json
+start_time = time.perf_counter()
+import dsp4bats
+from dsp4bats import cli
+cli.create_parser()
+print(json.dumps({'time_s': time.perf_counter() - start_time, 'modules': sorted(sys.modules)}))
+"""
+
+def check_startup(budget_s=STARTUP_BUDGET_S):
+    """ Imports dsp4bats and creates the parser in a new interpreter. Returns a
+        report dict. Raises UserWarning if a heavy module is loaded or if it
+        takes more than budget_s. """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_dir, env.get('PYTHONPATH')]))
+    output = subprocess.run([sys.executable, '-c', _STARTUP_CODE], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    loaded = [name for name in STARTUP_HEAVY_MODULES if name in result['modules']]
+    report = {'event': 'startup_check', 'time_s': round(result['time_s'], 3),
+              'budget_s': budget_s, 'heavy_modules': loaded}
+    if loaded:
+        raise UserWarning('Loaded at startup: ' + ', '.join(loaded))
+    if result['time_s'] > budget_s:
+        raise UserWarning('Startup took ' + str(report['time_s']) + ' s, budget: ' + str(budget_s) + ' s.')
+    return report
+
+def get_all_parameters(scanner_class):
+    """ Parameter names used by any subcommand. """
+    names = set(SCANNER_PARAMETERS) | set(get_scan_parameters(scanner_class))
+    for function in [scanner_class.watch_directory, scanner_class.scan_shared, 
+                     scanner_class.plot_results, scanner_class.plot_positions_on_map, 
+                     scanner_class.export_chirp_snippets]:
+        names |= set(get_parameters(function, skip=['scan_settings']))
+    return names
+
+def read_config(args, known_names):
+    """ Reads the config file. Nested settings groups, for example "chunk_settings", 
+        are flattened. Raises UserWarning for keys not used by any subcommand, 
+        they are often misspelled parameter names. """
+    from dsp4bats import batfiles_scanner
+    config = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            for name, value in json.load(config_file).items():
+                if isinstance(value, dict) and (name in batfiles_scanner.SETTINGS_GROUPS):
+                    config.update(value)
+                else:
+                    config[name] = value
+    unknown = sorted(set(config) - set(known_names))
+    if unknown:
+        raise UserWarning('Unknown keys in config file ' + args.config + ': ' + ', '.join(unknown))
+    return config
+
+def collect_settings(args, parameters, config):
+    """ Defaults, then config file, then command line flags. """
+    settings = dict(parameters)
+    for name, value in config.items():
+        if name in settings:
+            settings[name] = value
+    for name in parameters:
+        value = getattr(args, name, None)
+        if value is not None:
+            settings[name] = value
+    return settings
+
+def run_command(args, progress_callback):
+    """ """
+    if args.command == 'check':
+        progress_callback(check_startup())
+        from dsp4bats import reference_check
+        reports = reference_check.run_check(batfiles_dir=args.batfiles_dir, 
+                                            scanning_results_dir=args.scanning_results_dir, 
+                                            engine=args.engine, 
+                                            chunking=args.chunking, 
+                                            progress_callback=progress_callback)
+        return all(report['passed'] for report in reports)
+    #
+    from dsp4bats import batfiles_scanner
+    scanner_class = batfiles_scanner.BatfilesScanner
+    #
+    # Keys for other subcommands are allowed, the same file can be used for all.
+    config = read_config(args, get_all_parameters(scanner_class))
+    scanner_settings = collect_settings(args, SCANNER_PARAMETERS, config)
+    scanner = scanner_class(progress_callback=progress_callback, **scanner_settings)
+    scanner.create_list_of_files()
+    #
+    if args.command == 'scan':
+        scan_settings = collect_settings(args, get_scan_parameters(scanner_class), config)
+        if args.jobs is not None:
+            scan_settings['chunk_workers'] = args.jobs
+        if args.dtype is not None:
+            scan_settings['signal_dtype'] = args.dtype
+        scanner.scan_files(**batfiles_scanner.group_scan_settings(scan_settings))
+        if not args.skip_plots:
+            os.environ.setdefault('MPLBACKEND', 'Agg') # Headless.
+            scanner.plot_results()
+    elif args.command == 'watch':
+        scan_settings = collect_settings(args, get_scan_parameters(scanner_class), config)
+        watch_settings = collect_settings(args, get_parameters(scanner_class.watch_directory, 
+                                                               skip=['scan_settings']), config)
+        scanner.watch_directory(scan_settings=scan_settings, **watch_settings)
+    elif args.command == 'worker':
+        scan_settings = collect_settings(args, get_scan_parameters(scanner_class), config)
+        worker_settings = collect_settings(args, get_parameters(scanner_class.scan_shared, 
+                                                                skip=['scan_settings']), config)
+        scanner.scan_shared(scan_settings=scan_settings, **worker_settings)
+    elif args.command == 'plot':
+        os.environ.setdefault('MPLBACKEND', 'Agg') # Headless.
+        plot_settings = collect_settings(args, get_parameters(scanner_class.plot_results), config)
+        scanner.plot_results(**plot_settings)
+    elif args.command == 'map':
+        map_settings = collect_settings(args, get_parameters(scanner_class.plot_positions_on_map), config)
+        scanner.plot_positions_on_map(**map_settings)
+    elif args.command == 'snippets':
+        snippets_settings = collect_settings(args, get_parameters(scanner_class.export_chirp_snippets), config)
+        scanner.export_chirp_snippets(**snippets_settings)
+
+def main(argv=None):
+    """ Entry point for the "dsp4bats" command. """
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    # Stdout is used for JSON lines only.
+    json_out = sys.stdout
+    def progress_callback(progress):
+        json_out.write(json.dumps(progress, default=str) + '\n')
+        json_out.flush()
+    #
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.profile is not None:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                result = run_command(args, progress_callback)
+            finally:
+                profiler.disable()
+                if args.profile == '-':
+                    pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+                else:
+                    profiler.dump_stats(args.profile)
+        else:
+            result = run_command(args, progress_callback)
+    return 1 if result is False else 0 # False: Check failed.
+
+
+# === MAIN ===
+if __name__ == "__main__":
+    sys.exit(main())
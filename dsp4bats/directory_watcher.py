@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import time
+import pathlib
+import threading
+import concurrent.futures
+
+from dsp4bats import sound_stream_manager
+
+class DirectoryWatcherSource(sound_stream_manager.SoundSourceBase):
+    """ Sound source that watches a directory for new wave files, for example
+        from a WURB recorder. A file is pushed, as an absolute path string,
+        when its size and modification time have been unchanged for
+        stable_time_s. The directory is polled with os.scandir, which only
+        reads directory entries and works on network shares where inotify
+        is not available. None is pushed when stopped.
+    """
+    def __init__(self,
+                 dir_path,
+                 poll_interval_s=0.5,
+                 stable_time_s=2.0, # Size and mtime unchanged this long.
+                 include_existing=False, # False: Finished files in the directory at start are ignored.
+                 file_suffixes=('.wav',),
+                 max_files=None, # Stops after this number of files. None: No limit.
+                 ):
+        """ """
+        super().__init__()
+        self.dir_path = str(dir_path)
+        self.poll_interval_s = poll_interval_s
+        self.stable_time_s = stable_time_s
+        self.include_existing = include_existing
+        self.file_suffixes = tuple(suffix.lower() for suffix in file_suffixes)
+        self.max_files = max_files
+        self._stop_event = threading.Event()
+        self._candidates = {} # Path: (size, mtime_ns, time when last changed).
+        self._done = set()
+
+    def stop(self):
+        """ """
+        self._active = False
+        self._stop_event.set()
+
+    def scan_directory(self):
+        """ Returns a dict with path: (size, mtime_ns) for matching files. """
+        entries = {}
+        try:
+            with os.scandir(self.dir_path) as dir_entries:
+                for entry in dir_entries:
+                    if not entry.name.lower().endswith(self.file_suffixes):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue # Removed or renamed.
+                    entries[os.path.abspath(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass # Not created yet.
+        return entries
+
+    def get_stable_files(self, now=None):
+        """ One poll. Returns files that are finished since the last poll. """
+        now = time.monotonic() if now is None else now
+        stable_files = []
+        entries = self.scan_directory()
+        for path, (size, mtime_ns) in entries.items():
+            if path in self._done:
+                continue
+            old = self._candidates.get(path)
+            if (old is None) or (old[0] != size) or (old[1] != mtime_ns):
+                self._candidates[path] = (size, mtime_ns, now)
+                continue
+            if (size > 44) and (now - old[2] >= self.stable_time_s): # Wave header is 44 bytes.
+                stable_files.append(path)
+                self._done.add(path)
+                del self._candidates[path]
+        # Forget removed files.
+        for path in list(self._candidates):
+            if path not in entries:
+                del self._candidates[path]
+        return sorted(stable_files)
+
+    def source_exec(self):
+        """ """
+        self._active = True
+        self._stop_event.clear()
+        if not self.include_existing:
+            # Files modified within stable_time_s may still be written, for example
+            # if restarted during a recording. They are handled as new files.
+            now = time.time()
+            for path, (size, mtime_ns) in self.scan_directory().items():
+                if now - mtime_ns / 1e9 >= self.stable_time_s:
+                    self._done.add(path)
+        file_counter = 0
+        while self._active:
+            for path in self.get_stable_files():
+                self.push_item(path)
+                file_counter += 1
+                if (self.max_files is not None) and (file_counter >= self.max_files):
+                    self._active = False
+                    break
+            if self._active:
+                self._stop_event.wait(self.poll_interval_s)
+        self.push_item(None) # Terminate.
+
+
+class MetricsScanProcess(sound_stream_manager.SoundProcessBase):
+    """ Scans files from a DirectoryWatcherSource with BatfilesScanner.scan_file.
+        Metrics files are written by the scanner. At most file_workers files
+        are scanned at the same time. When all workers are busy new files wait
+        in the source queue. A dict with file and timing is pushed for each
+        scanned file.
+    """
+    def __init__(self, scanner, settings, file_workers=1):
+        """ settings: As returned by BatfilesScanner.get_scan_settings. """
+        super().__init__()
+        self.scanner = scanner
+        self.settings = settings
+        self.file_workers = max(int(file_workers), 1)
+
+    def process_exec(self):
+        """ """
+        self._active = True
+        workers_available = threading.Semaphore(self.file_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.file_workers) as executor:
+            while self._active:
+                item = self.pull_item()
+                if item is None:
+                    self._active = False
+                    break
+                workers_available.acquire()
+                future = executor.submit(self._scan, item)
+                future.add_done_callback(lambda _future: workers_available.release())
+        self.push_item(None) # Terminate, after all files are scanned.
+
+    def _scan(self, file_path):
+        """ """
+        start_time = time.monotonic()
+        result = {'file': file_path}
+        try:
+            self.scanner.scan_file(file_path, self.settings)
+        except Exception as e:
+            result['error'] = str(e)
+        result['scan_time_s'] = round(time.monotonic() - start_time, 3)
+        self.push_item(result)
+
+
+class ScanResultTarget(sound_stream_manager.SoundTargetBase):
+    """ Calls result_callback with each result dict from MetricsScanProcess. """
+    def __init__(self, result_callback=None):
+        """ """
+        super().__init__()
+        self.result_callback = result_callback
+        self.results = []
+
+    def target_exec(self):
+        """ """
+        self._active = True
+        while self._active:
+            item = self.pull_item()
+            if item is None:
+                self._active = False # Terminated.
+            else:
+                self.results.append(item)
+                if self.result_callback is not None:
+                    self.result_callback(item)
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import shutil
+    import tempfile
+    import dsp4bats
+    print('Test started.')
+    data_dir = pathlib.Path(__file__).parent.parent / 'data' / 'batfiles'
+    with tempfile.TemporaryDirectory() as temp_dir:
+        watch_dir = pathlib.Path(temp_dir, 'recordings')
+        watch_dir.mkdir()
+        scanner = dsp4bats.BatfilesScanner(batfiles_dir=str(watch_dir),
+                                           scanning_results_dir=str(pathlib.Path(temp_dir, 'results')))
+        # Recording in progress when the watcher is started. Scanned when finished.
+        wave_files = sorted(data_dir.glob('*.wav'))
+        shutil.copy(str(wave_files[0]), str(watch_dir))
+        def copy_files():
+            for file_path in wave_files[1:]:
+                time.sleep(0.2)
+                shutil.copy(str(file_path), str(watch_dir))
+        threading.Thread(target=copy_files).start()
+        start_time = time.monotonic()
+        results = scanner.watch_directory(poll_interval_s=0.1, stable_time_s=0.3,
+                                          file_workers=2, max_files=3)
+        for result in results:
+            print(pathlib.Path(result['file']).name, '  scan time (s): ', result['scan_time_s'])
+        print('Metrics files: ', sorted(path.name for path in pathlib.Path(temp_dir, 'results').glob('*')))
+        print('Total time (s): ', round(time.monotonic() - start_time, 2))
+    print('Test ended.')
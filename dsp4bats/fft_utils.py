@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import threading
+import importlib.util
+import numpy as np
+#
+# scipy.fft is available in scipy >= 1.4. It is only loaded when used, to keep
+# "import dsp4bats" and the command line parser fast.
+scipy_fft_installed = importlib.util.find_spec('scipy') is not None
+
+class FftBackend():
+    """ Real FFT used by the spectrum utils. Uses scipy.fft, with a number
+        of worker threads for batches of frames, if available. Otherwise numpy.fft.
+        The threads are used inside scipy.fft, no Python level parallelism is needed.
+        Single frames (1D) always use numpy.fft, it has less overhead per call.
+    """
+    def __init__(self,
+                 workers=-1, # -1: Use all cores. Only used by scipy.fft.
+                 use_scipy=True,
+                 ):
+        """ """
+        self.workers = workers
+        self.use_scipy = use_scipy and scipy_fft_installed
+
+    def rfft(self, frames, axis=-1):
+        """ Real FFT over the last axis. Rows in a 2D array are transformed in parallel. """
+        if self.use_scipy and (np.ndim(frames) > 1):
+            import scipy.fft
+            return scipy.fft.rfft(frames, axis=axis, workers=self.workers)
+        return np.fft.rfft(frames, axis=axis)
+
+    def irfft(self, spectrum, n=None, axis=-1):
+        """ """
+        if self.use_scipy and (np.ndim(spectrum) > 1):
+            import scipy.fft
+            return scipy.fft.irfft(spectrum, n=n, axis=axis, workers=self.workers)
+        return np.fft.irfft(spectrum, n=n, axis=axis)
+
+
+# Process-wide default backend.
+_default_backend = FftBackend()
+
+def get_fft_backend():
+    """ """
+    return _default_backend
+
+def set_fft_backend(backend):
+    """ Replace the default backend used by new DbfsSpectrumUtil objects. """
+    global _default_backend
+    _default_backend = backend
+
+
+# Process-wide cache for windows. Key: (function, size, beta).
+_window_cache = {}
+_window_cache_lock = threading.Lock()
+
+def get_window(window_function='kaiser', window_size=256, kaiser_beta=14):
+    """ Returns a cached window and its max dBFS value as (window, dbfs_max).
+        The window array is read-only since it is shared. """
+    name = window_function.lower()
+    if name in ['hanning', 'hann']:
+        key = ('hann', window_size, None)
+    elif name in ['hann_periodic', 'periodic_hann']:
+        # Periodic (DFT-even) Hann. Can be applied in the frequency domain.
+        key = ('hann_periodic', window_size, None)
+    elif name in ['blackman', 'black']:
+        key = ('blackman', window_size, None)
+    elif name in ['blackmanharris', 'blackman-harris', 'blackh']:
+        key = ('blackmanharris', window_size, None)
+    elif name in ['kaiser']:
+        key = ('kaiser', window_size, kaiser_beta)
+    else:
+        raise UserWarning("Invalid window function name.")
+    #
+    with _window_cache_lock:
+        if key not in _window_cache:
+            import scipy.signal.windows # Only loaded when a window is created.
+            if key[0] == 'hann':
+                window = np.hanning(window_size)
+            elif key[0] == 'hann_periodic':
+                window = scipy.signal.windows.hann(window_size, sym=False)
+            elif key[0] == 'blackman':
+                window = np.blackman(window_size)
+            elif key[0] == 'blackmanharris':
+                window = scipy.signal.windows.blackmanharris(window_size)
+            else:
+                window = scipy.signal.windows.kaiser(window_size, kaiser_beta)
+            window.setflags(write=False)
+            # Max db value in window. DBFS = db full scale. Half spectrum used.
+            dbfs_max = np.sum(window) / 2
+            _window_cache[key] = (window, dbfs_max)
+        #
+        return _window_cache[key]
+
+def spectrum_to_dbfs(spectrum, dbfs_max, out=None):
+    """ Converts a complex spectrum to dBFS, 20 * log10(abs(spectrum) / dbfs_max).
+        All steps are done in place in "out", which can be reused between calls. 
+        Note: Squared magnitude (power) followed by 10 * log10 was tested, but
+        was slower than numpy's abs() for both single frames and batches. """
+    if out is None:
+        out = np.empty(spectrum.shape, dtype=np.float64)
+    np.abs(spectrum, out=out)
+    np.divide(out, dbfs_max, out=out)
+    np.log10(out, out=out)
+    np.multiply(out, 20.0, out=out)
+    #
+    return out
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    window, dbfs_max = get_window('kaiser', 128, 14)
+    print('Same object from cache: ', window is get_window('kaiser', 128, 14)[0])
+    frames = np.random.randn(1000, 128) * window
+    spectrum = get_fft_backend().rfft(frames)[:, :-1]
+    dbfs = spectrum_to_dbfs(spectrum, dbfs_max)
+    reference = 20 * np.log10(np.abs(spectrum) / dbfs_max)
+    print('Max diff from reference: ', np.max(np.abs(dbfs - reference)))
+    print('Test ended.')
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import numpy as np
+
+class Int16ActivityDetector():
+    """ Activity detector working directly on int16 buffers, as read with
+        WaveFileReader.read_buffer(convert_to_float=False). No float arrays are
+        created per buffer, which saves time and memory on small CPUs:
+        - Band signal: FIR high pass filter with integer taps, int32 arithmetic.
+        - Envelope: Sum of absolute values per frame, accumulated in int32.
+        - Thresholds: Calculated from dBFS once, as integers in envelope units.
+        - Peaks: Local max on the integer envelope.
+        A buffer is worth keeping if at least min_active_frames frames are
+        above threshold. The float based detection can then be used on the
+        buffers that are kept.
+    """
+    def __init__(self,
+                 sampling_freq=384000,
+                 low_freq_hz=15000, # High pass filter cut off.
+                 threshold_dbfs=-50.0, # Level for a sine in the pass band.
+                 noise_threshold_factor=None, # Also above median envelope times this. None: Not used.
+                 frame_length=None, # Samples per envelope frame. Default = 1 ms.
+                 min_active_frames=1,
+                 filter_taps=31,
+                 coeff_bits=12, # Taps are scaled by 2**coeff_bits.
+                 ):
+        """ """
+        self.sampling_freq = sampling_freq
+        self.frame_length = frame_length if frame_length is not None else int(sampling_freq / 1000)
+        self.min_active_frames = min_active_frames
+        self.noise_threshold_factor = noise_threshold_factor
+        self.coeff_bits = coeff_bits
+        # Integer FIR high pass. Windowed sinc, spectral inversion. Only done once.
+        self.taps = None
+        if low_freq_hz:
+            n = np.arange(filter_taps) - (filter_taps - 1) / 2
+            lowpass = np.sinc(2 * low_freq_hz / sampling_freq * n) * np.hamming(filter_taps)
+            highpass = -lowpass / np.sum(lowpass)
+            highpass[(filter_taps - 1) // 2] += 1.0
+            self.taps = np.round(highpass * 2 ** coeff_bits).astype(np.int32)
+            # Max band value must fit in int32 before it is scaled back.
+            if 32768 * int(np.sum(np.abs(self.taps))) >= 2 ** 31:
+                raise UserWarning('Too many coeff_bits for int32 accumulation.')
+        # Threshold as sum of absolute values over a frame. The mean absolute
+        # value of a sine with amplitude A is 2A/pi.
+        amplitude = 32767 * 10 ** (threshold_dbfs / 20)
+        self.threshold = int(round(amplitude * 2 / np.pi * self.frame_length))
+        if 32768 * self.frame_length >= 2 ** 31:
+            raise UserWarning('Too long frame_length for int32 accumulation.')
+
+    def band_signal(self, signal):
+        """ High pass filtered int16 signal, as int32. """
+        signal = np.asarray(signal)
+        if signal.dtype != np.int16:
+            raise UserWarning('Signal must be int16.')
+        band = signal.astype(np.int32)
+        if self.taps is not None:
+            band = np.convolve(band, self.taps, mode='same') # Integer arithmetic.
+            np.right_shift(band, self.coeff_bits, out=band)
+        return band
+
+    def envelope(self, signal):
+        """ Sum of absolute band values for each frame, int32. """
+        band = self.band_signal(signal)
+        np.abs(band, out=band)
+        frames = len(band) // self.frame_length
+        return band[:frames * self.frame_length].reshape(frames, self.frame_length).sum(axis=1, dtype=np.int32)
+
+    def get_threshold(self, envelope):
+        """ Integer threshold for the envelope. """
+        threshold = self.threshold
+        if (self.noise_threshold_factor is not None) and (len(envelope) > 0):
+            middle = len(envelope) // 2
+            median = int(np.partition(envelope, middle)[middle])
+            threshold = max(threshold, int(median * self.noise_threshold_factor))
+        return threshold
+
+    def detect(self, signal):
+        """ Returns (keep, peaks). keep is True if the buffer contains activity.
+            peaks are signal indexes, the center of frames with local max in
+            the envelope above threshold. Can be used as peak positions in
+            chirp_metrics after conversion to float. Buffers shorter than one 
+            frame, for example the empty buffer at end of file, are not kept. """
+        if len(signal) < self.frame_length:
+            return False, np.empty(0, dtype=np.int64)
+        envelope = self.envelope(signal)
+        threshold = self.get_threshold(envelope)
+        above = envelope > threshold
+        keep = int(np.count_nonzero(above)) >= self.min_active_frames
+        if len(envelope) < 3:
+            return keep, np.flatnonzero(above) * self.frame_length + self.frame_length // 2
+        local_max = np.zeros(len(envelope), dtype=bool)
+        local_max[1:-1] = (envelope[1:-1] > envelope[:-2]) & (envelope[1:-1] >= envelope[2:])
+        local_max &= above
+        peaks = np.flatnonzero(local_max) * self.frame_length + self.frame_length // 2
+        return keep, peaks
+
+    def keep_buffer(self, signal):
+        """ """
+        return self.detect(signal)[0]
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import pathlib
+    import dsp4bats
+    print('Test started.')
+    data_dir = pathlib.Path(__file__).parent.parent / 'data' / 'batfiles'
+    detector = Int16ActivityDetector(sampling_freq=384000, low_freq_hz=30000, threshold_dbfs=-40.0)
+    for file_path in sorted(data_dir.glob('*.wav')):
+        wave_reader = dsp4bats.WaveFileReader(str(file_path))
+        signal = wave_reader.read_buffer(convert_to_float=False)
+        wave_reader.close()
+        keep, peaks = detector.detect(signal)
+        print(file_path.name, '  keep: ', keep, '  peaks: ', len(peaks))
+    silence = np.zeros(384000, dtype=np.int16)
+    print('Silence, keep: ', detector.keep_buffer(silence))
+    print('Empty buffer (end of file): ', detector.detect(np.empty(0, dtype=np.int16)))
+    print('Test ended.')
@@ -4,8 +4,10 @@
 # Copyright (c) 2017-2018 Arnold Andreasson 
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import collections
 import numpy as np
-import scipy.signal
+
+from dsp4bats import fft_utils
 
 class DbfsSpectrumUtil():
     """ """
@@ -14,27 +16,20 @@ class DbfsSpectrumUtil():
                  window_function='kaiser',
                  kaiser_beta=14,
                  sampling_freq=384000,
+                 fft_backend=None, # None: Use the default backend in fft_utils.
                  ):
         """ """
         self.window_size = window_size
         self.sampling_freq = sampling_freq
         self.bins_in_hz = None
-#         self.dbfs_matrix = None
-        
-        self.window = None
-        if window_function.lower() in ['hanning', 'hann']:
-            self.window = np.hanning(self.window_size)
-        elif window_function.lower() in ['blackman', 'black']:
-            self.window = np.blackman(self.window_size)
-        elif window_function.lower() in ['blackmanharris', 'blackman-harris', 'blackh']:
-            self.window = scipy.signal.blackmanharris(self.window_size)
-        elif window_function.lower() in ['kaiser']:
-            self.window = scipy.signal.kaiser(self.window_size, kaiser_beta)
-        else:
-            raise UserWarning("Invalid window function name.")
-
+        self.fft_backend = fft_backend
+        if self.fft_backend is None:
+            self.fft_backend = fft_utils.get_fft_backend()
+        # Windows are shared and cached per (function, size, beta).
         # Max db value in window. DBFS = db full scale. Half spectrum used.
-        self.dbfs_max = np.sum(self.window) / 2 
+        self.window, self.dbfs_max = fft_utils.get_window(window_function, 
+                                                          self.window_size, 
+                                                          kaiser_beta)
 
     def get_freq_bins_in_hz(self):
         """ Converts frequency bins to array in Hz. Calculated on demand. """
@@ -47,34 +42,53 @@ class DbfsSpectrumUtil():
     def calc_dbfs_matrix(self, signal, 
                          matrix_size=128, 
                          jump=None):
-        """ Convert frame to dBFS spectrum. """
+        """ Convert frames to a dBFS matrix. All frames are transformed in one batch. """
         if jump is None:
             jump=int(self.sampling_freq/1000) # Default = 1 ms.
-            
-#         # Reuse the same matrix for fast processing.
-#         if self.dbfs_matrix is None:
-#             self.dbfs_matrix = np.full([matrix_size, int(self.window_size / 2)], -120.0) # Default = -120 dBFS.
-#         else:
-#             self.dbfs_matrix.fill(-120) # Default = -120 dBFS.
-
+        #
         dbfs_matrix = np.full([matrix_size, int(self.window_size / 2)], -120.0) # Default = -120 dBFS.
+        # Rows are used while (start_index + jump) < signal_len. Rows with 
+        # frames shorter than window_size are left at the default value.
+        signal_len = len(signal)
+        rows = min(matrix_size, max(0, -(-(signal_len - jump) // jump)))
+        if signal_len >= self.window_size:
+            full_frames = min(rows, (signal_len - self.window_size) // jump + 1)
+        else:
+            full_frames = 0
+        if full_frames <= 0:
+            return dbfs_matrix
+        #
+        signal = np.ascontiguousarray(signal, dtype=np.float64)
+        frames = np.lib.stride_tricks.as_strided(signal, 
+                                                 shape=(full_frames, self.window_size),
+                                                 strides=(signal.strides[0] * jump, signal.strides[0]),
+                                                 writeable=False)
+        spectrum = self.fft_backend.rfft(frames * self.window)[:, :-1]
+        fft_utils.spectrum_to_dbfs(spectrum, self.dbfs_max, out=dbfs_matrix[:full_frames])
+        #
+        return dbfs_matrix
 
-        signal_len = len(signal)      
-        row_number = 0
-        start_index = 0
-        while (row_number < matrix_size) and ((start_index + jump) < signal_len):
-            spectrum = self.calc_dbfs_spectrum(signal[start_index:start_index+self.window_size])
-            if spectrum is not False:
-#                 self.dbfs_matrix[row_number] = spectrum
-                dbfs_matrix[row_number] = spectrum
-            row_number += 1
-            start_index += jump
-        #   
-#         return self.dbfs_matrix
+    def calc_dbfs_frames(self, signal, frame_starts):
+        """ dBFS spectra for frames starting at the indexes in frame_starts, in any
+            order, calculated in one batch. Frames are moved inside the signal 
+            if needed. Returns a matrix with one row per frame. """
+        frame_starts = np.asarray(frame_starts, dtype=np.int64)
+        dbfs_matrix = np.full([len(frame_starts), int(self.window_size / 2)], -120.0) # Default = -120 dBFS.
+        if (len(signal) < self.window_size) or (len(frame_starts) == 0):
+            return dbfs_matrix
+        #
+        # No contiguous copy of the signal. Only the frames are copied.
+        signal = np.asarray(signal, dtype=np.float64)
+        frame_starts = np.clip(frame_starts, 0, len(signal) - self.window_size)
+        frames = np.lib.stride_tricks.sliding_window_view(signal, self.window_size)[frame_starts]
+        frames *= self.window # Fancy indexing above returns a copy.
+        spectrum = self.fft_backend.rfft(frames)[:, :-1]
+        fft_utils.spectrum_to_dbfs(spectrum, self.dbfs_max, out=dbfs_matrix)
+        #
         return dbfs_matrix
 
-    def calc_dbfs_spectrum(self, signal):
-        """ Convert frame to dBFS spectrum. """
+    def calc_dbfs_spectrum(self, signal, out=None):
+        """ Convert frame to dBFS spectrum. The array "out" can be reused between calls. """
         signal_len = len(signal)
         if signal_len == self.window_size:
             frame = signal * self.window
@@ -83,8 +97,8 @@ class DbfsSpectrumUtil():
         else:
             return False
         # Calc dBFS spectrum.
-        spectrum = np.fft.rfft(frame)[:-1]
-        dbfs_spectrum = 20 * np.log10(np.abs(spectrum) / self.dbfs_max)
+        spectrum = self.fft_backend.rfft(frame)[:-1]
+        dbfs_spectrum = fft_utils.spectrum_to_dbfs(spectrum, self.dbfs_max, out=out)
         #
         return dbfs_spectrum
 
@@ -108,6 +122,121 @@ class DbfsSpectrumUtil():
         #
         return peak_frequency, peak_amplitude
 
+    def interpolate_spectral_peaks(self, spectrum_db_matrix, peak_bins=None):
+        """ Same as interpolate_spectral_peak, but for all rows in a matrix at once.
+            Interpolates around the argmax of each row, or around peak_bins if given.
+            Returns arrays for peak frequencies and peak amplitudes. """
+        matrix = np.asarray(spectrum_db_matrix)
+        rows = np.arange(len(matrix))
+        bins = matrix.shape[1]
+        if peak_bins is None:
+            peak_bin = matrix.argmax(axis=1)
+        else:
+            peak_bin = np.asarray(peak_bins)
+        y1 = matrix[rows, peak_bin]
+        # Edges are not interpolated.
+        inside = (peak_bin > 0) & (peak_bin < bins - 1)
+        y0 = np.where(inside, matrix[rows, np.maximum(peak_bin - 1, 0)], 0.0)
+        y2 = np.where(inside, matrix[rows, np.minimum(peak_bin + 1, bins - 1)], 0.0)
+        x_adjust = np.zeros(len(matrix))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_adjust[inside] = ((y0 - y2) / 2 / (y0 - y1*2 + y2))[inside]
+        # Only within +/- 0.5 bin for a local max. Not extrapolated for other bins.
+        x_adjust = np.clip(x_adjust, -0.5, 0.5)
+        # 
+        peak_frequency = (peak_bin + x_adjust) * self.sampling_freq / self.window_size
+        # Peak amplitude.
+        peak_amplitude = y1 - (y0 - y2) * x_adjust / 4
+        #
+        return peak_frequency, peak_amplitude
+
+    def harmonic_analysis(self, spectrum_db_matrix, 
+                          max_harmonics=3, 
+                          subharmonic_threshold_db=20.0, 
+                          noise_margin_db=10.0, 
+                          max_mismatch_bins=0.5, 
+                          min_valley_db=6.0, 
+                          min_freq_hz=None, 
+                          search_bins=1):
+        """ Finds the fundamental and its harmonics for each row in a dBFS matrix.
+            The strongest bin is not always the fundamental. For each row the 
+            bins at 1/2, 1/3... of the strongest bin (up to max_harmonics) are 
+            checked and the lowest one is used as fundamental if it is:
+            - a local max, 
+            - within subharmonic_threshold_db from the strongest bin, 
+            - noise_margin_db above the noise floor, the median of the row, 
+            - the strongest bin, interpolated, is a multiple of it within 
+              max_mismatch_bins, 
+            - and the spectrum between them dips min_valley_db below it. Short 
+              frames, for example a chirp end, give one broad peak without dips. 
+            Harmonics are then searched for at multiples of the fundamental, 
+            +/- search_bins, and only used if the found bin is a local max. 
+            Returns two arrays with shape (rows, max_harmonics) for frequencies 
+            and amplitudes. Column 0 is the fundamental. Harmonics above 
+            Nyquist are NaN. """
+        matrix = np.asarray(spectrum_db_matrix)
+        rows = np.arange(len(matrix))
+        bins = matrix.shape[1]
+        min_bin = 1
+        if min_freq_hz is not None:
+            min_bin = max(min_bin, int(np.ceil(min_freq_hz * self.window_size / self.sampling_freq)))
+        offsets = np.arange(-search_bins, search_bins + 1)
+        hz_per_bin = self.sampling_freq / self.window_size
+        noise_floor_db = np.median(matrix, axis=1)
+        # Strongest bin.
+        peak_bin = matrix.argmax(axis=1)
+        peak_db = matrix[rows, peak_bin]
+        peak_in_bins = self.interpolate_spectral_peaks(matrix, peak_bin)[0] / hz_per_bin
+        bin_numbers = np.arange(bins)
+        # Check sub-harmonics. The lowest accepted one is the fundamental.
+        fundamental_bin = peak_bin.copy()
+        for divisor in range(2, max_harmonics + 1):
+            candidate = np.round(peak_bin / divisor).astype(np.int64)
+            candidate_bin = self._local_max_bins(matrix, candidate, offsets)
+            candidate_db = matrix[rows, candidate_bin]
+            candidate_in_bins = self.interpolate_spectral_peaks(matrix, candidate_bin)[0] / hz_per_bin
+            # Lowest level between the candidate and the strongest bin.
+            between = (bin_numbers > candidate_bin[:, None]) & (bin_numbers < peak_bin[:, None])
+            valley_db = np.where(between, matrix, np.inf).min(axis=1)
+            accepted = (candidate_bin >= min_bin) & \
+                       self._is_local_max(matrix, candidate_bin) & \
+                       (candidate_db >= peak_db - subharmonic_threshold_db) & \
+                       (candidate_db >= noise_floor_db + noise_margin_db) & \
+                       (np.abs(peak_in_bins - candidate_in_bins * divisor) <= max_mismatch_bins) & \
+                       (valley_db <= candidate_db - min_valley_db)
+            fundamental_bin[accepted] = candidate_bin[accepted]
+        # Interpolated fundamental, used to find the harmonics.
+        freqs_hz = np.full((len(matrix), max_harmonics), np.nan)
+        amps_db = np.full((len(matrix), max_harmonics), np.nan)
+        freqs_hz[:, 0], amps_db[:, 0] = self.interpolate_spectral_peaks(matrix, fundamental_bin)
+        fundamental_in_bins = freqs_hz[:, 0] * self.window_size / self.sampling_freq
+        for harmonic in range(2, max_harmonics + 1):
+            expected = np.round(fundamental_in_bins * harmonic).astype(np.int64)
+            harmonic_bin = self._local_max_bins(matrix, expected, offsets)
+            found = (expected < bins) & self._is_local_max(matrix, harmonic_bin)
+            freq, amp = self.interpolate_spectral_peaks(matrix, harmonic_bin)
+            freqs_hz[found, harmonic - 1] = freq[found]
+            amps_db[found, harmonic - 1] = amp[found]
+        #
+        return freqs_hz, amps_db
+
+    def _local_max_bins(self, matrix, center_bins, offsets):
+        """ Bin with max value within center_bins + offsets, for each row. """
+        bins = matrix.shape[1]
+        neighbour_bins = np.clip(center_bins[:, np.newaxis] + offsets, 0, bins - 1)
+        neighbour_db = np.take_along_axis(matrix, neighbour_bins, axis=1)
+        return neighbour_bins[np.arange(len(matrix)), neighbour_db.argmax(axis=1)]
+
+    def _is_local_max(self, matrix, peak_bins):
+        """ True for rows where the bin is not on the edge and >= both neighbours. """
+        rows = np.arange(len(matrix))
+        bins = matrix.shape[1]
+        inside = (peak_bins > 0) & (peak_bins < bins - 1)
+        center_db = matrix[rows, peak_bins]
+        below_db = matrix[rows, np.maximum(peak_bins - 1, 0)]
+        above_db = matrix[rows, np.minimum(peak_bins + 1, bins - 1)]
+        return inside & (center_db >= below_db) & (center_db >= above_db)
+
     def chirp_metrics_header(self):
         """ """
         return ['peak_freq_khz', 'peak_dbfs', 
@@ -123,8 +252,23 @@ class DbfsSpectrumUtil():
                       threshold_dbfs_below_peak = 15.0, 
                       max_frames_to_check=100, 
                       max_silent_slots=8, 
+                      frequency_estimator='peak', # 'peak' or 'harmonic'.
+                      max_harmonics=3, # Used by 'harmonic'.
+                      subharmonic_threshold_db=20.0, # Used by 'harmonic'. See harmonic_analysis.
+                      spectrum_cache=None, # SpectrumCache for the same signal.
+                      coarse_factor=1, # > 1: Coarse-to-fine search, see below.
                       debug=False):
-        """ Extracts chirp metrics based on peak freq/"""
+        """ Extracts chirp metrics based on peak freq/
+            With frequency_estimator='harmonic' the fundamental, and its amplitude, is 
+            used for each frame instead of the strongest bin. That prevents jumps 
+            between the fundamental and harmonics. 
+            threshold_dbfs can be one value, or an array with one value per bin. 
+            Use a SpectrumCache when many peaks in the same signal are checked. 
+            With coarse_factor > 1 the chirp is first followed in steps of 
+            coarse_factor jumps. Then the frames used by the full search, over 
+            the chirp and after its edges, are calculated in one batch, and 
+            their peaks are interpolated in one call. The results are the same 
+            as for the full search. """
         signal_length = len(signal)
         # Expected results.
         peak_freq_hz = None
@@ -145,6 +289,31 @@ class DbfsSpectrumUtil():
         # Used to decide when to stop checking.
         negative_index_counter = 0
         positive_index_counter = 0
+        # Reused for all frames.
+        spectrum_buffer = np.empty(int(self.window_size / 2))
+        if (spectrum_cache is not None) and (spectrum_cache.signal is not signal):
+            raise UserWarning("The spectrum cache is not created for this signal.")
+        # Threshold can be one value per bin, for example from a NoiseFloorTracker.
+        if np.ndim(threshold_dbfs) > 0:
+            threshold_dbfs = np.asarray(threshold_dbfs, dtype=np.float64)
+        # Used by 'harmonic'.
+        harmonic_settings = {'max_harmonics': max_harmonics, 
+                             'subharmonic_threshold_db': subharmonic_threshold_db}
+        # Frame start: (freq_hz, dbfs, threshold_dbfs). Calculated in one batch 
+        # for coarse-to-fine. Other frames are calculated one at a time.
+        frame_peaks = {}
+        if coarse_factor > 1:
+            starts = self._coarse_chirp_frames(signal, peak_position, jump, int(coarse_factor), 
+                                               high_pass_filter_freq_hz, threshold_dbfs, 
+                                               threshold_dbfs_below_peak, max_frames_to_check, 
+                                               max_silent_slots, frequency_estimator, 
+                                               harmonic_settings, spectrum_cache, spectrum_buffer)
+            starts = starts[(starts >= 0) & (starts + self.window_size < signal_length)]
+            if len(starts) > 0:
+                frame_peaks = dict(zip(starts.tolist(), zip(*self._frame_peaks(
+                                            self.calc_dbfs_frames(signal, starts), 
+                                            frequency_estimator, harmonic_settings, 
+                                            high_pass_filter_freq_hz, threshold_dbfs))))
         # Loop over frames. Switch between positive and negative side.
         for ix in range(1, max_frames_to_check):
             # Jump 0,1,-1,2,-2,3,-3...
@@ -173,12 +342,15 @@ class DbfsSpectrumUtil():
             if start+self.window_size >= signal_length:
                 positive_index_counter = max_silent_slots + 10 # Finished.
                 continue
-            # Calculate spectrum in dBFS.            
-            spectrum = self.calc_dbfs_spectrum(signal[start:start+self.window_size])
-            if spectrum is False:
+            # Frequency and dBFS for the frame.
+            frame_peak = frame_peaks.get(start)
+            if frame_peak is None:
+                frame_peak = self._frame_peak(signal, start, spectrum_cache, spectrum_buffer, 
+                                              frequency_estimator, harmonic_settings, 
+                                              high_pass_filter_freq_hz, threshold_dbfs)
+            if frame_peak is None:
                 continue
-            # Calculate frequency and dBFS by interpolation over spectral bins. 
-            bin_freq_hz, bin_dbfs = self.interpolate_spectral_peak(spectrum)
+            bin_freq_hz, bin_dbfs, bin_threshold_dbfs = frame_peak
             # Check peak and adjust if the original peak_position was wrong..
             if (peak_dbfs is None) or (peak_dbfs < bin_dbfs):
                 peak_dbfs = bin_dbfs
@@ -186,7 +358,7 @@ class DbfsSpectrumUtil():
                 peak_index = index
             # Check levels.
             if (bin_dbfs > peak_dbfs - threshold_dbfs_below_peak) and \
-               (bin_dbfs > threshold_dbfs):
+               (bin_dbfs > bin_threshold_dbfs):
                 # Metric start_freq.
                 if (start_index is None) or (start_index > index ):
                     start_freq_hz = bin_freq_hz 
@@ -250,24 +422,183 @@ class DbfsSpectrumUtil():
         else:
             return False
 
+    def _frame_peak(self, signal, start, spectrum_cache, spectrum_buffer, 
+                    frequency_estimator, harmonic_settings, high_pass_filter_freq_hz, 
+                    threshold_dbfs):
+        """ Frequency, dBFS and threshold for the frame starting at start. Used 
+            by chirp_metrics. Returns None if there is no spectrum. """
+        # Calculate spectrum in dBFS.            
+        if spectrum_cache is not None:
+            spectrum = spectrum_cache.get_spectrum(start)
+        else:
+            spectrum = self.calc_dbfs_spectrum(signal[start:start+self.window_size], 
+                                               out=spectrum_buffer)
+        if spectrum is False:
+            return None
+        if (frequency_estimator == 'peak') and (np.ndim(threshold_dbfs) == 0):
+            bin_freq_hz, bin_dbfs = self.interpolate_spectral_peak(spectrum)
+            return bin_freq_hz, bin_dbfs, threshold_dbfs
+        freqs_hz, dbfs, thresholds_dbfs = self._frame_peaks(spectrum[np.newaxis, :], 
+                                                            frequency_estimator, harmonic_settings, 
+                                                            high_pass_filter_freq_hz, threshold_dbfs)
+        return freqs_hz[0], dbfs[0], thresholds_dbfs[0]
+
+    def _frame_peaks(self, dbfs_matrix, frequency_estimator, harmonic_settings, 
+                     high_pass_filter_freq_hz, threshold_dbfs):
+        """ Same as _frame_peak, for all rows in a dBFS matrix. Returns arrays 
+            for frequency, dBFS and threshold. """
+        rows = np.arange(len(dbfs_matrix))
+        # Threshold can be one value per bin, for example from a NoiseFloorTracker.
+        per_bin_threshold = np.ndim(threshold_dbfs) > 0
+        thresholds_dbfs = np.full(len(dbfs_matrix), threshold_dbfs if not per_bin_threshold else np.nan)
+        # Calculate frequency and dBFS by interpolation over spectral bins. 
+        if frequency_estimator == 'harmonic':
+            freqs_hz, amps_db = self.harmonic_analysis(dbfs_matrix, 
+                                                       min_freq_hz=high_pass_filter_freq_hz, 
+                                                       **harmonic_settings)
+            freqs_hz, dbfs = freqs_hz[:, 0], amps_db[:, 0]
+            if per_bin_threshold:
+                threshold_bins = np.round(freqs_hz * self.window_size / self.sampling_freq).astype(np.int64)
+                thresholds_dbfs = threshold_dbfs[np.minimum(threshold_bins, len(threshold_dbfs) - 1)]
+        elif per_bin_threshold:
+            # Strongest bin in relation to its threshold. Avoids bins with narrow band noise.
+            threshold_bins = (dbfs_matrix - threshold_dbfs).argmax(axis=1)
+            freqs_hz, dbfs = self.interpolate_spectral_peaks(dbfs_matrix, threshold_bins)
+            thresholds_dbfs = threshold_dbfs[threshold_bins]
+        else:
+            freqs_hz, dbfs = self.interpolate_spectral_peaks(dbfs_matrix)
+        return freqs_hz, dbfs, thresholds_dbfs
+
+    def _coarse_chirp_frames(self, signal, peak_position, jump, coarse_factor, 
+                             high_pass_filter_freq_hz, threshold_dbfs, 
+                             threshold_dbfs_below_peak, max_frames_to_check, 
+                             max_silent_slots, frequency_estimator, harmonic_settings, 
+                             spectrum_cache, spectrum_buffer):
+        """ Used by chirp_metrics when coarse_factor > 1. The chirp is followed 
+            in steps of coarse_factor jumps. Returns the start index for all 
+            frames that the full search will check: The chirp, and 
+            max_silent_slots + 1 frames after the edges. """
+        # Frames checked by the full search: +/- max_index jumps from peak_position.
+        max_index = int((max_frames_to_check - 1) / 2)
+        coarse_factor = min(coarse_factor, max_silent_slots + 1)
+        # Each side is followed until the silent coarse frames cover more 
+        # than max_silent_slots jumps, as in the full search.
+        max_silent_coarse = int(max_silent_slots / coarse_factor) + 1
+        peak_dbfs = None
+        active = [0]
+        for direction in [1, -1]:
+            silent_frames = 0
+            for step in range(0 if direction == 1 else 1, int(max_index / coarse_factor) + 1):
+                start = peak_position + jump * direction * step * coarse_factor
+                if (start < 0) or (start + self.window_size >= len(signal)):
+                    break
+                frame_peak = self._frame_peak(signal, start, spectrum_cache, spectrum_buffer, 
+                                              frequency_estimator, harmonic_settings, 
+                                              high_pass_filter_freq_hz, threshold_dbfs)
+                if frame_peak is None:
+                    continue
+                bin_freq_hz, bin_dbfs, bin_threshold_dbfs = frame_peak
+                if (peak_dbfs is None) or (peak_dbfs < bin_dbfs):
+                    peak_dbfs = bin_dbfs
+                if (bin_dbfs > peak_dbfs - threshold_dbfs_below_peak) and \
+                   (bin_dbfs > bin_threshold_dbfs):
+                    active.append(direction * step * coarse_factor)
+                    silent_frames = 0
+                else:
+                    silent_frames += 1
+                    if silent_frames >= max_silent_coarse:
+                        break
+        # Fine frames between the coarse frames, and after the edges.
+        margin = coarse_factor - 1 + max_silent_slots + 1
+        first_index = max(min(active) - margin, -max_index)
+        last_index = min(max(active) + margin, max_index)
+        return peak_position + jump * np.arange(first_index, last_index + 1)
+
+    def chirp_features_header(self, shape_points=16):
+        """ Columns in the matrix from chirp_features. """
+        header = self.chirp_metrics_header()[:7] # Signal indexes are not features.
+        header += ['shape_freq_khz_' + str(index) for index in range(shape_points)]
+        header += ['shape_dbfs_' + str(index) for index in range(shape_points)]
+        return header
+
+    def chirp_features(self, signal, peaks, 
+                       shape_points=16, # Number of points in the resampled shape curve.
+                       spectrum_cache=None, 
+                       **metrics_kwargs):
+        """ Fixed length feature vectors for chirps, for example for classifiers.
+            chirp_metrics is called for each peak, with metrics_kwargs. Frames
+            around the peaks are calculated in batches first. The shape curve
+            is shape_points frames evenly spread from start to end of the chirp,
+            all calculated in one batch.
+            Returns (features, signal_indexes). features is a float32 matrix
+            (n_chirps, n_features) with the columns in chirp_features_header(). 
+            signal_indexes is an int64 matrix (n_chirps, 3) with peak, start and 
+            end signal index. Peaks rejected by chirp_metrics are not included. """
+        if spectrum_cache is None:
+            spectrum_cache = SpectrumCache(self, signal)
+        # Frames checked first by chirp_metrics for each peak.
+        jump = int(self.sampling_freq / metrics_kwargs.get('jump_factor', 4000))
+        max_silent_slots = metrics_kwargs.get('max_silent_slots', 8)
+        offsets = np.arange(-max_silent_slots - 1, max_silent_slots + 2) * jump
+        peaks = np.asarray(peaks, dtype=np.int64)
+        peaks_in_batch = max(spectrum_cache.max_items // (2 * len(offsets)), 1)
+        metrics = []
+        for batch_start in range(0, len(peaks), peaks_in_batch):
+            batch_peaks = peaks[batch_start:batch_start + peaks_in_batch]
+            spectrum_cache.prefill(np.add.outer(batch_peaks, offsets).ravel())
+            for peak_position in batch_peaks:
+                result = self.chirp_metrics(signal, int(peak_position), 
+                                            spectrum_cache=spectrum_cache, 
+                                            **metrics_kwargs)
+                if result is not False:
+                    metrics.append(result)
+        #
+        features = np.empty((len(metrics), 7 + 2 * shape_points), dtype=np.float32)
+        signal_indexes = np.empty((len(metrics), 3), dtype=np.int64)
+        if len(metrics) == 0:
+            return features, signal_indexes
+        metrics = np.array(metrics, dtype=np.float64)
+        features[:, :7] = metrics[:, :7]
+        signal_indexes[:] = metrics[:, 7:10]
+        # Shape curves. Start and end signal indexes are frame starts.
+        fractions = np.linspace(0.0, 1.0, shape_points)
+        frame_starts = signal_indexes[:, 1:2] + \
+                       np.round((signal_indexes[:, 2:3] - signal_indexes[:, 1:2]) * fractions)
+        matrix = self.calc_dbfs_frames(signal, frame_starts.ravel())
+        freq_hz, amp_db = self.interpolate_spectral_peaks(matrix)
+        features[:, 7:7 + shape_points] = freq_hz.reshape(-1, shape_points) / 1000
+        features[:, 7 + shape_points:] = amp_db.reshape(-1, shape_points)
+        #
+        return features, signal_indexes
+
     def chirp_shape_header(self):
         """ """
         return ['time_s', 'frequency_hz', 'amplitude_dbfs', 'signal_index']
+
+    def chirp_shape_dtype(self):
+        """ Structured array type for results from chirp_shape. """
+        return np.dtype([('time_s', np.float64), 
+                         ('frequency_hz', np.float64), 
+                         ('amplitude_dbfs', np.float64), 
+                         ('signal_index', np.int64)])
         
     def chirp_shape(self, signal, peak_position, 
                     start_index=None, 
                     stop_index=None, 
                     jump_factor=8000, # Jump factor: 8000 = 0.125 ms.
-                    max_size=256):
-        """ To be used for plotting similar to ZC (Zero Crossing). """
+                    max_size=256, 
+                    as_array=False): # True: Structured array instead of a list of rows.
+        """ To be used for plotting similar to ZC (Zero Crossing). 
+            Returns a list of rows with the columns in chirp_shape_header(),
+            or a structured array if as_array is True. """
         # Create a matrix with one row for each 0.125 ms. Size 256*(window_size/2). 
         jump = int(self.sampling_freq / jump_factor) 
         if start_index is None:
             start_index = int(peak_position - (max_size * jump / 2))
         if stop_index is not None:
             max_size = int((stop_index - start_index) / jump)
-        # Make it wider.
-        start_index -= jump * 5
+        # Make it wider. Not before the signal start, for chirps at a chunk edge.
+        start_index = max(int(start_index) - jump * 5, 0)
         max_size += 5
         # Calculate matrix.                
         matrix = self.calc_dbfs_matrix(signal[start_index:], matrix_size=max_size, jump=jump)
@@ -275,18 +606,333 @@ class DbfsSpectrumUtil():
         # row, col = np.unravel_index(matrix.argmax(), matrix.shape)
         # calc_peak_freq_hz, calc_peak_dbfs = self.interpolate_spectral_peak(matrix[row])
         #
-        result_table = []
-        for spectrum_index, spectrum in enumerate(matrix):
-            # Interpolate.
-            freq_hz, amp_db = self.interpolate_spectral_peak(spectrum)
-            #
-            signal_index = start_index + spectrum_index * jump
-            time_s = np.round(signal_index / self.sampling_freq, 5)
-            frequency_hz = np.round(freq_hz, 0)
-            amplitude_dbfs = np.round(amp_db, 1)
-            # Add to result.
-            result_table.append([time_s, frequency_hz, amplitude_dbfs, signal_index])
+        # Interpolate all rows at once.
+        freq_hz, amp_db = self.interpolate_spectral_peaks(matrix)
+        signal_index = start_index + np.arange(len(matrix)) * jump
+        #
+        result_table = np.empty(len(matrix), dtype=self.chirp_shape_dtype())
+        result_table['time_s'] = np.round(signal_index / self.sampling_freq, 5)
+        result_table['frequency_hz'] = np.round(freq_hz, 0)
+        result_table['amplitude_dbfs'] = np.round(amp_db, 1)
+        result_table['signal_index'] = signal_index
+        #
+        if not as_array:
+            return [[row['time_s'], row['frequency_hz'], row['amplitude_dbfs'], int(row['signal_index'])]
+                    for row in result_table]
+        return result_table
+
+class SpectrumCache():
+    """ dBFS spectra for frames in one signal buffer, cached by frame start index.
+        Peaks found by find_localmax are close to each other and chirp_metrics 
+        checks overlapping frames for them. Shared by all chirp_metrics calls 
+        on the same buffer each frame spectrum is only calculated once. 
+        Least recently used spectra are removed when max_items is reached.
+    """
+    def __init__(self, spectrum_util, signal, max_items=4096):
+        """ """
+        self.spectrum_util = spectrum_util
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._spectra = collections.OrderedDict()
+        self.signal = signal
+
+    def clear(self, signal=None):
+        """ Empty the cache. Use the new signal buffer if given. """
+        self._spectra.clear()
+        self.hits = 0
+        self.misses = 0
+        if signal is not None:
+            self.signal = signal
+
+    def get_spectrum(self, start):
+        """ dBFS spectrum for the frame starting at index "start". Don't modify it. """
+        spectrum = self._spectra.get(start)
+        if spectrum is not None:
+            self._spectra.move_to_end(start)
+            self.hits += 1
+            return spectrum
+        #
+        self.misses += 1
+        spectrum = self.spectrum_util.calc_dbfs_spectrum(
+                            self.signal[start:start+self.spectrum_util.window_size])
+        self._spectra[start] = spectrum
+        if len(self._spectra) > self.max_items:
+            self._spectra.popitem(last=False)
+        return spectrum
+
+    def prefill(self, starts):
+        """ Calculates spectra for many frames in one batch. Frames already in 
+            the cache, or not used by chirp_metrics at the signal ends, are skipped. """
+        window_size = self.spectrum_util.window_size
+        starts = np.unique(np.asarray(starts, dtype=np.int64))
+        starts = starts[(starts >= 0) & (starts + window_size < len(self.signal))]
+        missing = [start for start in starts.tolist() if start not in self._spectra]
+        missing = missing[:self.max_items]
+        if len(missing) == 0:
+            return
+        matrix = self.spectrum_util.calc_dbfs_frames(self.signal, missing)
+        self.misses += len(missing)
+        for start, spectrum in zip(missing, matrix):
+            self._spectra[start] = spectrum
+        while len(self._spectra) > self.max_items:
+            self._spectra.popitem(last=False)
+
+    def get_counters(self):
+        """ Returns (hits, misses). """
+        return self.hits, self.misses
+
+class StreamingSpectrogram():
+    """ dBFS spectrogram for a stream of signal buffers of any size. Only the 
+        samples needed for the next frame are kept between buffers, so frames 
+        over buffer boundaries are not lost and memory usage does not depend 
+        on the length of the stream. Each frame is returned with the absolute 
+        index of its first sample. The frames are the same as from 
+        DbfsSpectrumUtil.calc_dbfs_matrix on the whole signal.
+    """
+    def __init__(self, 
+                 window_size=256,
+                 window_function='kaiser',
+                 kaiser_beta=14,
+                 sampling_freq=384000,
+                 jump=None, # Samples between frames. Default = 1 ms.
+                 fft_backend=None, 
+                 ):
+        """ """
+        self.spectrum_util = DbfsSpectrumUtil(window_size=window_size, 
+                                              window_function=window_function, 
+                                              kaiser_beta=kaiser_beta, 
+                                              sampling_freq=sampling_freq, 
+                                              fft_backend=fft_backend)
+        self.window_size = window_size
+        self.sampling_freq = sampling_freq
+        self.jump = jump if jump is not None else int(sampling_freq / 1000)
+        self.clear()
+
+    def clear(self):
+        """ Starts a new stream at signal index 0. """
+        self._samples = np.empty(0) # Kept from earlier buffers.
+        self._samples_start = 0 # Absolute index for _samples[0].
+        self._next_frame = 0 # Absolute index for the first sample in the next frame.
+
+    def get_freq_bins_in_hz(self):
+        """ """
+        return self.spectrum_util.get_freq_bins_in_hz()
+
+    def process_buffer(self, signal):
+        """ Adds the next buffer. Returns (frame_indexes, dbfs_matrix) for all 
+            frames that are complete. frame_indexes are absolute signal indexes 
+            for the first sample in each frame. Divide by sampling_freq for time. """
+        samples = np.concatenate((self._samples, np.asarray(signal, dtype=np.float64)))
+        samples_end = self._samples_start + len(samples)
+        frames = max(0, (samples_end - self._next_frame - self.window_size) // self.jump + 1)
+        frame_indexes = self._next_frame + np.arange(frames, dtype=np.int64) * self.jump
+        dbfs_matrix = self.spectrum_util.calc_dbfs_frames(samples, frame_indexes - self._samples_start)
+        # Keep samples from the next frame start.
+        self._next_frame += frames * self.jump
+        keep_from = min(max(self._next_frame - self._samples_start, 0), len(samples))
+        self._samples = samples[keep_from:].copy()
+        self._samples_start += keep_from
+        #
+        return frame_indexes, dbfs_matrix
+
+    def flush(self):
+        """ Ends the stream. Frames that start before the end of the stream are 
+            returned, zero padded. """
+        samples_end = self._samples_start + len(self._samples)
+        frames = max(0, -(-(samples_end - self._next_frame) // self.jump))
+        if frames == 0:
+            self.clear()
+            return np.empty(0, dtype=np.int64), np.empty((0, int(self.window_size / 2)))
+        padding = self._next_frame + (frames - 1) * self.jump + self.window_size - samples_end
+        frame_indexes, dbfs_matrix = self.process_buffer(np.zeros(padding))
+        self.clear()
+        return frame_indexes, dbfs_matrix
+
+    def process_wave_file(self, file_path, buffer_size=None, flush=True):
+        """ Generator. Yields (frame_indexes, dbfs_matrix) for one buffer at a 
+            time from a wave file. buffer_size in samples, default 1 sec. """
+        from dsp4bats import wave_file_utils
+        self.clear()
+        wave_reader = wave_file_utils.WaveFileReader(str(file_path))
+        try:
+            while True:
+                signal = wave_reader.read_buffer(buffer_size)
+                if len(signal) == 0:
+                    break
+                yield self.process_buffer(signal)
+            if flush:
+                yield self.flush()
+        finally:
+            wave_reader.close()
+
+
+class ChirpFrequencyTracker():
+    """ Follows the peak frequency of a chirp from the peak frame and outward 
+        in both directions, with a sliding DFT. Only the bins in a band of 
+        +/- band_bins around the peak are updated for each hop:
+            X_k(n + hop) = e^(j2pi*k*hop/N) * (X_k(n) + sum((x(n+N+m) - x(n+m)) * e^(-j2pi*k*m/N)))
+        That is O(band * hop) per frame instead of O(N * log N) for a full FFT. 
+        The periodic Hann window is applied in the frequency domain with the 
+        3-term kernel Y_k = 0.5 * X_k - 0.25 * (X_k-1 + X_k+1), so the result is 
+        exact and not an approximation of a windowed FFT. 
+        The band is moved with the peak. New bins are calculated as single bin 
+        DFTs, O(N) each. Every resync_hops frame is a full FFT, to avoid drift 
+        and to find the strongest bin again. 
+        Results are the same as for DbfsSpectrumUtil, with the window function 
+        'hann_periodic', as long as the strongest bin is inside the band.
+    """
+    def __init__(self, 
+                 window_size=256,
+                 sampling_freq=384000,
+                 band_bins=2, # Bins on each side of the peak bin.
+                 resync_hops=16, # Full FFT after this number of sliding DFT updates.
+                 fft_backend=None, 
+                 ):
+        """ """
+        self.spectrum_util = DbfsSpectrumUtil(window_size=window_size, 
+                                              window_function='hann_periodic', 
+                                              sampling_freq=sampling_freq, 
+                                              fft_backend=fft_backend)
+        self.window_size = window_size
+        self.sampling_freq = sampling_freq
+        self.band_size = min(2 * max(int(band_bins), 1) + 1, window_size // 2)
+        self.resync_hops = max(int(resync_hops), 1)
+        self._hop_kernels = {} # Key: hop. Value: (twiddles, rotations) for all bins.
+        self.full_ffts = 0
+        self.band_updates = 0
+        self.new_bins = 0
+
+    def get_counters(self):
+        """ Returns (full_ffts, band_updates, new_bins). """
+        return self.full_ffts, self.band_updates, self.new_bins
+
+    def _get_hop_kernel(self, hop):
+        """ Twiddle factors e^(-j2pi*k*m/N), m < hop, and rotations e^(j2pi*k*hop/N) 
+            for the raw bins -1 to N/2, as rows 0 to N/2+1. """
+        if hop not in self._hop_kernels:
+            raw_bins = np.arange(-1, self.window_size // 2 + 1)
+            twiddles = np.exp(-2j * np.pi * np.outer(raw_bins, np.arange(hop)) / self.window_size)
+            rotations = np.exp(2j * np.pi * raw_bins * hop / self.window_size)
+            self._hop_kernels[hop] = (twiddles, rotations)
+        return self._hop_kernels[hop]
+
+    def _raw_band(self, frame, low):
+        """ Unwindowed DFT for the bins low-1 to low+band_size, single bin DFTs. """
+        raw_bins = np.arange(low - 1, low + self.band_size + 1)
+        self.new_bins += len(raw_bins)
+        return np.exp(-2j * np.pi * np.outer(raw_bins, np.arange(self.window_size)) / self.window_size) @ frame
+
+    def _band_dbfs(self, raw_band):
+        """ Hann window applied in the frequency domain, as dBFS. """
+        band = 0.5 * raw_band[1:-1] - 0.25 * (raw_band[:-2] + raw_band[2:])
+        return fft_utils.spectrum_to_dbfs(band, self.spectrum_util.dbfs_max)
+
+    def track(self, signal, frame_starts, first_frame):
+        """ Peak frequency and dBFS for frames starting at frame_starts, in time 
+            order and with a constant hop. Tracking starts at frame number 
+            first_frame, normally the chirp peak. Returns (freq_hz, dbfs) arrays. 
+            Frames outside the signal get frequency 0.0 and -120 dBFS. """
+        window_size = self.window_size
+        bins = window_size // 2
+        band_size = self.band_size
+        signal = np.asarray(signal, dtype=np.float64)
+        frame_starts = np.asarray(frame_starts, dtype=np.int64)
+        freq_hz = np.zeros(len(frame_starts))
+        dbfs = np.full(len(frame_starts), -120.0)
+        if (len(frame_starts) == 0) or (len(signal) < window_size):
+            return freq_hz, dbfs
+        hops = np.diff(frame_starts)
+        if (len(hops) > 0) and (np.any(hops != hops[0]) or (hops[0] <= 0)):
+            raise UserWarning('ChirpFrequencyTracker: frame_starts must have a constant hop.')
+        hop = int(hops[0]) if len(hops) > 0 else 1
+        twiddles, rotations = self._get_hop_kernel(hop)
+        inside = (frame_starts >= 0) & (frame_starts + window_size <= len(signal))
+        # Band dBFS, low bin and peak in band, for each frame. Interpolated at the end.
+        band_rows = np.full((len(frame_starts), band_size), -120.0)
+        band_low = np.zeros(len(frame_starts), dtype=np.int64)
+        band_peak = np.zeros(len(frame_starts), dtype=np.int64)
+        #
+        for step in [1, -1]:
+            frame_number = first_frame if step == 1 else first_frame - 1
+            hops_since_resync = self.resync_hops
+            raw_band = None
+            while (0 <= frame_number < len(frame_starts)) and inside[frame_number]:
+                start = frame_starts[frame_number]
+                frame = signal[start:start + window_size]
+                if (raw_band is None) or (hops_since_resync >= self.resync_hops):
+                    # Resync. Full FFT, and a new band around the strongest bin.
+                    spectrum = self.spectrum_util.fft_backend.rfft(frame)
+                    self.full_ffts += 1
+                    windowed = 0.5 * spectrum[:bins] - 0.25 * (np.concatenate(([np.conj(spectrum[1])], spectrum[:bins - 1])) + 
+                                                               spectrum[1:bins + 1])
+                    peak_bin = int(np.abs(windowed).argmax())
+                    low = min(max(peak_bin - band_size // 2, 0), bins - band_size)
+                    raw_bins = np.arange(low - 1, low + band_size + 1)
+                    raw_band = np.where(raw_bins < 0, np.conj(spectrum[np.abs(raw_bins)]), spectrum[np.abs(raw_bins)])
+                    hops_since_resync = 0
+                else:
+                    # Sliding DFT update for the band. The frame moves one hop.
+                    rows = slice(low, low + band_size + 2) # Raw bin low-1 is row low.
+                    if step == 1:
+                        previous = start - hop
+                        diff = signal[previous + window_size:start + window_size] - signal[previous:start]
+                        raw_band = rotations[rows] * (raw_band + twiddles[rows] @ diff)
+                    else:
+                        diff = signal[start + window_size:start + window_size + hop] - signal[start:start + hop]
+                        raw_band = raw_band * np.conj(rotations[rows]) - twiddles[rows] @ diff
+                    self.band_updates += 1
+                    hops_since_resync += 1
+                band_db = self._band_dbfs(raw_band)
+                peak = int(band_db.argmax())
+                # Peak on the band edge, not on the spectrum edge: Move the band.
+                while ((peak == 0) and (low > 0)) or ((peak == band_size - 1) and (low + band_size < bins)):
+                    low = min(max(low + peak - band_size // 2, 0), bins - band_size)
+                    raw_band = self._raw_band(frame, low)
+                    band_db = self._band_dbfs(raw_band)
+                    peak = int(band_db.argmax())
+                band_rows[frame_number] = band_db
+                band_low[frame_number] = low
+                band_peak[frame_number] = peak
+                frame_number += step
+        #
+        tracked = np.flatnonzero(inside & (band_rows.max(axis=1) > -120.0))
+        band_freq, band_dbfs = self.spectrum_util.interpolate_spectral_peaks(band_rows[tracked], 
+                                                                             band_peak[tracked])
+        freq_hz[tracked] = band_freq + band_low[tracked] * self.sampling_freq / window_size
+        dbfs[tracked] = band_dbfs
+        return freq_hz, dbfs
+
+    def chirp_shape(self, signal, peak_position, 
+                    start_index=None, 
+                    stop_index=None, 
+                    jump_factor=8000, # Jump factor: 8000 = 0.125 ms.
+                    max_size=256, 
+                    as_array=False): # True: Structured array instead of a list of rows.
+        """ Same frames and result as DbfsSpectrumUtil.chirp_shape, but tracked 
+            from the frame closest to peak_position. """
+        spectrum_util = self.spectrum_util
+        jump = int(self.sampling_freq / jump_factor) 
+        if start_index is None:
+            start_index = int(peak_position - (max_size * jump / 2))
+        if stop_index is not None:
+            max_size = int((stop_index - start_index) / jump)
+        # Make it wider. Not before the signal start, for chirps at a chunk edge.
+        start_index = max(int(start_index) - jump * 5, 0)
+        max_size += 5
+        signal_index = start_index + np.arange(max_size) * jump
+        first_frame = int(np.clip(np.round((peak_position - start_index) / jump), 0, max_size - 1))
+        freq_hz, amp_db = self.track(signal, signal_index, first_frame)
+        #
+        result_table = np.empty(max_size, dtype=spectrum_util.chirp_shape_dtype())
+        result_table['time_s'] = np.round(signal_index / self.sampling_freq, 5)
+        result_table['frequency_hz'] = np.round(freq_hz, 0)
+        result_table['amplitude_dbfs'] = np.round(amp_db, 1)
+        result_table['signal_index'] = signal_index
         #
+        if not as_array:
+            return [[row['time_s'], row['frequency_hz'], row['amplitude_dbfs'], int(row['signal_index'])]
+                    for row in result_table]
         return result_table
 
 
@@ -299,4 +945,57 @@ if __name__ == "__main__":
     print('Freq: ', freq, '   amp(db): ', amp_db)
     freq, amp_db = dsu.interpolate_spectral_peak(np.array([0,0,0,0,0,0,0,3,10,7,0,0,0,0,0,0,]))
     print('Freq: ', freq, '   amp(db): ', amp_db)
+    # Synthetic FM chirp, 80 to 40 kHz in 5 ms.
+    sampling_freq = 384000
+    time_s = np.arange(int(0.005 * sampling_freq)) / sampling_freq
+    chirp = 0.5 * np.sin(2 * np.pi * (80000 * time_s - 4000000 * time_s ** 2))
+    signal = np.concatenate([np.zeros(1000), chirp, np.zeros(1000)])
+    dsu = DbfsSpectrumUtil(window_size=256, window_function='kaiser', kaiser_beta=14, 
+                           sampling_freq=sampling_freq)
+    # Chirp at the start of a chunk.
+    edge_signal = signal[1000:] + np.random.normal(0, 0.00001, len(signal) - 1000)
+    edge_shape = dsu.chirp_shape(edge_signal, len(chirp) // 2, 0, len(chirp), as_array=True)
+    print('Chunk edge, first signal_index: ', edge_shape['signal_index'][0], 
+          '  max freq (Hz): ', edge_shape['frequency_hz'].max())
+    if (edge_shape['signal_index'][0] < 0) or (edge_shape['frequency_hz'].max() <= 0):
+        raise UserWarning('Chirp shape at chunk edge failed.')
+    # Coarse-to-fine. Chirp with a short gap, shorter than max_silent_slots jumps.
+    gap_signal = np.concatenate([np.zeros(3000), chirp, np.zeros(300), chirp[:600], np.zeros(3000)])
+    gap_signal += np.random.normal(0, 0.0003, len(gap_signal))
+    for peak_position in [3500, 4000, 4500, 5300]:
+        full_metrics = dsu.chirp_metrics(gap_signal, peak_position)
+        coarse_metrics = dsu.chirp_metrics(gap_signal, peak_position, coarse_factor=4)
+        if full_metrics != coarse_metrics:
+            raise UserWarning('Coarse-to-fine differs from the full search.')
+    print('Coarse-to-fine, duration (ms): ', coarse_metrics[6], '  same as full search.')
+    # Harmonic analysis. No harmonics: Same as the strongest bin in all frames.
+    noisy_signal = signal + np.random.normal(0, 0.0003, len(signal))
+    matrix = dsu.calc_dbfs_matrix(noisy_signal, matrix_size=40, jump=96)
+    peak_freqs_hz, _peak_amps_db = dsu.interpolate_spectral_peaks(matrix)
+    harmonic_freqs_hz, _harmonic_amps_db = dsu.harmonic_analysis(matrix, min_freq_hz=15000)
+    print('No harmonics, changed frames: ', np.sum(harmonic_freqs_hz[:, 0] != peak_freqs_hz))
+    if np.any(harmonic_freqs_hz[:, 0] != peak_freqs_hz):
+        raise UserWarning('Harmonic analysis changed a chirp without harmonics.')
+    # Second harmonic 6 dB stronger than the fundamental.
+    harmonic_signal = 0.25 * np.sin(2 * np.pi * 40000 * time_s) + 0.5 * np.sin(2 * np.pi * 80000 * time_s)
+    harmonic_signal += np.random.normal(0, 0.0003, len(harmonic_signal))
+    matrix = dsu.calc_dbfs_matrix(harmonic_signal, matrix_size=10, jump=96)
+    harmonic_freqs_hz, _harmonic_amps_db = dsu.harmonic_analysis(matrix, min_freq_hz=15000)
+    print('Fundamental (kHz): ', np.round(harmonic_freqs_hz[0] / 1000, 2), '  expected: 40, 80')
+    if np.any(np.abs(harmonic_freqs_hz[:, 0] - 40000) > 1000):
+        raise UserWarning('Harmonic analysis did not find the fundamental.')
+    # Sliding DFT tracker. Same peaks as calc_dbfs_matrix with the same window.
+    tracker = ChirpFrequencyTracker(window_size=256, sampling_freq=sampling_freq)
+    hann_dsu = DbfsSpectrumUtil(window_size=256, window_function='hann_periodic', 
+                                sampling_freq=sampling_freq)
+    matrix = hann_dsu.calc_dbfs_matrix(noisy_signal, matrix_size=60, jump=48)
+    fft_freqs_hz, fft_amps_db = hann_dsu.interpolate_spectral_peaks(matrix)
+    frame_starts = np.arange(60) * 48
+    track_freqs_hz, track_amps_db = tracker.track(noisy_signal, frame_starts, (1000 + len(chirp) // 2) // 48)
+    in_chirp = fft_amps_db > -40
+    freq_diff = np.abs(track_freqs_hz - fft_freqs_hz)[in_chirp]
+    print('Tracker, max diff from FFT (Hz): ', freq_diff.max(), '  frames: ', in_chirp.sum(), 
+          '  (full FFTs, band updates, new bins): ', tracker.get_counters())
+    if (freq_diff.max() > 1e-3) or (np.abs(track_amps_db - fft_amps_db)[in_chirp].max() > 1e-6):
+        raise UserWarning('Tracker differs from the full FFT.')
     print('Test ended.')
@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import numpy as np
+
+import dsp4bats
+
+# Template parameters, same as for SignalUtil.chirp_generator.
+DEFAULT_TEMPLATES = [
+    {'start_freq_hz': 90000, 'end_freq_hz': 30000, 'duration_s': 0.003}, # FM, for example Myotis.
+    {'start_freq_hz': 70000, 'end_freq_hz': 45000, 'duration_s': 0.005}, # FM-QCF, for example Pipistrellus.
+    {'start_freq_hz': 35000, 'end_freq_hz': 20000, 'duration_s': 0.010}, # QCF, for example Nyctalus.
+    ]
+
+class MatchedFilterDetector():
+    """ Chirp detector based on matched filters. The signal is correlated with
+        a bank of chirp templates by FFT convolution. Buffers can be of any
+        length. The convolution tail is carried over to the next buffer
+        (overlap-add), so the filter output does not depend on buffer
+        boundaries.
+
+        The detection level is the max, over all templates, of the absolute
+        filter output. Templates are normalized to unit energy. The level is
+        divided into blocks of "jump" samples. A block is a peak if its max
+        is above its neighbours and above threshold_factor times the noise
+        level. The noise level is a running mean, over noise_time_s, of the
+        median level in each block. It is updated per block, so the peaks do
+        not depend on buffer boundaries either. The filter response from one
+        chirp spans several blocks, so only the peak with the highest score
+        is kept (non-max suppression). Peaks are compared with other peaks
+        within template_length, and with peaks in the same event. An event is
+        blocks above the threshold, with gaps up to event_gap_s, max
+        max_event_s long. Echoes and long chirps give one peak. Peaks are positioned at the chirp center
+        and can be used as peak_position in DbfsSpectrumUtil.chirp_metrics.
+    """
+    def __init__(self,
+                 sampling_freq=384000,
+                 templates=None, # List of dicts with chirp_template parameters. None: DEFAULT_TEMPLATES.
+                 threshold_factor=8.0, # Multiplies the running noise level.
+                 jump=None, # Min distance between peaks. Default: 1 ms.
+                 noise_time_s=1.0, # Time constant for the running noise level.
+                 event_gap_s=0.015, # Max gap in an event. Echoes arrive within this time.
+                 max_event_s=0.05, # Longer events are split.
+                 ):
+        """ """
+        self.sampling_freq = sampling_freq
+        self.templates = templates if templates is not None else DEFAULT_TEMPLATES
+        self.threshold_factor = threshold_factor
+        self.jump = jump if jump is not None else int(sampling_freq / 1000)
+        self.noise_blocks = max(int(noise_time_s * sampling_freq / self.jump), 1)
+        # The first noise level is the mean over the first 0.1 sec.
+        self.first_noise_blocks = min(self.noise_blocks, max(int(0.1 * sampling_freq / self.jump), 1))
+        self.event_gap = int(event_gap_s * sampling_freq)
+        self.max_event_length = int(max_event_s * sampling_freq)
+        # Create the template bank. All templates are centered in the same length.
+        signal_util = dsp4bats.SignalUtil(sampling_freq)
+        chirps = [signal_util.chirp_template(**template) for template in self.templates]
+        self.template_length = max(len(chirp) for chirp in chirps)
+        self.kernels = np.zeros((len(chirps), self.template_length))
+        for index, chirp in enumerate(chirps):
+            start = (self.template_length - len(chirp)) // 2
+            self.kernels[index, start:start + len(chirp)] = chirp / np.sqrt(np.sum(chirp ** 2))
+        # Correlation is convolution with time reversed templates.
+        self.kernels = self.kernels[:, ::-1].copy()
+        # Filter output index minus delay is the chirp center.
+        self.delay = self.template_length - 1 - self.template_length // 2
+        # Blocks where the filter output is not complete, at the stream start.
+        self.startup_blocks = -(-(self.template_length - 1) // self.jump)
+        self.clear()
+
+    def peaks_dtype(self):
+        """ """
+        return np.dtype([('signal_index', np.int64), # Chirp center, absolute index.
+                         ('template', np.int32), # Index in templates.
+                         ('score', np.float64)]) # Level divided by threshold.
+
+    def _candidates_dtype(self):
+        """ Peaks before non-max suppression, with the event number. """
+        return np.dtype(self.peaks_dtype().descr + [('event', np.int64)])
+
+    def clear(self):
+        """ Resets the stream. The next buffer starts at signal index 0. """
+        self._tail = np.zeros((len(self.kernels), self.template_length - 1))
+        self._output_start = 0 # Absolute index for the next finalized output sample.
+        self._pending_level = np.empty(0) # Output not yet in a complete block.
+        self._pending_template = np.empty(0, dtype=np.int64)
+        # Running noise level. A plain mean over the first noise_blocks blocks.
+        self._noise_level = 0.0
+        self._noise_count = 0
+        # Events. The open event can get more blocks, -1 if none.
+        self._events = 0
+        self._open_event = -1
+        self._event_start = 0
+        self._last_above = 0 # Start of the last block above the threshold.
+        # Blocks waiting for the next block to be compared with.
+        self._carried = {'level': np.array([-np.inf]), 'index': np.array([0]),
+                         'template': np.array([0]), 'threshold': np.array([np.inf]), 
+                         'event': np.array([-1])}
+        # Peaks before non-max suppression. Decided peaks are kept for comparison.
+        self._candidates = np.empty(0, dtype=self._candidates_dtype())
+        self._decided = np.empty(0, dtype=self._candidates_dtype())
+        self._decided_until = 0
+
+    def get_decided_until(self):
+        """ All peaks before this absolute signal index have been returned. """
+        return self._decided_until
+
+    def process_buffer(self, signal):
+        """ Adds the next buffer in the stream. Returns peaks found so far as a
+            structured array, see peaks_dtype. Peaks are delayed by up to one
+            template length and one block, and may belong to earlier buffers. """
+        import scipy.signal # Only loaded when used.
+        signal = np.asarray(signal, dtype=np.float64)
+        if len(signal) == 0:
+            return np.empty(0, dtype=self.peaks_dtype())
+        output = scipy.signal.fftconvolve(signal[np.newaxis, :], self.kernels,
+                                          mode='full', axes=-1)
+        # Overlap-add. The end of the output is finalized by the next buffer.
+        output[:, :self.template_length - 1] += self._tail
+        self._tail = output[:, len(signal):].copy()
+        return self._add_output(output[:, :len(signal)], final=False)
+
+    def flush(self):
+        """ Ends the stream. Returns the remaining peaks. """
+        peaks = self._add_output(self._tail, final=True)
+        self.clear()
+        return peaks
+
+    def detect(self, signal):
+        """ Peaks in one signal, with signal_index relative to the signal start. """
+        self.clear()
+        peaks = self.process_buffer(signal)
+        peaks = np.concatenate((peaks, self.flush()))
+        return peaks[peaks['signal_index'] < len(signal)]
+
+    def _add_output(self, output, final):
+        """ Level per sample, blocks and peaks. """
+        level = np.abs(output)
+        template = level.argmax(axis=0)
+        level = level.max(axis=0)
+        # Complete blocks.
+        level = np.concatenate((self._pending_level, level))
+        template = np.concatenate((self._pending_template, template))
+        level_start = self._output_start - len(self._pending_level)
+        blocks = len(level) // self.jump
+        if (self._noise_count == 0) and (blocks < self.first_noise_blocks) and not final:
+            blocks = 0 # Wait for the first noise level.
+        threshold = self.threshold_factor * self._update_noise_level(
+                            np.median(level[:blocks * self.jump].reshape(blocks, self.jump), axis=1))
+        if final and (len(level) > blocks * self.jump):
+            # Last partial block. Same noise level as the block before, if any.
+            noise_level = self._noise_level if self._noise_count > 0 else np.median(level[blocks * self.jump:])
+            level = np.concatenate((level, np.full(self.jump - len(level) % self.jump, -np.inf)))
+            blocks += 1
+            threshold = np.append(threshold, self.threshold_factor * noise_level)
+        self._output_start += output.shape[-1]
+        self._pending_level = level[blocks * self.jump:]
+        self._pending_template = template[blocks * self.jump:]
+        block_level = level[:blocks * self.jump].reshape(blocks, self.jump)
+        block_argmax = block_level.argmax(axis=1)
+        block_offset = np.arange(blocks) * self.jump + block_argmax
+        new_blocks = {'level': block_level.max(axis=1),
+                      'index': level_start + block_offset,
+                      'template': template[np.minimum(block_offset, len(template) - 1)],
+                      'threshold': threshold}
+        new_blocks['event'] = self._block_events(new_blocks['level'] > threshold, 
+                                                 level_start + np.arange(blocks) * self.jump)
+        # Compare with neighbour blocks. The last block is compared in the next call.
+        all_blocks = {key: np.concatenate((self._carried[key], new_blocks[key]))
+                      for key in new_blocks}
+        if final:
+            all_blocks = {key: np.append(value, {'level': -np.inf, 'event': -1}.get(key, 0))
+                          for key, value in all_blocks.items()}
+            self._open_event = -1
+        levels = all_blocks['level']
+        middle = slice(1, len(levels) - 1)
+        is_peak = (levels[middle] >= levels[:-2]) & \
+                  (levels[middle] > levels[2:]) & \
+                  (levels[middle] > all_blocks['threshold'][middle])
+        peak_index = np.flatnonzero(is_peak) + 1
+        self._carried = {key: value[-2:] for key, value in all_blocks.items()}
+        #
+        peaks = np.empty(len(peak_index), dtype=self._candidates_dtype())
+        peaks['signal_index'] = np.maximum(all_blocks['index'][peak_index] - self.delay, 0)
+        peaks['template'] = all_blocks['template'][peak_index]
+        peaks['score'] = levels[peak_index] / all_blocks['threshold'][peak_index]
+        peaks['event'] = all_blocks['event'][peak_index]
+        peaks = self._suppress_non_max(peaks, final)
+        result = np.empty(len(peaks), dtype=self.peaks_dtype())
+        for name in result.dtype.names:
+            result[name] = peaks[name]
+        return result
+
+    def _block_events(self, above, block_starts):
+        """ Event number for each block, -1 if below the threshold. """
+        events = np.full(len(above), -1, dtype=np.int64)
+        for number in np.flatnonzero(above):
+            block_start = block_starts[number]
+            if (self._open_event < 0) or \
+               (block_start - self._last_above > self.event_gap) or \
+               (block_start - self._event_start >= self.max_event_length):
+                self._open_event = self._events
+                self._events += 1
+                self._event_start = block_start
+            self._last_above = block_start
+            events[number] = self._open_event
+        # The event ends when no block within event_gap is above the threshold.
+        if (len(above) > 0) and (block_starts[-1] - self._last_above > self.event_gap):
+            self._open_event = -1
+        return events
+
+    def _update_noise_level(self, block_medians):
+        """ Running noise level for each block. The same level for the first 
+            first_noise_blocks blocks, then a cumulative mean up to noise_blocks 
+            blocks, then an exponential mean. """
+        import scipy.signal # Only loaded when used.
+        noise_level = np.empty(len(block_medians))
+        first = 0
+        if (self._noise_count == 0) and (len(block_medians) > 0):
+            # Blocks in the filter startup are not used, if there are others.
+            first = min(self.first_noise_blocks, len(block_medians))
+            noise_level[:first] = np.mean(block_medians[min(self.startup_blocks, first - 1):first])
+            self._noise_level = noise_level[first - 1]
+            self._noise_count = first
+        block_medians = block_medians[first:]
+        warm_up = min(max(self.noise_blocks - self._noise_count, 0), len(block_medians))
+        if warm_up > 0:
+            counts = self._noise_count + np.arange(1, warm_up + 1)
+            sums = self._noise_level * self._noise_count + np.cumsum(block_medians[:warm_up])
+            noise_level[first:first + warm_up] = sums / counts
+        if warm_up < len(block_medians):
+            coeff = 1.0 / self.noise_blocks
+            previous = noise_level[first + warm_up - 1] if first + warm_up > 0 else self._noise_level
+            noise_level[first + warm_up:], _state = scipy.signal.lfilter([coeff], [1.0, coeff - 1.0], 
+                                                                         block_medians[warm_up:], 
+                                                                         zi=[(1.0 - coeff) * previous])
+        if len(block_medians) > 0:
+            self._noise_level = noise_level[-1]
+            self._noise_count += len(block_medians)
+        return noise_level
+
+    def _suppress_non_max(self, peaks, final):
+        """ Keeps a peak if no other peak within template_length, or in the same 
+            event, has a higher score. Peaks are decided when all peaks within 
+            template_length after them are known, and the event has ended. """
+        # Later peaks can only come from the carried blocks or later.
+        horizon = np.inf if final else self._carried['index'].min() - self.delay
+        candidates = np.concatenate((self._candidates, peaks))
+        all_peaks = np.concatenate((self._decided, candidates))
+        index = all_peaks['signal_index']
+        score = all_peaks['score']
+        event = all_peaks['event']
+        ready = np.flatnonzero((candidates['signal_index'] + self.template_length < horizon) & 
+                               ((candidates['event'] != self._open_event) | final))
+        keep = np.zeros(len(ready), dtype=bool)
+        for number, candidate in enumerate(ready + len(self._decided)):
+            low = np.searchsorted(index, index[candidate] - self.template_length, side='right')
+            high = np.searchsorted(index, index[candidate] + self.template_length, side='left')
+            same_event = np.flatnonzero(event == event[candidate])
+            # Equal scores: The first one is kept.
+            keep[number] = np.all(score[candidate] >= score[low:candidate]) and \
+                           np.all(score[candidate] > score[candidate + 1:high]) and \
+                           np.all(score[candidate] >= score[same_event[same_event < candidate]]) and \
+                           np.all(score[candidate] > score[same_event[same_event > candidate]])
+        decided = np.concatenate((self._decided, candidates[ready]))
+        self._candidates = np.delete(candidates, ready)
+        # Only decided peaks close enough, or in the same event, to be compared with later peaks.
+        if len(self._candidates) > 0:
+            first_open = self._candidates['signal_index'][0]
+        else:
+            first_open = horizon
+        self._decided = decided[(decided['signal_index'] + self.template_length > first_open) | 
+                                np.isin(decided['event'], self._candidates['event'])]
+        self._decided_until = min(horizon - self.template_length, first_open)
+        return candidates[ready][keep]
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    sampling_freq = 384000
+    signal_util = dsp4bats.SignalUtil(sampling_freq)
+    # Weak chirps, SNR well below what find_localmax can handle.
+    signal = signal_util.chirp_generator(start_freq_hz=70000, end_freq_hz=45000, duration_s=0.005,
+                                         max_amplitude=0.01, noise_level=0.01, number_of_chirps=10)
+    detector = MatchedFilterDetector(sampling_freq=sampling_freq)
+    peaks = detector.detect(signal)
+    print('Matched filter peaks: ', len(peaks), '  expected: 10')
+    print('Chirp centers (s): ', np.round(peaks['signal_index'] / sampling_freq, 3))
+    # Same result when streamed in buffers of any length.
+    detector.clear()
+    streamed = [detector.process_buffer(signal[start:start + 100000])
+                for start in range(0, len(signal), 100000)]
+    streamed = np.concatenate(streamed + [detector.flush()])
+    print('Streamed peaks: ', len(streamed))
+    if not np.array_equal(streamed['signal_index'], peaks['signal_index']):
+        raise UserWarning('Streamed peaks differ from one buffer.')
+    localmax_peaks = signal_util.find_localmax(signal, noise_threshold=3 * signal_util.noise_level(signal))
+    print('find_localmax peaks: ', len(localmax_peaks))
+    # One chirp gives one peak.
+    chirp = signal_util.chirp_template(start_freq_hz=90000, end_freq_hz=30000, duration_s=0.003)
+    signal = np.concatenate((np.zeros(20000), 0.3 * chirp, np.zeros(20000)))
+    signal += np.random.normal(0, 0.001, len(signal))
+    peaks = detector.detect(signal)
+    print('One chirp, peaks: ', len(peaks), '  expected: 1')
+    if len(peaks) != 1:
+        raise UserWarning('Non-max suppression failed.')
+    print('Test ended.')
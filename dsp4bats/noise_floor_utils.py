@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import numpy as np
+
+import dsp4bats
+
+class NoiseFloorTracker():
+    """ Noise floor in dBFS for each frequency bin, updated buffer by buffer.
+        Each buffer is summarized as a low percentile over its frames, per bin.
+        That value is then merged into the tracked floor at O(bins) cost:
+        - 'minimum': Minimum statistics. Follows decreasing levels directly and
+          increasing levels by at most rise_db per buffer.
+        - 'percentile': Running percentile. Moves the floor up or down by
+          step_db, weighted so it converges to the "percentile" value over time.
+        Narrow band noise from insects or rain raises the floor for those bins
+        only. The result can be used as a per bin threshold in chirp_metrics.
+    """
+    def __init__(self,
+                 window_size=128,
+                 window_function='kaiser',
+                 kaiser_beta=14,
+                 sampling_freq=384000,
+                 method='minimum', # 'minimum' or 'percentile'.
+                 buffer_percentile=20, # Used to summarize each buffer.
+                 rise_db=3.0, # Used by 'minimum'.
+                 percentile=50, # Used by 'percentile'.
+                 step_db=1.0, # Used by 'percentile'.
+                 ):
+        """ """
+        if method not in ['minimum', 'percentile']:
+            raise UserWarning("Invalid method. Use 'minimum' or 'percentile'.")
+        self.method = method
+        self.buffer_percentile = buffer_percentile
+        self.rise_db = rise_db
+        self.percentile = percentile
+        self.step_db = step_db
+        self.spectrum_util = dsp4bats.DbfsSpectrumUtil(window_size=window_size,
+                                                       window_function=window_function,
+                                                       kaiser_beta=kaiser_beta,
+                                                       sampling_freq=sampling_freq)
+        self.clear()
+
+    def clear(self):
+        """ """
+        self.noise_floor_dbfs = None
+        self.buffer_counter = 0
+
+    def update(self, signal):
+        """ Updates the floor from one buffer. Returns the floor per bin in dBFS. """
+        return self.update_from_spectrum(self.calc_buffer_floor(signal))
+
+    def calc_buffer_floor(self, signal):
+        """ Summary of one buffer, one value per bin. Does not change the tracker, 
+            so it can be calculated in parallel for many buffers. """
+        # Non-overlapping frames are enough for noise.
+        jump = self.spectrum_util.window_size
+        matrix_size = max(int(len(signal) / jump), 1)
+        with np.errstate(divide='ignore'):
+            matrix = self.spectrum_util.calc_dbfs_matrix(signal,
+                                                         matrix_size=matrix_size,
+                                                         jump=jump)
+        np.maximum(matrix, -120.0, out=matrix) # Silent bins.
+        return np.percentile(matrix, self.buffer_percentile, axis=0)
+
+    def update_from_spectrum(self, buffer_floor_dbfs):
+        """ Updates the floor from an already summarized buffer, one value per bin. """
+        buffer_floor_dbfs = np.asarray(buffer_floor_dbfs, dtype=np.float64)
+        if self.noise_floor_dbfs is None:
+            self.noise_floor_dbfs = buffer_floor_dbfs.copy()
+        elif self.method == 'minimum':
+            self.noise_floor_dbfs += self.rise_db
+            np.minimum(self.noise_floor_dbfs, buffer_floor_dbfs, out=self.noise_floor_dbfs)
+        else:
+            fraction = self.percentile / 100.0
+            above = buffer_floor_dbfs > self.noise_floor_dbfs
+            self.noise_floor_dbfs += np.where(above,
+                                              self.step_db * fraction,
+                                              -self.step_db * (1.0 - fraction))
+        self.buffer_counter += 1
+        #
+        return self.noise_floor_dbfs
+
+    def get_threshold_dbfs(self, margin_db=10.0, min_threshold_dbfs=None):
+        """ Per bin threshold. Can be used as threshold_dbfs in chirp_metrics. """
+        if self.noise_floor_dbfs is None:
+            return min_threshold_dbfs
+        threshold = self.noise_floor_dbfs + margin_db
+        if min_threshold_dbfs is not None:
+            threshold = np.maximum(threshold, min_threshold_dbfs)
+        return threshold
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    sampling_freq = 384000
+    tracker = NoiseFloorTracker(sampling_freq=sampling_freq)
+    time = np.arange(0, sampling_freq) / sampling_freq
+    for index in range(5):
+        # White noise and an "insect" at 20 kHz.
+        signal = np.random.randn(sampling_freq) * 0.001 + 0.01 * np.sin(2 * np.pi * 20000 * time)
+        floor = tracker.update(signal)
+    bins_hz = tracker.spectrum_util.get_freq_bins_in_hz()
+    print('Floor at 21 kHz: ', np.round(floor[7], 1), '  at 60 kHz: ', np.round(floor[20], 1),
+          '  bins: ', bins_hz[7], bins_hz[20])
+    print('Test ended.')
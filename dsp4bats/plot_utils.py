@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import struct
+import hashlib
+import pathlib
+import concurrent.futures
+import numpy as np
+
+# Note: matplotlib is imported when the first renderer is created.
+# pyplot is not used, figures are rendered with the Agg canvas directly.
+
+def read_metrics_file(metrics_file_path):
+    """ Reads a "*_Metrics.txt" file to a dict with one numpy array per column. """
+    with open(metrics_file_path) as metrics_file:
+        header = metrics_file.readline().rstrip('\n').split('\t')
+        rows = [line.rstrip('\n').split('\t') for line in metrics_file if line.strip()]
+    if len(rows) == 0:
+        values = np.empty((0, len(header)))
+    else:
+        values = np.array(rows, dtype=np.float64)
+    return {name: values[:, index] for index, name in enumerate(header)}
+
+# PNG text chunk with a hash of the renderer settings used for the plot.
+SETTINGS_HASH_KEY = 'dsp4bats_settings'
+
+def settings_hash(renderer_settings):
+    """ Hash of the parameters to MetricsPlotRenderer. Defaults are included. """
+    settings = dict(MetricsPlotRenderer.default_settings(), **renderer_settings)
+    key = json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+def read_png_text(plot_file_path):
+    """ Text chunks (tEXt) in a PNG file as a dict. Image data is not read. """
+    text = {}
+    with open(plot_file_path, 'rb') as png_file:
+        if png_file.read(8) != b'\x89PNG\r\n\x1a\n':
+            return text
+        while True:
+            header = png_file.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IEND':
+                break
+            if chunk_type == b'tEXt':
+                keyword, _, value = png_file.read(length).partition(b'\x00')
+                text[keyword.decode('latin-1')] = value.decode('latin-1')
+                png_file.seek(4, os.SEEK_CUR) # CRC.
+            else:
+                png_file.seek(length + 4, os.SEEK_CUR)
+    return text
+
+def is_plot_up_to_date(metrics_file_path, plot_file_path, renderer_settings=None):
+    """ True if the plot exists and is newer than the metrics file. If
+        renderer_settings is given, the plot must also be rendered with the
+        same settings. """
+    try:
+        if os.stat(plot_file_path).st_mtime < os.stat(metrics_file_path).st_mtime:
+            return False
+        if renderer_settings is None:
+            return True
+        return read_png_text(plot_file_path).get(SETTINGS_HASH_KEY) == settings_hash(renderer_settings)
+    except OSError:
+        return False
+
+class MetricsPlotRenderer():
+    """ Renders "*_Metrics.txt" files as "*_Plot.png". The figure, axes, colorbar
+        and artists are created once. For each file only the artist data,
+        limits and titles are updated before the figure is saved.
+    """
+    def __init__(self,
+                 sampling_freq=384000,
+                 figsize_width=16,
+                 figsize_height=10,
+                 dpi=150,
+                 plot_min_time_s=0.0, # None: Automatic.
+                 plot_max_time_s=None, # None: Automatic.
+                 plot_max_freq_khz=200, # None: Automatic.
+                 plot_max_interval_s=0.2, # None: Automatic.
+                 plot_max_duration_ms=20, # None: Automatic.
+                 ):
+        """ """
+        self.settings_hash = settings_hash(dict(sampling_freq=sampling_freq,
+                                                figsize_width=figsize_width,
+                                                figsize_height=figsize_height,
+                                                dpi=dpi,
+                                                plot_min_time_s=plot_min_time_s,
+                                                plot_max_time_s=plot_max_time_s,
+                                                plot_max_freq_khz=plot_max_freq_khz,
+                                                plot_max_interval_s=plot_max_interval_s,
+                                                plot_max_duration_ms=plot_max_duration_ms))
+        self.sampling_freq = sampling_freq
+        self.plot_min_time_s = plot_min_time_s
+        self.plot_max_time_s = plot_max_time_s
+        self.plot_max_freq_khz = plot_max_freq_khz
+        self.plot_max_interval_s = plot_max_interval_s
+        self.plot_max_duration_ms = plot_max_duration_ms
+        self._create_figure(figsize_width, figsize_height, dpi)
+
+    @classmethod
+    def default_settings(cls):
+        """ Default values for the parameters to __init__. """
+        import inspect
+        parameters = inspect.signature(cls.__init__).parameters
+        return {name: parameter.default for name, parameter in parameters.items() 
+                if parameter.default is not inspect.Parameter.empty}
+
+    def _create_figure(self, figsize_width, figsize_height, dpi):
+        """ Figure template. Same layout as in the old plot_results. """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        #
+        self.fig = Figure(figsize=(figsize_width, figsize_height), dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax1, ax2 = self.fig.subplots(2, 1)
+        # ax1 - Peak freq, etc.
+        self.peak_scatter = ax1.scatter(x=[], y=[], s=150,
+                                        edgecolors='black',
+                                        linewidth=0.5,
+                                        c=[],
+                                        cmap='YlOrRd',
+                                        alpha=0.7)
+        self.freq_vlines = ax1.vlines(x=[], ymin=[], ymax=[], linewidth=0.5, alpha=0.8)
+        self.time_hlines = ax1.hlines(y=[], xmin=[], xmax=[], linewidth=0.5, alpha=0.8)
+        self.fig.colorbar(self.peak_scatter, ax=ax1, label='dBFS')
+        ax1.minorticks_on()
+        ax1.grid(which='major', linestyle='-', linewidth='0.5', alpha=0.6)
+        ax1.grid(which='minor', linestyle='-', linewidth='0.5', alpha=0.3)
+        ax1.tick_params(which='both', top='off', left='off', right='off', bottom='off')
+        # ax2 - Interval.
+        self.interval_scatter = ax2.scatter(x=[], y=[], s=20, color='blue',
+                                            label='Interval (s)', alpha=0.5)
+        self.interval_hlines = ax2.hlines(y=[], xmin=[], xmax=[], linewidth=0.5,
+                                          color='blue', label=None, alpha=0.8)
+        ax2.minorticks_on()
+        ax2.grid(which='major', linestyle='-', linewidth='0.5', alpha=0.6)
+        ax2.grid(which='minor', linestyle='-', linewidth='0.5', alpha=0.3)
+        ax2.tick_params(which='both', top='off', left='off', right='off', bottom='off')
+        # ax3 - Duration.
+        ax3 = ax2.twinx()
+        self.duration_scatter = ax3.scatter(x=[], y=[], s=20, marker='s', color='red',
+                                            label='Duration (ms)', alpha=0.5)
+        # Legends
+        ax2.legend(loc='upper left')
+        ax3.legend(loc='upper right')
+        # Adjust size on second diagram.
+        pos = ax1.get_position()
+        pos2 = ax2.get_position()
+        ax2.set_position([pos.x0,pos2.y0,pos.width,pos2.height])
+        ax3.set_position([pos.x0,pos2.y0,pos.width,pos2.height])
+        # Titles and labels.
+        self.suptitle = self.fig.suptitle('', fontsize=12, fontweight='bold')
+        ax1.set_title('Peak and start/end frequencies, amplitude and start/stop time')
+        ax1.set_xlabel('Time (s)')
+        ax1.set_ylabel('Frequency (kHz)')
+        ax2.set_xlabel('Time (s)')
+        ax2.set_title('Interval (s) and duration (ms)')
+        ax2.set_ylabel('Interval (s)')
+        ax3.set_ylabel('Duration (ms)')
+        #
+        self.ax1, self.ax2, self.ax3 = ax1, ax2, ax3
+
+    def render(self, metrics_file_path, plot_file_path):
+        """ Returns False if there was nothing to plot. """
+        metrics = read_metrics_file(metrics_file_path)
+        peak_s = metrics['peak_signal_index'] / self.sampling_freq
+        if len(peak_s) == 0:
+            return False # Empty.
+        start_s = metrics['start_signal_index'] / self.sampling_freq
+        end_s = metrics['end_signal_index'] / self.sampling_freq
+        # Intervals between chirps. Chirps after too long intervals are not plotted.
+        interval_s = np.full(len(peak_s), np.nan)
+        interval_s[1:] = np.diff(peak_s)
+        max_interval_s = self.plot_max_interval_s
+        with np.errstate(invalid='ignore'):
+            keep = ~(interval_s > (0.2 if max_interval_s is None else max_interval_s))
+        peak_s = peak_s[keep]
+        start_s = start_s[keep]
+        end_s = end_s[keep]
+        interval_s = interval_s[keep]
+        peak_freq_khz = metrics['peak_freq_khz'][keep]
+        peak_dbfs = metrics['peak_dbfs'][keep]
+        duration_ms = metrics['duration_ms'][keep]
+        # Calculate if automatic.
+        min_time_s = self.plot_min_time_s
+        max_time_s = self.plot_max_time_s
+        max_freq_khz = self.plot_max_freq_khz
+        max_duration_ms = self.plot_max_duration_ms
+        if min_time_s is None:
+            min_time_s = peak_s.min() - 0.1
+        if max_time_s is None:
+            max_time_s = peak_s.max() + 0.1
+        if max_freq_khz is None:
+            max_freq_khz = self.sampling_freq / 1000 / 2 # Nyquist.
+        if max_interval_s is None:
+            max_interval_s = np.nanmax(interval_s) + 0.1 if np.isfinite(interval_s).any() else 0.3
+        if max_duration_ms is None:
+            max_duration_ms = duration_ms.max() + 0.1
+        # ax1.
+        self.peak_scatter.set_offsets(np.column_stack((peak_s, peak_freq_khz)))
+        self.peak_scatter.set_array(peak_dbfs)
+        self.peak_scatter.set_clim(peak_dbfs.min(), peak_dbfs.max())
+        self.freq_vlines.set_segments(np.stack((np.column_stack((peak_s, metrics['start_freq_khz'][keep])),
+                                                np.column_stack((peak_s, metrics['end_freq_khz'][keep]))),
+                                               axis=1))
+        self.time_hlines.set_segments(np.stack((np.column_stack((start_s, peak_freq_khz)),
+                                                np.column_stack((end_s, peak_freq_khz))),
+                                               axis=1))
+        # ax2 and ax3. The first chirp has no interval.
+        has_interval = np.isfinite(interval_s)
+        self.interval_scatter.set_offsets(np.column_stack((peak_s, interval_s))[has_interval])
+        self.interval_hlines.set_segments(np.stack((np.column_stack((peak_s - interval_s, interval_s)),
+                                                    np.column_stack((peak_s, interval_s))),
+                                                   axis=1)[has_interval])
+        self.duration_scatter.set_offsets(np.column_stack((peak_s, duration_ms)))
+        # Limits.
+        for ax in [self.ax1, self.ax2, self.ax3]:
+            ax.set_xlim((min_time_s, max_time_s))
+        self.ax1.set_ylim((0, max_freq_khz))
+        self.ax2.set_ylim((0, max_interval_s))
+        self.ax3.set_ylim((0, max_duration_ms))
+        # Title and save.
+        self.suptitle.set_text('Metrics from: ' + pathlib.Path(metrics_file_path).name)
+        self.fig.savefig(str(plot_file_path), metadata={SETTINGS_HASH_KEY: self.settings_hash})
+        return True
+
+# Used by worker processes. One renderer, and one figure, in each process.
+_worker_renderer = None
+
+def _init_worker(renderer_settings):
+    """ """
+    global _worker_renderer
+    _worker_renderer = MetricsPlotRenderer(**renderer_settings)
+
+def _render_in_worker(metrics_file_path, plot_file_path):
+    """ """
+    return _worker_renderer.render(metrics_file_path, plot_file_path)
+
+def render_plots(file_pairs, renderer_settings, workers=1, skip_up_to_date=True):
+    """ Renders a list of (metrics_file_path, plot_file_path) tuples.
+        Yields (metrics_file_path, plot_file_path, created) in the same order.
+        Missing metrics files are left out. If skip_up_to_date is True, plots
+        newer than their metrics files and rendered with the same
+        renderer_settings are skipped, with created False. """
+    entries = []
+    for metrics_file_path, plot_file_path in file_pairs:
+        if not pathlib.Path(metrics_file_path).exists():
+            continue
+        up_to_date = skip_up_to_date and \
+                     is_plot_up_to_date(metrics_file_path, plot_file_path, renderer_settings)
+        entries.append((str(metrics_file_path), str(plot_file_path), up_to_date))
+    jobs = [(metrics_file_path, plot_file_path) 
+            for metrics_file_path, plot_file_path, up_to_date in entries if not up_to_date]
+    #
+    if (workers <= 1) or (len(jobs) == 0):
+        renderer = MetricsPlotRenderer(**renderer_settings) if len(jobs) > 0 else None
+        for metrics_file_path, plot_file_path, up_to_date in entries:
+            created = False if up_to_date else renderer.render(metrics_file_path, plot_file_path)
+            yield metrics_file_path, plot_file_path, created
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    initializer=_init_worker,
+                                                    initargs=(renderer_settings,)) as executor:
+            futures = iter([executor.submit(_render_in_worker, metrics_file_path, plot_file_path)
+                            for metrics_file_path, plot_file_path in jobs])
+            for metrics_file_path, plot_file_path, up_to_date in entries:
+                created = False if up_to_date else next(futures).result()
+                yield metrics_file_path, plot_file_path, created
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import tempfile
+    import time
+    print('Test started.')
+    results_dir = pathlib.Path(__file__).parent.parent / 'data' / 'batfiles_results'
+    metrics_files = sorted(results_dir.glob('*_Metrics.txt'))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_pairs = [(path, pathlib.Path(temp_dir, path.stem.replace('_Metrics', '_Plot.png')))
+                      for path in metrics_files]
+        start_time = time.time()
+        created = [result[2] for result in render_plots(file_pairs, {'dpi': 80}, workers=2)]
+        print('Created: ', created, '  time (s): ', round(time.time() - start_time, 2))
+        skipped = [result[2] for result in render_plots(file_pairs, {'dpi': 80})]
+        print('Second run, up to date: ', skipped)
+        if any(skipped):
+            raise UserWarning('Up to date plots were rendered again.')
+        # Other settings. All plots are rendered again, in the same order.
+        results = list(render_plots(file_pairs, {'dpi': 60}, workers=2))
+        print('New dpi, created: ', [result[2] for result in results])
+        if results != [(str(path), str(plot_path), True) for path, plot_path in file_pairs]:
+            raise UserWarning('Plots with new settings not rendered, or not in the same order.')
+    print('Test ended.')
@@ -0,0 +1,489 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+""" A/B check of optimized DSP engines against the reference implementations.
+
+    The bundled recordings in data/batfiles are scanned twice, buffer by
+    buffer, with the reference engine and with the selected engine. For each
+    buffer the results from find_localmax, calc_dbfs_matrix and chirp_metrics
+    are compared. The chirp metrics are also compared with the "*_Metrics.txt"
+    files in data/batfiles_results. Differences are checked against per column
+    tolerances, and the time used by each engine is reported.
+    With chunking=True the files are also scanned by BatfilesScanner with
+    small chunks, as selected by memory_budget_mb, and compared with the
+    "*_Metrics.txt" files. See SMALL_CHUNK_SETTINGS.
+
+    Example:
+        dsp4bats check --engine float32
+        dsp4bats check --chunking
+"""
+
+import time
+import pathlib
+import numpy as np
+
+import dsp4bats
+from dsp4bats import fft_utils
+
+# Settings used to create the bundled "*_Metrics.txt" files.
+BUNDLED_SETTINGS = {
+    'time_filter_low_limit_hz': 30000,
+    'localmax_noise_threshold_factor': 3.0,
+    'localmax_jump_factor': 1000,
+    'localmax_frame_length': 1024,
+    'freq_window_size': 128,
+    'freq_filter_low_hz': 30000,
+    'freq_threshold_below_peak_db': 20.0,
+    'freq_threshold_dbfs': -50.0,
+    'freq_jump_factor': 2000,
+    'freq_max_frames_to_check': 100,
+    'freq_max_silent_slots': 8,
+    }
+
+# Scanner chunk_settings that must give the same results as whole 1 sec chunks.
+SMALL_CHUNK_SETTINGS = {
+    'chunk_size_s': 0.25,
+    'chunk_halo_s': 0.05,
+    'chunk_workers': 2,
+    }
+
+# Max absolute difference per column. Metrics are rounded to 3 decimals for
+# frequency and duration, 1 decimal for dBFS, in the files.
+DEFAULT_TOLERANCES = {
+    'peak_freq_khz': 0.0015,
+    'peak_dbfs': 0.15,
+    'start_freq_khz': 0.0015,
+    'end_freq_khz': 0.0015,
+    'max_freq_khz': 0.0015,
+    'min_freq_khz': 0.0015,
+    'duration_ms': 0.0015,
+    'peak_signal_index': 0,
+    'start_signal_index': 0,
+    'end_signal_index': 0,
+    'dbfs_matrix': 1e-6, # dB. Values below -120 dBFS are compared as -120.
+    'localmax': 0, # Number of different peak positions.
+    }
+
+
+class ReferenceEngine():
+    """ The implementations as they were before any optimization: filtfilt,
+        numpy FFT, one frame at a time and no spectrum cache. The methods are
+        frozen copies, they do not call the optimized code in dsp4bats.
+        Subclasses replace one or more of the methods. """
+    name = 'reference'
+
+    def __init__(self, sampling_freq, settings):
+        """ """
+        self.sampling_freq = sampling_freq
+        self.settings = settings
+        self.signal_util = dsp4bats.SignalUtil(sampling_freq)
+        self.spectrum_util = dsp4bats.DbfsSpectrumUtil(window_size=settings['freq_window_size'],
+                                                       window_function='kaiser',
+                                                       kaiser_beta=14,
+                                                       sampling_freq=sampling_freq,
+                                                       fft_backend=self.create_fft_backend())
+
+    def create_fft_backend(self):
+        """ """
+        return fft_utils.FftBackend(use_scipy=False)
+
+    def filter(self, signal):
+        """ Highpass, Butterworth order 9, filtfilt in float64. """
+        import scipy.signal
+        signal = np.asarray(signal, dtype=np.float64)
+        low = self.settings['time_filter_low_limit_hz'] / (0.5 * self.sampling_freq)
+        b, a = scipy.signal.butter(9, [low], btype='highpass')
+        return scipy.signal.filtfilt(b, a, signal)
+
+    def find_localmax(self, signal, noise_threshold):
+        """ """
+        jump = int(self.sampling_freq / self.settings['localmax_jump_factor'])
+        frame_length = self.settings['localmax_frame_length']
+        if self.sampling_freq < 300000:
+            frame_length = int(frame_length / 2)
+        y = signal.copy()
+        if noise_threshold > 0.0:
+            y[(np.abs(y) < noise_threshold)] = 0.0
+        rms = dsp4bats.librosa_rms(y=y, hop_length=jump, frame_length=frame_length, center=True)
+        locmax = dsp4bats.librosa_localmax(rms.T)
+        maxindexlist = [index for index, a in enumerate(locmax) if a==True]
+        return np.asarray(dsp4bats.librosa_frames_to_samples(maxindexlist, hop_length=jump))
+
+    def calc_dbfs_spectrum(self, frame):
+        """ One frame. """
+        spectrum_util = self.spectrum_util
+        spectrum = np.fft.rfft(frame * spectrum_util.window)[:-1]
+        return 20 * np.log10(np.abs(spectrum) / spectrum_util.dbfs_max)
+
+    def calc_dbfs_matrix(self, signal, matrix_size, jump):
+        """ One frame at a time. """
+        spectrum_util = self.spectrum_util
+        dbfs_matrix = np.full([matrix_size, int(spectrum_util.window_size / 2)], -120.0)
+        row_number = 0
+        start_index = 0
+        while (row_number < matrix_size) and ((start_index + jump) < len(signal)):
+            frame = signal[start_index:start_index + spectrum_util.window_size]
+            if len(frame) >= spectrum_util.window_size:
+                dbfs_matrix[row_number] = self.calc_dbfs_spectrum(frame)
+            row_number += 1
+            start_index += jump
+        return dbfs_matrix
+
+    def interpolate_spectral_peak(self, spectrum_db):
+        """ Quadratic interpolation around the strongest bin. """
+        peak_bin = spectrum_db.argmax()
+        if (peak_bin == 0) or (peak_bin >= len(spectrum_db) - 1):
+            y0, y1, y2 = 0, spectrum_db[peak_bin], 0
+            x_adjust = 0.0
+        else:
+            y0, y1, y2 = spectrum_db[peak_bin-1:peak_bin+2]
+            x_adjust = (y0 - y2) / 2 / (y0 - y1*2 + y2)
+        peak_frequency = (peak_bin + x_adjust) * self.sampling_freq / self.spectrum_util.window_size
+        peak_amplitude = y1 - (y0 - y2) * x_adjust / 4
+        return peak_frequency, peak_amplitude
+
+    def chirp_metrics(self, signal, peaks):
+        """ Returns a list of metrics rows. """
+        rows = []
+        for peak_position in peaks:
+            result = self.chirp_metrics_for_peak(signal, peak_position)
+            if result is not False:
+                rows.append(result)
+        return rows
+
+    def chirp_metrics_for_peak(self, signal, peak_position):
+        """ Frame by frame, alternating on both sides of the peak. """
+        window_size = self.spectrum_util.window_size
+        max_silent_slots = self.settings['freq_max_silent_slots']
+        threshold_dbfs = self.settings['freq_threshold_dbfs']
+        threshold_dbfs_below_peak = self.settings['freq_threshold_below_peak_db']
+        jump = int(self.sampling_freq / self.settings['freq_jump_factor'])
+        peak_freq_hz = peak_dbfs = start_freq_hz = end_freq_hz = max_freq_hz = min_freq_hz = None
+        peak_index = start_index = end_index = max_freq_index = min_freq_index = None
+        negative_index_counter = 0
+        positive_index_counter = 0
+        for ix in range(1, self.settings['freq_max_frames_to_check']):
+            # Jump 0,1,-1,2,-2,3,-3...
+            index = int(ix / 2)
+            if (ix % 2) != 0:
+                index *= -1
+            if index < 0:
+                if negative_index_counter > max_silent_slots:
+                    if positive_index_counter > max_silent_slots:
+                        break
+                    continue
+            else:
+                if positive_index_counter > max_silent_slots:
+                    if negative_index_counter > max_silent_slots:
+                        break
+                    continue
+            start = peak_position + jump * index
+            if start < 0:
+                negative_index_counter = max_silent_slots + 10
+                continue
+            if start + window_size >= len(signal):
+                positive_index_counter = max_silent_slots + 10
+                continue
+            spectrum = self.calc_dbfs_spectrum(signal[start:start + window_size])
+            bin_freq_hz, bin_dbfs = self.interpolate_spectral_peak(spectrum)
+            if (peak_dbfs is None) or (peak_dbfs < bin_dbfs):
+                peak_dbfs = bin_dbfs
+                peak_freq_hz = bin_freq_hz
+                peak_index = index
+            if (bin_dbfs > peak_dbfs - threshold_dbfs_below_peak) and (bin_dbfs > threshold_dbfs):
+                if (start_index is None) or (start_index > index):
+                    start_freq_hz = bin_freq_hz
+                    start_index = index
+                if (end_index is None) or (end_index < index):
+                    end_freq_hz = bin_freq_hz
+                    end_index = index
+                if (max_freq_index is None) or (max_freq_hz < bin_freq_hz):
+                    max_freq_hz = bin_freq_hz
+                    max_freq_index = index
+                if (min_freq_index is None) or (min_freq_hz > bin_freq_hz):
+                    min_freq_hz = bin_freq_hz
+                    min_freq_index = index
+                if index < 0:
+                    negative_index_counter = 0
+                else:
+                    positive_index_counter = 0
+            else:
+                if index < 0:
+                    negative_index_counter += 1
+                else:
+                    positive_index_counter += 1
+        if (start_index is None) or (peak_freq_hz < self.settings['freq_filter_low_hz']):
+            return False
+        duration_ms = (end_index - start_index + 1) * jump / self.sampling_freq * 1000
+        return (np.round(peak_freq_hz/1000, 3), 
+                np.round(peak_dbfs, 1), 
+                np.round(start_freq_hz/1000, 3), 
+                np.round(end_freq_hz/1000, 3), 
+                np.round(max_freq_hz/1000, 3), 
+                np.round(min_freq_hz/1000, 3), 
+                np.round(duration_ms, 3), 
+                peak_position + jump * peak_index, 
+                peak_position + jump * start_index, 
+                peak_position + jump * end_index)
+
+    def metrics_kwargs(self):
+        """ Parameters for DbfsSpectrumUtil.chirp_metrics, used by subclasses. """
+        return {'jump_factor': self.settings['freq_jump_factor'],
+                'high_pass_filter_freq_hz': self.settings['freq_filter_low_hz'],
+                'threshold_dbfs': self.settings['freq_threshold_dbfs'],
+                'threshold_dbfs_below_peak': self.settings['freq_threshold_below_peak_db'],
+                'max_frames_to_check': self.settings['freq_max_frames_to_check'],
+                'max_silent_slots': self.settings['freq_max_silent_slots']}
+
+class DefaultEngine(ReferenceEngine):
+    """ As used by BatfilesScanner: scipy.fft, batched frames and SpectrumCache. """
+    name = 'default'
+
+    def create_fft_backend(self):
+        """ """
+        return fft_utils.get_fft_backend()
+
+    def filter(self, signal):
+        """ """
+        signal = np.asarray(signal, dtype=np.float64)
+        return self.signal_util.butterworth_filter(signal,
+                                                   low_freq_hz=self.settings['time_filter_low_limit_hz'])
+
+    def find_localmax(self, signal, noise_threshold):
+        """ """
+        return np.asarray(self.signal_util.find_localmax(signal=signal,
+                                                         noise_threshold=noise_threshold,
+                                                         jump=int(self.sampling_freq / self.settings['localmax_jump_factor']),
+                                                         frame_length=self.settings['localmax_frame_length']))
+
+    def calc_dbfs_matrix(self, signal, matrix_size, jump):
+        """ """
+        return self.spectrum_util.calc_dbfs_matrix(signal, matrix_size=matrix_size, jump=jump)
+
+    def chirp_metrics(self, signal, peaks):
+        """ """
+        spectrum_cache = dsp4bats.SpectrumCache(self.spectrum_util, signal)
+        rows = []
+        for peak_position in peaks:
+            result = self.spectrum_util.chirp_metrics(signal, peak_position,
+                                                      spectrum_cache=spectrum_cache,
+                                                      **self.metrics_kwargs())
+            if result is not False:
+                rows.append(result)
+        return rows
+
+class Float32Engine(DefaultEngine):
+    """ Signal in float32. Filtered with second-order sections. """
+    name = 'float32'
+
+    def filter(self, signal):
+        """ """
+        signal = np.asarray(signal, dtype=np.float32)
+        return self.signal_util.butterworth_filter(signal,
+                                                   low_freq_hz=self.settings['time_filter_low_limit_hz'])
+
+class FeaturesEngine(DefaultEngine):
+    """ Chirp metrics from the batch API DbfsSpectrumUtil.chirp_features. """
+    name = 'features'
+
+    def chirp_metrics(self, signal, peaks):
+        """ """
+        features, signal_indexes = self.spectrum_util.chirp_features(signal, peaks,
+                                                                     shape_points=2,
+                                                                     **self.metrics_kwargs())
+        decimals = [3, 1, 3, 3, 3, 3, 3] # As in chirp_metrics.
+        return [tuple(round(float(value), decimal) for value, decimal in zip(row, decimals)) + 
+                tuple(indexes) for row, indexes in zip(features, signal_indexes)]
+
+class CoarseToFineEngine(DefaultEngine):
+    """ chirp_metrics with coarse_factor=4. Same results as the full search. """
+    name = 'coarse'
+
+    def metrics_kwargs(self):
+        """ """
+        kwargs = super().metrics_kwargs()
+        kwargs['coarse_factor'] = 4
+        return kwargs
+
+ENGINES = {engine.name: engine for engine in [ReferenceEngine, DefaultEngine,
+                                              Float32Engine, FeaturesEngine, 
+                                              CoarseToFineEngine]}
+
+def register_engine(engine_class):
+    """ Adds an engine, a subclass of ReferenceEngine, that can be selected by name. """
+    ENGINES[engine_class.name] = engine_class
+
+
+def compare_rows(rows_a, rows_b, header, tolerances):
+    """ Max absolute difference per column, and columns outside tolerance.
+        Different number of rows is reported as "row_count". """
+    rows_a = np.asarray(rows_a, dtype=np.float64).reshape(-1, len(header))
+    rows_b = np.asarray(rows_b, dtype=np.float64).reshape(-1, len(header))
+    if len(rows_a) != len(rows_b):
+        return {}, ['row_count']
+    max_diff = {}
+    failed = []
+    for column, name in enumerate(header):
+        diff = float(np.max(np.abs(rows_a[:, column] - rows_b[:, column]))) if len(rows_a) > 0 else 0.0
+        max_diff[name] = diff
+        if diff > tolerances.get(name, 0.0) + 1e-9:
+            failed.append(name)
+    return max_diff, failed
+
+def check_file(file_path, metrics_file_path, engine, reference, tolerances):
+    """ Runs both engines on one file, 1 sec buffers. Returns a report dict. """
+    from dsp4bats import plot_utils # Metrics file reader, no plotting.
+    settings = engine.settings
+    header = engine.spectrum_util.chirp_metrics_header()
+    times = {'reference': {'localmax': 0.0, 'dbfs_matrix': 0.0, 'chirp_metrics': 0.0},
+             'engine': {'localmax': 0.0, 'dbfs_matrix': 0.0, 'chirp_metrics': 0.0}}
+    rows = {'reference': [], 'engine': []}
+    localmax_diff = 0
+    matrix_diff = 0.0
+    wave_reader = dsp4bats.WaveFileReader(str(file_path))
+    buffer_start = 0
+    while True:
+        raw_signal = wave_reader.read_buffer()
+        if len(raw_signal) == 0:
+            break
+        peaks = {}
+        for key, used_engine in [('reference', reference), ('engine', engine)]:
+            signal = used_engine.filter(raw_signal)
+            noise_threshold = used_engine.signal_util.noise_level(signal) * \
+                              settings['localmax_noise_threshold_factor']
+            start_time = time.perf_counter()
+            peaks[key] = used_engine.find_localmax(signal, noise_threshold)
+            times[key]['localmax'] += time.perf_counter() - start_time
+            #
+            jump = int(used_engine.sampling_freq / settings['freq_jump_factor'])
+            start_time = time.perf_counter()
+            matrix = used_engine.calc_dbfs_matrix(signal, len(signal) // jump, jump)
+            times[key]['dbfs_matrix'] += time.perf_counter() - start_time
+            if key == 'reference':
+                reference_matrix = matrix
+            else:
+                # Bins below the 16 bit noise floor are not compared.
+                matrix_diff = max(matrix_diff, float(np.max(np.abs(np.maximum(matrix, -120.0) - 
+                                                                   np.maximum(reference_matrix, -120.0)))))
+            # Metrics with absolute signal indexes.
+            start_time = time.perf_counter()
+            buffer_rows = used_engine.chirp_metrics(signal, peaks[key])
+            times[key]['chirp_metrics'] += time.perf_counter() - start_time
+            rows[key] += [list(row[:7]) + [index + buffer_start for index in row[7:]]
+                          for row in buffer_rows]
+        if len(peaks['reference']) != len(peaks['engine']):
+            localmax_diff += abs(len(peaks['reference']) - len(peaks['engine']))
+        else:
+            localmax_diff += int(np.sum(peaks['reference'] != peaks['engine']))
+        buffer_start += len(raw_signal)
+    wave_reader.close()
+    # Compare.
+    failed = []
+    if localmax_diff > tolerances['localmax']:
+        failed.append('localmax')
+    if matrix_diff > tolerances['dbfs_matrix']:
+        failed.append('dbfs_matrix')
+    engine_diff, engine_failed = compare_rows(rows['engine'], rows['reference'], header, tolerances)
+    failed += ['reference.' + name for name in engine_failed]
+    file_diff = {}
+    if pathlib.Path(metrics_file_path).exists():
+        metrics = plot_utils.read_metrics_file(metrics_file_path)
+        expected_rows = np.column_stack([metrics[name] for name in header])
+        file_diff, file_failed = compare_rows(rows['engine'], expected_rows, header, tolerances)
+        failed += ['metrics_file.' + name for name in file_failed]
+    #
+    return {'file': str(file_path),
+            'engine': engine.name,
+            'chirps': len(rows['engine']),
+            'reference_chirps': len(rows['reference']),
+            'localmax_diff': localmax_diff,
+            'dbfs_matrix_max_diff': matrix_diff,
+            'max_diff_to_reference': engine_diff,
+            'max_diff_to_metrics_file': file_diff,
+            'speedup': {stage: round(times['reference'][stage] / max(times['engine'][stage], 1e-9), 2)
+                        for stage in times['engine']},
+            'time_s': times,
+            'failed': failed,
+            'passed': len(failed) == 0}
+
+def check_chunking(file_path, metrics_file_path, sampling_freq, settings, tolerances, 
+                   chunk_settings=None):
+    """ Scans one file with BatfilesScanner and small chunks, and compares 
+        with the metrics file. Returns a report dict. """
+    import tempfile
+    from dsp4bats import plot_utils # Metrics file reader, no plotting.
+    chunk_settings = chunk_settings if chunk_settings is not None else SMALL_CHUNK_SETTINGS
+    header = dsp4bats.DbfsSpectrumUtil().chirp_metrics_header()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        scanner = dsp4bats.BatfilesScanner(scanning_results_dir=temp_dir, sampling_freq=sampling_freq)
+        scanner.scan_file(str(file_path), scanner.get_scan_settings(chunk_settings=chunk_settings, **settings))
+        result_path = pathlib.Path(temp_dir, pathlib.Path(file_path).stem + '_Metrics.txt')
+        rows = []
+        if result_path.exists():
+            metrics = plot_utils.read_metrics_file(result_path)
+            rows = np.column_stack([metrics[name] for name in header])
+    file_diff = {}
+    failed = []
+    if pathlib.Path(metrics_file_path).exists():
+        metrics = plot_utils.read_metrics_file(metrics_file_path)
+        expected_rows = np.column_stack([metrics[name] for name in header])
+        file_diff, file_failed = compare_rows(rows, expected_rows, header, tolerances)
+        failed += ['chunking.' + name for name in file_failed]
+    return {'file': str(file_path),
+            'engine': 'chunking',
+            'chunk_settings': chunk_settings,
+            'chirps': len(rows),
+            'max_diff_to_metrics_file': file_diff,
+            'failed': failed,
+            'passed': len(failed) == 0}
+
+def run_check(batfiles_dir='data/batfiles',
+              scanning_results_dir='data/batfiles_results',
+              engine='default',
+              sampling_freq=384000,
+              settings=None, # None: BUNDLED_SETTINGS.
+              tolerances=None, # Updates DEFAULT_TOLERANCES.
+              chunking=False, # Also check_chunking for each file.
+              progress_callback=None):
+    """ Checks all wave files in batfiles_dir. Returns a list of reports, one
+        per file, and one more per file for chunking. progress_callback is 
+        called with each report. """
+    if engine not in ENGINES:
+        raise UserWarning('Unknown engine: ' + str(engine) + '. Use one of: ' + ', '.join(ENGINES))
+    settings = dict(BUNDLED_SETTINGS, **(settings or {}))
+    used_tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    reference = ReferenceEngine(sampling_freq, settings)
+    selected = ENGINES[engine](sampling_freq, settings)
+    reports = []
+    file_paths = sorted(set(pathlib.Path(batfiles_dir).glob('*.wav')) |
+                        set(pathlib.Path(batfiles_dir).glob('*.WAV')))
+    for file_path in file_paths:
+        metrics_file_path = pathlib.Path(scanning_results_dir, file_path.stem + '_Metrics.txt')
+        file_reports = [check_file(file_path, metrics_file_path, selected, reference, used_tolerances)]
+        if chunking:
+            file_reports.append(check_chunking(file_path, metrics_file_path, sampling_freq, 
+                                               settings, used_tolerances))
+        for report in file_reports:
+            reports.append(report)
+            if progress_callback is not None:
+                progress_callback(report)
+    return reports
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    data_dir = pathlib.Path(__file__).parent.parent / 'data'
+    for engine_name in ENGINES:
+        for report in run_check(data_dir / 'batfiles', data_dir / 'batfiles_results', engine=engine_name):
+            print(engine_name, pathlib.Path(report['file']).name, ' passed: ', report['passed'],
+                  report['failed'], '  speedup: ', report['speedup'])
+    for file_path in sorted((data_dir / 'batfiles').glob('*.wav')):
+        metrics_file_path = data_dir / 'batfiles_results' / (file_path.stem + '_Metrics.txt')
+        report = check_chunking(file_path, metrics_file_path, 384000, BUNDLED_SETTINGS, DEFAULT_TOLERANCES)
+        print('chunking', file_path.name, ' passed: ', report['passed'], report['failed'])
+    print('Test ended.')
@@ -64,6 +64,17 @@ class SoundStreamManager(object):
             # Stop source only. 
             self._source.stop()
 
+    def wait_until_finished(self, timeout=None):
+        """ Waits for all threads. Returns False if still running after timeout. """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        for thread in [self._source_thread, self._process_thread, self._target_thread]:
+            if thread is None:
+                continue
+            thread.join(None if end_time is None else max(end_time - time.monotonic(), 0))
+            if thread.is_alive():
+                return False
+        return True
+
 
 class SoundSourceBase(object):
     """ Base class for sound sources. Mainly files or streams. """
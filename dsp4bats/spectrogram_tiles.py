@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import hashlib
+import json
+import pathlib
+import numpy as np
+
+import dsp4bats
+
+class SpectrogramTilePyramid():
+    """ Multi-resolution dBFS spectrograms for sound files, cached on disk.
+
+        Level 0 contains one spectrum for each "jump" samples. Each higher
+        level halves the time resolution by taking the max value of two
+        adjacent frames in the level below. That keeps short chirps visible
+        also when zoomed out. Levels are stored as memory-mapped .npy files
+        and are calculated tile by tile when a part of them is requested
+        the first time.
+    """
+    def __init__(self,
+                 cache_dir='spectrogram_cache',
+                 window_size=256,
+                 window_function='kaiser',
+                 kaiser_beta=14,
+                 jump_factor=8000, # Jump factor: 8000 = 0.125 ms for level 0.
+                 tile_frames=1024, # Number of frames in each tile.
+                 dtype='uint8', # 'uint8' or 'float16'.
+                 dbfs_min=-120.0, # Lower limit when quantized to uint8.
+                 ):
+        """ """
+        self.cache_dir = cache_dir
+        self.window_size = window_size
+        self.window_function = window_function
+        self.kaiser_beta = kaiser_beta
+        self.jump_factor = jump_factor
+        self.tile_frames = tile_frames
+        self.dtype = np.dtype(dtype)
+        self.dbfs_min = dbfs_min
+        if self.dtype not in [np.dtype('uint8'), np.dtype('float16')]:
+            raise UserWarning("Invalid dtype. Use 'uint8' or 'float16'.")
+        #
+        self._files = {} # Opened pyramids. Key: absolute file path.
+
+    def get_window(self, file_path,
+                   start_s=0.0,
+                   end_s=None,
+                   min_freq_hz=None,
+                   max_freq_hz=None,
+                   max_frames=2000, # Used to select level if level is None.
+                   level=None):
+        """ Returns a dBFS matrix (time x frequency) for a part of a sound file,
+            together with arrays for time (s) and frequency (Hz).
+            Tiles are calculated and stored on demand. """
+        pyramid = self._get_pyramid(file_path)
+        sampling_freq = pyramid['sampling_freq']
+        if end_s is None:
+            end_s = pyramid['length'] / sampling_freq
+        # Select level. Lowest level where the number of frames fits.
+        if level is None:
+            level = 0
+            while (level < pyramid['levels'] - 1) and \
+                  (self._frames_in_range(pyramid, level, start_s, end_s) > max_frames):
+                level += 1
+        level = min(max(level, 0), pyramid['levels'] - 1)
+        # Frame range at this level.
+        level_jump = pyramid['jump'] * 2 ** level
+        level_frames = pyramid['frames'][level]
+        first_frame = max(int(np.floor(start_s * sampling_freq / level_jump)), 0)
+        last_frame = min(int(np.ceil(end_s * sampling_freq / level_jump)), level_frames)
+        if last_frame <= first_frame:
+            last_frame = min(first_frame + 1, level_frames)
+        # Calculate missing tiles.
+        first_tile = first_frame // self.tile_frames
+        last_tile = (last_frame - 1) // self.tile_frames
+        for tile in range(first_tile, last_tile + 1):
+            self._ensure_tile(pyramid, level, tile)
+        # Frequency range.
+        freqs_hz = np.arange(pyramid['bins']) * sampling_freq / self.window_size
+        first_bin = 0
+        last_bin = pyramid['bins']
+        if min_freq_hz is not None:
+            first_bin = int(np.searchsorted(freqs_hz, min_freq_hz, side='left'))
+        if max_freq_hz is not None:
+            last_bin = int(np.searchsorted(freqs_hz, max_freq_hz, side='right'))
+        #
+        matrix = pyramid['matrix'][level][first_frame:last_frame, first_bin:last_bin]
+        dbfs_matrix = self._dequantize(matrix)
+        times_s = np.arange(first_frame, last_frame) * level_jump / sampling_freq
+        #
+        return dbfs_matrix, times_s, freqs_hz[first_bin:last_bin]
+
+    def get_levels(self, file_path):
+        """ Returns a list of (level, time resolution in s, number of frames). """
+        pyramid = self._get_pyramid(file_path)
+        result = []
+        for level in range(pyramid['levels']):
+            level_jump = pyramid['jump'] * 2 ** level
+            result.append((level,
+                           level_jump / pyramid['sampling_freq'],
+                           pyramid['frames'][level]))
+        return result
+
+    def close(self):
+        """ Flush and release all memory-mapped files. """
+        for pyramid in self._files.values():
+            for level in range(pyramid['levels']):
+                pyramid['matrix'][level].flush()
+                pyramid['done'][level].flush()
+        self._files = {}
+
+    def _frames_in_range(self, pyramid, level, start_s, end_s):
+        """ """
+        level_jump = pyramid['jump'] * 2 ** level
+        return (end_s - start_s) * pyramid['sampling_freq'] / level_jump
+
+    def _get_pyramid(self, file_path):
+        """ Opens, or creates, memory-mapped files for all levels. """
+        abs_path = str(pathlib.Path(file_path).absolute().resolve())
+        if abs_path in self._files:
+            return self._files[abs_path]
+        # Get file info.
+        wave_reader = dsp4bats.WaveFileReader(abs_path)
+        sampling_freq = wave_reader.sampling_freq
+        length = wave_reader.get_length()
+        wave_reader.close()
+        jump = int(sampling_freq / self.jump_factor)
+        bins = int(self.window_size / 2)
+        # Number of frames per level. Stop when one tile covers the file.
+        frames = [max(int(np.ceil(length / jump)), 1)]
+        while frames[-1] > self.tile_frames:
+            frames.append(int(np.ceil(frames[-1] / 2)))
+        # Cache directory. Content depends on file and settings.
+        stat = pathlib.Path(abs_path).stat()
+        key = json.dumps([abs_path, stat.st_size, stat.st_mtime,
+                          self.window_size, self.window_function, self.kaiser_beta,
+                          jump, self.tile_frames, self.dtype.name, self.dbfs_min])
+        key_hash = hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+        pyramid_dir = pathlib.Path(self.cache_dir, pathlib.Path(abs_path).stem + '_' + key_hash)
+        if not pyramid_dir.exists():
+            pyramid_dir.mkdir(parents=True)
+        #
+        pyramid = {'file_path': abs_path,
+                   'sampling_freq': sampling_freq,
+                   'length': length,
+                   'jump': jump,
+                   'bins': bins,
+                   'levels': len(frames),
+                   'frames': frames,
+                   'matrix': [],
+                   'done': [],
+                   'spectrum_util': None,
+                   }
+        for level, level_frames in enumerate(frames):
+            matrix_path = pathlib.Path(pyramid_dir, 'level_' + str(level) + '.npy')
+            done_path = pathlib.Path(pyramid_dir, 'level_' + str(level) + '_tiles.npy')
+            number_of_tiles = int(np.ceil(level_frames / self.tile_frames))
+            if matrix_path.exists() and done_path.exists():
+                matrix = np.lib.format.open_memmap(str(matrix_path), mode='r+')
+                done = np.lib.format.open_memmap(str(done_path), mode='r+')
+            else:
+                matrix = np.lib.format.open_memmap(str(matrix_path), mode='w+',
+                                                   dtype=self.dtype,
+                                                   shape=(level_frames, bins))
+                done = np.lib.format.open_memmap(str(done_path), mode='w+',
+                                                 dtype=np.bool_,
+                                                 shape=(number_of_tiles,))
+            pyramid['matrix'].append(matrix)
+            pyramid['done'].append(done)
+        #
+        self._files[abs_path] = pyramid
+        return pyramid
+
+    def _ensure_tile(self, pyramid, level, tile):
+        """ Calculates a tile, and the tiles below it, if not already done. """
+        if pyramid['done'][level][tile]:
+            return
+        first_frame = tile * self.tile_frames
+        last_frame = min(first_frame + self.tile_frames, pyramid['frames'][level])
+        if level == 0:
+            dbfs_matrix = self._calc_base_frames(pyramid, first_frame, last_frame)
+            pyramid['matrix'][0][first_frame:last_frame] = self._quantize(dbfs_matrix)
+        else:
+            # Max of two adjacent frames in the level below.
+            below_frames = pyramid['frames'][level - 1]
+            below_first = first_frame * 2
+            below_last = min(last_frame * 2, below_frames)
+            for below_tile in range(below_first // self.tile_frames,
+                                    (below_last - 1) // self.tile_frames + 1):
+                self._ensure_tile(pyramid, level - 1, below_tile)
+            below = pyramid['matrix'][level - 1][below_first:below_last]
+            if len(below) % 2 != 0:
+                below = np.concatenate((below, below[-1:]))
+            pooled = np.maximum(below[0::2], below[1::2])
+            pyramid['matrix'][level][first_frame:last_frame] = pooled
+        pyramid['done'][level][tile] = True
+
+    def _calc_base_frames(self, pyramid, first_frame, last_frame):
+        """ dBFS spectra for level 0, read from the sound file. """
+        if pyramid['spectrum_util'] is None:
+            pyramid['spectrum_util'] = dsp4bats.DbfsSpectrumUtil(
+                                                window_size=self.window_size,
+                                                window_function=self.window_function,
+                                                kaiser_beta=self.kaiser_beta,
+                                                sampling_freq=pyramid['sampling_freq'])
+        spectrum_util = pyramid['spectrum_util']
+        jump = pyramid['jump']
+        start_index = first_frame * jump
+        buffer_size = (last_frame - first_frame - 1) * jump + self.window_size
+        wave_reader = dsp4bats.WaveFileReader(pyramid['file_path'])
+        wave_reader.set_position(start_index)
+        signal = wave_reader.read_buffer(buffer_size)
+        wave_reader.close()
+        # Pad last tile to get full frames.
+        if len(signal) < buffer_size:
+            signal = np.concatenate((signal, np.zeros(buffer_size - len(signal))))
+        with np.errstate(divide='ignore'):
+            dbfs_matrix = spectrum_util.calc_dbfs_matrix(signal,
+                                                         matrix_size=last_frame - first_frame,
+                                                         jump=jump)
+        return dbfs_matrix
+
+    def _quantize(self, dbfs_matrix):
+        """ """
+        dbfs_matrix = np.clip(dbfs_matrix, self.dbfs_min, 0.0)
+        if self.dtype == np.dtype('uint8'):
+            return np.round((dbfs_matrix - self.dbfs_min) * 255.0 / -self.dbfs_min).astype(np.uint8)
+        return dbfs_matrix.astype(np.float16)
+
+    def _dequantize(self, matrix):
+        """ """
+        if self.dtype == np.dtype('uint8'):
+            return matrix.astype(np.float32) * (-self.dbfs_min / 255.0) + self.dbfs_min
+        return matrix.astype(np.float32)
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    import tempfile
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tiles = SpectrogramTilePyramid(cache_dir=cache_dir)
+        for level, resolution_s, frames in tiles.get_levels('../data/batfiles/Mdau_TE384.wav'):
+            print('Level: ', level, '  resolution (ms): ', resolution_s * 1000, '  frames: ', frames)
+        matrix, times_s, freqs_hz = tiles.get_window('../data/batfiles/Mdau_TE384.wav',
+                                                     start_s=0.045, end_s=0.065,
+                                                     min_freq_hz=20000, max_freq_hz=120000)
+        print('Window shape: ', matrix.shape, '  first time (s): ', times_s[0])
+        matrix, times_s, freqs_hz = tiles.get_window('../data/batfiles/Mdau_TE384.wav',
+                                                     max_frames=500)
+        print('Overview shape: ', matrix.shape, '  max dBFS: ', matrix.max())
+        tiles.close()
+    print('Test ended.')
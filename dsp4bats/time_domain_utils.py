@@ -5,7 +5,6 @@
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
 import numpy as np
-import scipy.signal
 
 import dsp4bats
 
@@ -26,9 +25,11 @@ class SignalUtil():
         """ """
         return np.sqrt(np.mean(np.square(signal)))
 
-    def noise_level_in_db(self, signal):
-        """ """
-        return 20 * np.log10(self.noise_level(signal) / 1.0)
+    def noise_level_in_db(self, signal, noise_level=None):
+        """ Use noise_level if already calculated for the signal. """
+        if noise_level is None:
+            noise_level = self.noise_level(signal)
+        return 20 * np.log10(noise_level / 1.0)
         
     def butterworth_filter(self, signal, 
                            low_freq_hz=None, # For highpass and bandpass filters
@@ -36,32 +37,40 @@ class SignalUtil():
                            filter_order=9,  
                            bandstop=False): # Use both low_ and high_freq_hz for bandstop. 
         """ Filter. Butterworth. """
+        import scipy.signal # Only loaded when used.
         nyquist = 0.5 * self.sampling_freq
+        # Float32 signals are filtered in second-order sections, which are 
+        # stable also in single precision, and the result is kept in float32.
+        single_precision = (np.asarray(signal).dtype == np.float32)
+        output = 'sos' if single_precision else 'ba'
         #
         if (low_freq_hz is not None) and (high_freq_hz is None) and (bandstop is False):
             low = low_freq_hz / nyquist
-            b, a = scipy.signal.butter(filter_order, [low], btype='highpass')
+            filter_coeffs = scipy.signal.butter(filter_order, [low], btype='highpass', output=output)
         elif (low_freq_hz is None) and (high_freq_hz is not None) and (bandstop is False):
             high = high_freq_hz / nyquist
-            b, a = scipy.signal.butter(filter_order, [high], btype='lowpass')
+            filter_coeffs = scipy.signal.butter(filter_order, [high], btype='lowpass', output=output)
         elif (low_freq_hz is not None) and (high_freq_hz is not None) and (bandstop is False):
             low = low_freq_hz / nyquist
             high = high_freq_hz / nyquist
-            b, a = scipy.signal.butter(filter_order, [low, high], btype='bandpass')
+            filter_coeffs = scipy.signal.butter(filter_order, [low, high], btype='bandpass', output=output)
         elif (low_freq_hz is not None) and (high_freq_hz is not None) and (bandstop is True):
             low = low_freq_hz / nyquist
             high = high_freq_hz / nyquist
-            b, a = scipy.signal.butter(filter_order, [low, high], btype='bandstop')
+            filter_coeffs = scipy.signal.butter(filter_order, [low, high], btype='bandstop', output=output)
         else:
             return signal
         # Apply folter on signal.
+        if single_precision:
+            return scipy.signal.sosfiltfilt(filter_coeffs.astype(np.float32), signal)
+        b, a = filter_coeffs
         # filtered_signal = scipy.signal.lfilter(b, a, signal)
         filtered_signal = scipy.signal.filtfilt(b, a, signal)
         #
         return filtered_signal
     
     def find_localmax(self, signal,
-                      noise_threshold=0.0, # Range: [0.0, 1.0]. 
+                      noise_threshold=0.0, # Range: [0.0, 1.0]. Or one value per sample.
                       jump=None, 
                       frame_length=1024):
         """ """
@@ -71,7 +80,7 @@ class SignalUtil():
         if jump is None:
             jump=int(self.sampling_freq/1000) # Default = 1 ms.
         y = signal.copy()
-        if noise_threshold > 0.0:
+        if np.max(noise_threshold) > 0.0:
             y[(np.abs(y) < noise_threshold)] = 0.0
         rms = dsp4bats.librosa_rms(y=y, hop_length=jump, frame_length=frame_length, center=True)
         locmax = dsp4bats.librosa_localmax(rms.T)
@@ -81,6 +90,25 @@ class SignalUtil():
         #
         return index_list
 
+    def chirp_template(self, 
+                       start_freq_hz = 100000, 
+                       end_freq_hz = 20000, 
+                       duration_s = 0.008, 
+                       ):
+        """ One chirp, max amplitude 1.0. Used by chirp_generator and as template 
+            for matched filters. """
+        import scipy.signal # Only loaded when used.
+        # Create chirp. The shape is in between FM and QCF calls.
+        time = np.linspace(0, duration_s, int(self.sampling_freq * duration_s))
+        chirp = scipy.signal.chirp(time, 
+                                   f0=start_freq_hz, 
+                                   f1=end_freq_hz, 
+                                   t1=duration_s, 
+                                   method='quadratic', 
+                                   vertex_zero=False)
+        # Apply window function.
+        return chirp * scipy.signal.windows.hann(len(time))
+
     def chirp_generator(self, 
                         start_freq_hz = 100000, 
                         end_freq_hz = 20000, 
@@ -91,16 +119,9 @@ class SignalUtil():
                         number_of_chirps = 10, 
                         ):
         """ """
-        # Create chirp. The shape is in between FM and QCF calls.
-        time = np.linspace(0, duration_s, int(self.sampling_freq * duration_s))
-        chirp = scipy.signal.waveforms.chirp(time, 
-                                             f0=start_freq_hz, 
-                                             f1=end_freq_hz, 
-                                             t1=duration_s, 
-                                             method='quadratic', 
-                                             vertex_zero=False)
-        # Apply window function and amplitude.
-        chirp = chirp * scipy.signal.hanning(len(time)) * max_amplitude
+        chirp = self.chirp_template(start_freq_hz=start_freq_hz, 
+                                    end_freq_hz=end_freq_hz, 
+                                    duration_s=duration_s) * max_amplitude
         # Create silent part.
         silent_duration = chirp_interval_s - duration_s
         silent_half = np.zeros(int(self.sampling_freq * silent_duration / 2))
@@ -4,9 +4,12 @@
 # Copyright (c) 2017-2018 Arnold Andreasson 
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import os
 import pathlib
 import re
-import dateutil.parser
+import queue
+import threading
+import time
 import numpy as np
 # import pandas as pd
 import wave
@@ -45,8 +48,8 @@ class WaveFileReader():
             if self.sampling_freq < 192000:
                 self.sampling_freq *= 10 # Must be Time Expanded.
 
-    def read_buffer(self, buffer_size=None, convert_to_float=True):
-        """ """
+    def read_buffer(self, buffer_size=None, convert_to_float=True, dtype=np.float64):
+        """ dtype is used when converted to float. np.float32 halves memory usage. """
         if self.wave_file is None:
             self.open()
         #    
@@ -66,9 +69,23 @@ class WaveFileReader():
         #
         if convert_to_float:
             # Convert to signal in the interval [-1.0, 1.0].
-            signal = signal / 32767
+            signal = np.divide(signal, 32767, dtype=dtype)
+        #
+        return signal
+
+    def get_length(self):
+        """ Number of samples (frames) in the file. """
+        if self.wave_file is None:
+            self.open()
+        #
+        return self.wave_file.getnframes()
+
+    def set_position(self, position):
+        """ Move to sample (frame) position. Next read_buffer starts there. """
+        if self.wave_file is None:
+            self.open()
         #
-        return signal       
+        self.wave_file.setpos(position)
 
     def close(self):
         """ """
@@ -132,6 +149,175 @@ class WaveFileWriter():
         self.wave_file.close()
         self.wave_file = None
 
+class AsyncWaveFileWriter(WaveFileWriter):
+    """ Wave file writer where the file is written in a background thread.
+        Signals are converted to int16, with clipping, in a pool of 
+        preallocated buffers. Filled buffers are passed to the I/O thread in
+        a bounded queue and are reused when written. 
+        If all buffers are in use the signal is dropped, so the caller is never
+        blocked by a slow disk. Dropped buffers are counted, see get_counters.
+        With drop_if_full=False write_buffer waits for a free buffer instead.
+        fsync_policy: 
+        - 'never': Leave it to the operating system.
+        - 'close': When the file is closed.
+        - 'interval': Every fsync_interval_s seconds, and when closed.
+        - 'buffer': After each buffer. Slow on SD cards.
+    """
+    def __init__(self, file_path=None,
+                 channels = 1,
+                 samp_width = 2,
+                 sampling_freq = 384000,
+                 frame_rate = 38400,
+                 time_expanded = False,
+                 buffer_size = 384000, # Samples in each preallocated buffer.
+                 number_of_buffers = 8, # Max buffers waiting to be written.
+                 drop_if_full = True, # False: Wait for a free buffer. Blocks the caller.
+                 fsync_policy = 'close', # 'never', 'close', 'interval' or 'buffer'.
+                 fsync_interval_s = 10.0,
+                ):
+        """ """
+        super().__init__(file_path=file_path,
+                         channels=channels,
+                         samp_width=samp_width,
+                         sampling_freq=sampling_freq,
+                         frame_rate=frame_rate,
+                         time_expanded=time_expanded)
+        if samp_width != 2:
+            raise UserWarning('Only 16 bits samples are supported.')
+        if fsync_policy not in ['never', 'close', 'interval', 'buffer']:
+            raise UserWarning("Invalid fsync_policy. Use 'never', 'close', 'interval' or 'buffer'.")
+        self.buffer_size = buffer_size
+        self.number_of_buffers = number_of_buffers
+        self.drop_if_full = drop_if_full
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_s = fsync_interval_s
+        self._file = None
+        self._thread = None
+        self._error = None
+        # Buffers are moved between the free queue and the write queue.
+        self._free_queue = queue.Queue()
+        self._write_queue = queue.Queue()
+        for _index in range(number_of_buffers):
+            self._free_queue.put(np.empty(buffer_size, dtype=np.int16))
+        self._scaled = np.empty(buffer_size, dtype=np.float64) # Used by the caller thread.
+        self.written_buffers = 0
+        self.dropped_buffers = 0
+        self.dropped_samples = 0
+
+    def get_counters(self):
+        """ Returns (written_buffers, dropped_buffers, dropped_samples) since open. """
+        return self.written_buffers, self.dropped_buffers, self.dropped_samples
+
+    def open(self, file_path=None):
+        """ """
+        if file_path is not None:
+            self.file_path = file_path
+        #
+        if self.wave_file is not None:
+            self.close()
+        #
+        if self.time_expanded:
+            self.frame_rate = int(self.sampling_freq / 10)
+        #
+        self._error = None
+        self.written_buffers = 0
+        self.dropped_buffers = 0
+        self.dropped_samples = 0
+        self._file = open(self.file_path, 'wb')
+        self.wave_file = wave.open(self._file, 'wb')
+        self.wave_file.setnchannels(self.channels)
+        self.wave_file.setsampwidth(self.samp_width)
+        self.wave_file.setframerate(self.frame_rate)
+        #
+        self._thread = threading.Thread(target=self._write_exec, args=[], daemon=True)
+        self._thread.start()
+
+    def write_buffer(self, signal):
+        """ Signal in the interval [-1.0, 1.0], or int16. Returns when the signal 
+            is copied to the internal buffers, not when it is written. """
+        if self.wave_file is None:
+            self.open()
+        self._check_error()
+        #
+        signal = np.asarray(signal)
+        for start in range(0, len(signal), self.buffer_size):
+            part = signal[start:start + self.buffer_size]
+            try:
+                buffer = self._free_queue.get(block=not self.drop_if_full)
+            except queue.Empty:
+                self.dropped_buffers += 1
+                self.dropped_samples += len(part)
+                continue # Skip.
+            length = len(part)
+            if signal.dtype == np.int16:
+                buffer[:length] = part
+            else:
+                # Convert from signal in the interval [-1.0, 1.0] to int16.
+                scaled = self._scaled[:length]
+                np.multiply(part, 32767, out=scaled)
+                np.clip(scaled, -32768, 32767, out=scaled)
+                buffer[:length] = scaled # Truncated, as in WaveFileWriter.
+            self._write_queue.put((buffer, length))
+
+    def flush(self):
+        """ Waits until all buffers are written. """
+        self._write_queue.join()
+        self._check_error()
+
+    def close(self):
+        """ Writes remaining buffers before the file is closed. """
+        if self.wave_file is None:
+            return
+        self._write_queue.put(None) # Terminate.
+        self._thread.join()
+        self._thread = None
+        try:
+            self.wave_file.close() # Updates the header.
+            if self.fsync_policy != 'never':
+                self._fsync()
+        finally:
+            self._file.close()
+            self._file = None
+            self.wave_file = None
+        self._check_error()
+
+    def _fsync(self):
+        """ """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _check_error(self):
+        """ Errors in the I/O thread are raised in the caller thread. """
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise UserWarning('Failed to write wave file: ' + str(error))
+
+    def _write_exec(self):
+        """ I/O thread. """
+        last_fsync = time.monotonic()
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                self._write_queue.task_done()
+                return # Terminated.
+            buffer, length = item
+            try:
+                if self._error is None:
+                    self.wave_file.writeframes(buffer[:length])
+                    if self.fsync_policy == 'buffer':
+                        self._fsync()
+                    elif self.fsync_policy == 'interval':
+                        if (time.monotonic() - last_fsync) >= self.fsync_interval_s:
+                            self._fsync()
+                            last_fsync = time.monotonic()
+                    self.written_buffers += 1
+            except Exception as e:
+                self._error = e
+            finally:
+                self._free_queue.put(buffer)
+                self._write_queue.task_done()
+
 class WurbFileUtils(object):
     """ Class for sound file management. """
     
@@ -161,42 +347,42 @@ class WurbFileUtils(object):
         """ """
         return self._soundfiles_df
     
-#     def find_sound_files(self, dir_path='.', recursive=False, wurb_files_only=False):
-#         """ Pandas dataframe is used to store found files. """
-#         path_list = []
-#         # Search for wave files. 
-#         if recursive:
-#             path_list.append(list(pathlib.Path(dir_path).glob('**/*.wav')))
-#             path_list.append(list(pathlib.Path(dir_path).glob('**/*.WAV')))
-#         else:
-#             path_list.append(list(pathlib.Path(dir_path).glob('*.wav')))
-#             path_list.append(list(pathlib.Path(dir_path).glob('*.WAV')))
-#         #
-#         path_list = sorted(path_list)
-#             
-#         # Extract metadata from file name and populate dataframe.    
-#         data = []
-# #         for filepath in path_list[0]:
-#         for filepath in path_list[1]:
-#             meta_dict = self.extract_metadata(filepath)
-#             if (wurb_files_only is False) or \
-#                (meta_dict.get('wurb_format', False) is True):
-#                 #
-#                 data_row = []
-#                 for key in self._columns:
-#                     data_row.append(meta_dict.get(key, ''))
-#                 #
-#                 data.append(data_row)
-# 
-#         # Create dataframe.    
-#         self._soundfiles_df = pd.DataFrame(data, columns=self._columns)
-#         self._soundfiles_df.reset_index()
+    def find_sound_files(self, dir_path='.', recursive=False, wurb_files_only=False):
+        """ Pandas dataframe is used to store found files. """
+        import pandas as pd # Only needed here.
+        # Search for wave files. 
+        if recursive:
+            path_list = list(pathlib.Path(dir_path).glob('**/*.wav'))
+            path_list += list(pathlib.Path(dir_path).glob('**/*.WAV'))
+        else:
+            path_list = list(pathlib.Path(dir_path).glob('*.wav'))
+            path_list += list(pathlib.Path(dir_path).glob('*.WAV'))
+        # Both patterns may match the same files on case insensitive file systems.
+        path_list = sorted(set(path_list))
+            
+        # Extract metadata from file name and populate dataframe.    
+        data = []
+        for filepath in path_list:
+            meta_dict = self.extract_metadata(filepath)
+            if (wurb_files_only is False) or \
+               (meta_dict.get('wurb_format', False) is True):
+                #
+                data_row = []
+                for key in self._columns:
+                    data_row.append(meta_dict.get(key, ''))
+                #
+                data.append(data_row)
+
+        # Create dataframe.    
+        self._soundfiles_df = pd.DataFrame(data, columns=self._columns)
+        self._soundfiles_df.reset_index()
 
     def extract_metadata(self, filepath):
         """ Used to extract file name parts from sound files created by CloudedBats-WURB.
             Format: <recorder-id>_<time>_<position>_<rec-type>_<comments>.wav
             Example: wurb1_20170611T005215+0200_N57.6548E12.6711_TE384_Mdau-in-tandem.wav
         """
+        import dateutil.parser # Only loaded when used.
         meta_dict = {}
         path = pathlib.Path(filepath)
         
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import time
+import socket
+import pathlib
+import threading
+import multiprocessing
+
+class FileLeaseQueue():
+    """ Work queue for several scanners, on one or more machines, sharing
+        batfiles_dir and scanning_results_dir. Only a shared directory is
+        needed, for example NFS or SMB. No message broker. For each wave file:
+        - "<file name>.lease": Claim. Created with O_CREAT | O_EXCL, so only
+          one worker can create it. Contains worker id, host and pid as JSON.
+        - Heartbeats: Leases are touched every heartbeat_s by a background
+          thread. A lease not touched for lease_s has expired and the worker
+          is assumed to be dead.
+        - Re-claim: An expired lease is first renamed to a name unique for the
+          worker. Only one worker can do that. Then a new lease is created.
+        - "<file name>.done": Written when the file is scanned, also if it
+          failed. The error is stored in the file.
+        Lease age is calculated from modification times set by the file
+        server, also for the current time, so clocks on the machines do not
+        need to be in sync. If a worker is slow, not dead, a file may be
+        scanned twice. The same results are then written twice.
+    """
+    def __init__(self,
+                 queue_dir,
+                 worker_id=None, # Unique for each worker. None: Host name and pid.
+                 lease_s=60.0, # Leases not touched this long have expired.
+                 heartbeat_s=None, # None: lease_s / 4.
+                 event_callback=None, # Called as event_callback(event, **kwargs).
+                 ):
+        """ """
+        self.queue_dir = pathlib.Path(queue_dir)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        if worker_id is None:
+            worker_id = socket.gethostname() + '-' + str(os.getpid())
+        self.worker_id = str(worker_id).replace(os.sep, '_')
+        self.lease_s = lease_s
+        self.heartbeat_s = heartbeat_s if heartbeat_s is not None else lease_s / 4
+        self.event_callback = event_callback
+        self._leases = {} # Lease path: File path. Held by this worker.
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat_thread = None
+
+    def lease_path(self, file_path):
+        """ """
+        return self.queue_dir / (pathlib.Path(file_path).name + '.lease')
+
+    def done_path(self, file_path):
+        """ """
+        return self.queue_dir / (pathlib.Path(file_path).name + '.done')
+
+    def is_done(self, file_path):
+        """ """
+        return self.done_path(file_path).exists()
+
+    def shared_time(self):
+        """ Current time on the file server, as the modification time of a
+            file touched by this worker. """
+        clock_path = self.queue_dir / ('.clock_' + self.worker_id)
+        clock_path.touch()
+        os.utime(str(clock_path), None)
+        return clock_path.stat().st_mtime
+
+    def claim(self, file_path):
+        """ Returns True if the file is claimed by this worker. Expired leases
+            held by other workers are re-claimed. """
+        if self.is_done(file_path):
+            return False
+        lease_path = self.lease_path(file_path)
+        if not self._create_lease(lease_path, file_path):
+            if not self._remove_expired(lease_path, file_path):
+                return False
+            if not self._create_lease(lease_path, file_path):
+                return False
+        if self.is_done(file_path): # Finished by another worker before the claim.
+            self._remove_own_lease(lease_path)
+            return False
+        with self._lock:
+            self._leases[str(lease_path)] = str(file_path)
+        return True
+
+    def release(self, file_path, done=True, error=None):
+        """ Marks the file as done and removes the lease. With done=False the
+            lease is only removed, and the file can be claimed again. """
+        if done:
+            done_path = self.done_path(file_path)
+            temp_path = done_path.with_name(done_path.name + '.' + self.worker_id + '.tmp')
+            with temp_path.open('w') as done_file:
+                json.dump({'worker': self.worker_id, 'file': str(file_path), 'error': error}, done_file)
+            os.replace(str(temp_path), str(done_path)) # Atomic.
+        lease_path = self.lease_path(file_path)
+        with self._lock:
+            self._leases.pop(str(lease_path), None)
+        self._remove_own_lease(lease_path)
+
+    def claim_files(self, file_paths, poll_interval_s=5.0):
+        """ Yields files claimed by this worker until all files are done. Files
+            leased by other workers are tried again after poll_interval_s, and
+            re-claimed when their leases have expired. release must be called
+            for each yielded file. """
+        remaining = [str(file_path) for file_path in file_paths]
+        while remaining:
+            waiting = []
+            for file_path in remaining:
+                if self.is_done(file_path):
+                    continue
+                if self.claim(file_path):
+                    yield file_path
+                else:
+                    waiting.append(file_path)
+            remaining = [file_path for file_path in waiting if not self.is_done(file_path)]
+            if remaining:
+                time.sleep(poll_interval_s)
+
+    def get_status(self, file_paths):
+        """ Number of files that are done, leased, expired and open. """
+        status = {'done': 0, 'leased': 0, 'expired': 0, 'open': 0}
+        now = self.shared_time()
+        for file_path in file_paths:
+            if self.is_done(file_path):
+                status['done'] += 1
+                continue
+            try:
+                age = now - self.lease_path(file_path).stat().st_mtime
+            except FileNotFoundError:
+                status['open'] += 1
+                continue
+            status['expired' if age >= self.lease_s else 'leased'] += 1
+        return status
+
+    def start_heartbeat(self):
+        """ Touches all leases held by this worker every heartbeat_s. """
+        self._stop_event.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_exec, daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        """ """
+        self._stop_event.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def heartbeat(self):
+        """ One heartbeat. Leases taken over by another worker are dropped. """
+        with self._lock:
+            leases = dict(self._leases)
+        for lease_path, file_path in leases.items():
+            if self._read_lease(lease_path).get('worker') != self.worker_id:
+                with self._lock:
+                    self._leases.pop(lease_path, None)
+                self._report('lease_lost', file=file_path, worker=self.worker_id)
+                continue
+            try:
+                os.utime(lease_path, None) # File server time.
+            except FileNotFoundError:
+                pass # Removed after the check. Found in next heartbeat.
+
+    def _heartbeat_exec(self):
+        """ """
+        while not self._stop_event.wait(self.heartbeat_s):
+            self.heartbeat()
+
+    def _create_lease(self, lease_path, file_path):
+        """ Atomic. Returns False if the lease exists. """
+        try:
+            lease_fd = os.open(str(lease_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(lease_fd, 'w') as lease_file:
+            json.dump({'worker': self.worker_id, 'host': socket.gethostname(),
+                       'pid': os.getpid(), 'file': str(file_path)}, lease_file)
+        return True
+
+    def _remove_expired(self, lease_path, file_path):
+        """ Returns True if the lease was expired and is removed by this worker,
+            or if it was released. """
+        try:
+            age = self.shared_time() - lease_path.stat().st_mtime
+        except FileNotFoundError:
+            return True # Released.
+        if age < self.lease_s:
+            return False
+        stale_path = lease_path.with_name(lease_path.name + '.' + self.worker_id + '.stale')
+        try:
+            os.rename(str(lease_path), str(stale_path))
+        except FileNotFoundError:
+            return False # Another worker was first.
+        previous = self._read_lease(stale_path)
+        # A new lease may have been created between the age check and the rename.
+        if self.shared_time() - stale_path.stat().st_mtime < self.lease_s:
+            try:
+                os.rename(str(stale_path), str(lease_path))
+            except OSError:
+                pass
+            return False
+        stale_path.unlink()
+        self._report('lease_reclaimed', file=str(file_path),
+                     previous_worker=previous.get('worker'), worker=self.worker_id)
+        return True
+
+    def _remove_own_lease(self, lease_path):
+        """ """
+        if self._read_lease(lease_path).get('worker') == self.worker_id:
+            try:
+                os.remove(str(lease_path))
+            except FileNotFoundError:
+                pass
+
+    def _read_lease(self, lease_path):
+        """ Lease content, or an empty dict if missing or not written yet. """
+        try:
+            with open(str(lease_path)) as lease_file:
+                return json.load(lease_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _report(self, event, **kwargs):
+        """ """
+        if self.event_callback is not None:
+            self.event_callback(event, **kwargs)
+
+
+def _local_worker(scanner_settings, scan_settings, queue_settings):
+    """ Runs in a separate process. """
+    import dsp4bats
+    scanner = dsp4bats.BatfilesScanner(**scanner_settings)
+    scanner.scan_shared(scan_settings=scan_settings, **queue_settings)
+
+def run_local_workers(workers=2, scanner_settings=None, scan_settings=None,
+                      lease_s=60.0, poll_interval_s=5.0):
+    """ Local stand-in for several machines, for testing. Starts workers
+        processes, each with its own BatfilesScanner using scan_shared on the
+        same directories. scanner_settings are parameters to BatfilesScanner,
+        scan_settings to scan_files. Returns the exit codes. """
+    processes = []
+    for worker_number in range(workers):
+        queue_settings = {'worker_id': 'local-' + str(worker_number),
+                          'lease_s': lease_s, 'poll_interval_s': poll_interval_s}
+        process = multiprocessing.Process(target=_local_worker,
+                                          args=(scanner_settings or {}, scan_settings, queue_settings))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    import tempfile
+    print('Test started.')
+    data_dir = pathlib.Path(__file__).parent.parent / 'data' / 'batfiles'
+    wave_files = sorted(data_dir.glob('*.wav'))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results_dir = pathlib.Path(temp_dir, 'results')
+        # A dead worker: Lease on the first file, not touched for a long time.
+        dead_queue = FileLeaseQueue(results_dir / 'work_queue', worker_id='dead', lease_s=2.0)
+        dead_queue.claim(wave_files[0])
+        old_time = dead_queue.shared_time() - 10.0
+        os.utime(str(dead_queue.lease_path(wave_files[0])), (old_time, old_time))
+        print('Before: ', dead_queue.get_status(wave_files))
+        #
+        start_time = time.monotonic()
+        exit_codes = run_local_workers(workers=2,
+                                       scanner_settings={'batfiles_dir': str(data_dir),
+                                                         'scanning_results_dir': str(results_dir)},
+                                       lease_s=2.0, poll_interval_s=0.2)
+        print('Exit codes: ', exit_codes, '  time (s): ', round(time.monotonic() - start_time, 2))
+        print('After: ', dead_queue.get_status(wave_files))
+        for done_path in sorted((results_dir / 'work_queue').glob('*.done')):
+            print(done_path.name, '  by: ', json.loads(done_path.read_text())['worker'])
+        print('Metrics files: ', len(list(results_dir.glob('*_Metrics.txt'))))
+    print('Test ended.')
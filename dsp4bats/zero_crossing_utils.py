@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2017-2018 Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import numpy as np
+
+class ZeroCrossingUtil():
+    """ Zero Crossing (ZC) analysis in time domain. Mainly used on filtered signals.
+        Works like classic ZC detectors: One output "dot" for each group of
+        "division_ratio" signal cycles. The frequency of a dot is calculated
+        from the duration of the group.
+    """
+    def __init__(self,
+                 sampling_freq=384000,
+                 division_ratio=8,
+                 ):
+        """ """
+        self.sampling_freq = sampling_freq
+        self.division_ratio = division_ratio
+
+    def zero_crossings(self, signal):
+        """ Positive-going zero crossings as fractional sample positions.
+            Linear interpolation between the two samples around each crossing. """
+        signal = np.asarray(signal)
+        index = np.flatnonzero((signal[:-1] < 0.0) & (signal[1:] >= 0.0))
+        y0 = signal[index]
+        y1 = signal[index + 1]
+        return index + y0 / (y0 - y1)
+
+    def zc_dots_header(self):
+        """ Same columns as for DbfsSpectrumUtil.chirp_shape. """
+        return ['time_s', 'frequency_hz', 'amplitude_dbfs', 'signal_index']
+
+    def zc_dots_dtype(self):
+        """ """
+        return np.dtype([('time_s', np.float64),
+                         ('frequency_hz', np.float64),
+                         ('amplitude_dbfs', np.float64),
+                         ('signal_index', np.int64)])
+
+    def zc_dots(self, signal,
+                threshold=0.0, # Min peak amplitude for a cycle. Range: [0.0, 1.0].
+                min_freq_hz=None,
+                max_freq_hz=None,
+                start_index=0, # Added to signal_index. Used for buffers and parts of signals.
+                as_list=False):
+        """ Returns ZC dots for the signal as a structured array with the columns
+            in zc_dots_header(), or a list of rows if as_list is True.
+            Only groups of consecutive cycles above threshold are used. """
+        signal = np.asarray(signal)
+        dots = np.empty(0, dtype=self.zc_dots_dtype())
+        crossings = self.zero_crossings(signal)
+        if len(crossings) <= self.division_ratio:
+            return self._dots_as_list(dots) if as_list else dots
+        # Peak amplitude for each cycle, from one crossing to the next.
+        crossing_index = crossings.astype(np.int64)
+        abs_signal = np.abs(signal)
+        cycle_peak = np.maximum.reduceat(abs_signal, crossing_index)[:-1]
+        valid = cycle_peak >= threshold
+        # Position in each run of consecutive valid cycles.
+        cycles = np.arange(len(valid))
+        run_start = np.maximum.accumulate(np.where(valid, 0, cycles + 1))
+        position = cycles - run_start
+        # Last cycle in each complete group.
+        group_end = np.flatnonzero(valid & ((position + 1) % self.division_ratio == 0))
+        group_start = group_end - self.division_ratio + 1
+        # Frequency from group duration.
+        start_pos = crossings[group_start]
+        end_pos = crossings[group_end + 1]
+        frequency_hz = self.division_ratio * self.sampling_freq / (end_pos - start_pos)
+        # Amplitude as max cycle peak in group.
+        if len(group_end) > 0:
+            reduce_index = np.column_stack((group_start, group_end + 1)).ravel()
+            group_peak = np.maximum.reduceat(np.append(cycle_peak, 0.0), reduce_index)[::2]
+        else:
+            group_peak = np.empty(0)
+        with np.errstate(divide='ignore'):
+            amplitude_dbfs = 20 * np.log10(group_peak)
+        # Limits.
+        keep = np.ones(len(group_end), dtype=bool)
+        if min_freq_hz is not None:
+            keep &= frequency_hz >= min_freq_hz
+        if max_freq_hz is not None:
+            keep &= frequency_hz <= max_freq_hz
+        # Dots are placed at the end of each group.
+        signal_index = start_index + np.round(end_pos[keep]).astype(np.int64)
+        dots = np.empty(int(keep.sum()), dtype=self.zc_dots_dtype())
+        dots['time_s'] = np.round((start_index + end_pos[keep]) / self.sampling_freq, 5)
+        dots['frequency_hz'] = np.round(frequency_hz[keep], 0)
+        dots['amplitude_dbfs'] = np.round(amplitude_dbfs[keep], 1)
+        dots['signal_index'] = signal_index
+        #
+        return self._dots_as_list(dots) if as_list else dots
+
+    def chirp_shape(self, signal, peak_position,
+                    start_index=None,
+                    stop_index=None,
+                    max_size_s=0.016, # Used when start or stop is not given.
+                    threshold=0.0,
+                    min_freq_hz=None,
+                    max_freq_hz=None,
+                    as_array=False): # True: Structured array instead of a list of rows.
+        """ ZC alternative to DbfsSpectrumUtil.chirp_shape. Same result columns,
+            but only calculated where the signal is above threshold. """
+        half_size = int(max_size_s * self.sampling_freq / 2)
+        if start_index is None:
+            start_index = peak_position - half_size
+        if stop_index is None:
+            stop_index = peak_position + half_size
+        start_index = max(int(start_index), 0)
+        stop_index = min(int(stop_index), len(signal))
+        #
+        return self.zc_dots(signal[start_index:stop_index],
+                            threshold=threshold,
+                            min_freq_hz=min_freq_hz,
+                            max_freq_hz=max_freq_hz,
+                            start_index=start_index,
+                            as_list=not as_array)
+
+    def _dots_as_list(self, dots):
+        """ """
+        return [[row['time_s'], row['frequency_hz'], row['amplitude_dbfs'], int(row['signal_index'])]
+                for row in dots]
+
+
+# === TEST ===
+if __name__ == "__main__":
+    """ """
+    print('Test started.')
+    sampling_freq = 384000
+    time = np.arange(0, int(sampling_freq * 0.005)) / sampling_freq
+    signal = 0.5 * np.sin(2 * np.pi * 45000 * time) + np.random.randn(len(time)) * 0.001
+    zc_util = ZeroCrossingUtil(sampling_freq=sampling_freq, division_ratio=8)
+    dots = zc_util.zc_dots(signal, threshold=0.01)
+    print('Number of dots: ', len(dots), '  mean freq (Hz): ', np.mean(dots['frequency_hz']))
+    print('Test ended.')
@@ -16,4 +16,9 @@ setup(name='dsp4bats',
         'scipy', 
         'python-dateutil', 
     ],
+    entry_points={
+        'console_scripts': [
+            'dsp4bats=dsp4bats.cli:main',
+        ],
+    },
     zip_safe=False)
\ No newline at end of file